@@ -383,6 +383,31 @@ CELERY_TASK_SOFT_TIME_LIMIT = int(_environ.get('CELERYD_TASK_SOFT_TIME_LIMIT', 6
 
 CELERY_BROKER_POOL_LIMIT = int(_environ.get('BROKER_POOL_LIMIT', 10))
 
+# Builds and GitHub pulls can be given their own workers by naming a queue for each.
+CELERY_TASK_ROUTES = {
+    'ide.tasks.build.run_compile': {'queue': _environ.get('CELERY_BUILD_QUEUE', 'celery')},
+    'ide.tasks.git.hooked_commit': {'queue': _environ.get('CELERY_GIT_QUEUE', 'celery')},
+}
+
+CELERY_BEAT_SCHEDULE = {
+    'collect-unreferenced-blobs': {
+        'task': 'ide.tasks.blobs.collect_unreferenced_blobs',
+        'schedule': 3600,
+    },
+    'sweep-orphaned-blob-contents': {
+        'task': 'ide.tasks.blobs.sweep_orphaned_blob_contents',
+        'schedule': 24 * 3600,
+    },
+    'prune-exports': {
+        'task': 'ide.tasks.archive.prune_exports',
+        'schedule': 3600,
+    },
+    'sweep-autosaves': {
+        'task': 'ide.tasks.autosave.sweep_autosaves',
+        'schedule': 300,
+    },
+}
+
 LOGIN_REDIRECT_URL = '/ide/'
 
 LOGIN_URL = '/#login'
@@ -397,6 +422,42 @@ EXPORT_DIRECTORY = os.getcwd() + '/user_data/export/'
 
 EXPORT_ROOT = _environ.get('EXPORT_ROOT', PUBLIC_URL.rstrip('/') + '/export/')
 
+# How long, in seconds, an unchanged project's export is handed out again rather than rebuilt.
+EXPORT_CACHE_TTL = int(_environ.get('EXPORT_CACHE_TTL', 24 * 3600))
+# How long, in seconds, an export is kept after its project changes, so that downloads already handed out finish.
+EXPORT_SUPERSEDED_GRACE = int(_environ.get('EXPORT_SUPERSEDED_GRACE', 15 * 60))
+
+# How many projects an account export packs at once.
+ACCOUNT_EXPORT_CONCURRENCY = int(_environ.get('ACCOUNT_EXPORT_CONCURRENCY', 8))
+
+# How build and export downloads are served:
+# 'stream' streams them through the web worker in chunks,
+# 'accel' hands local files off to nginx with X-Accel-Redirect (local storage only),
+# 'redirect' redirects to a presigned URL (S3 storage only).
+ARTIFACT_DOWNLOAD_MODE = _environ.get('ARTIFACT_DOWNLOAD_MODE', 'stream')
+# An nginx 'internal' location aliased to FILE_STORAGE, used when ARTIFACT_DOWNLOAD_MODE is 'accel'.
+ARTIFACT_ACCEL_REDIRECT_PREFIX = _environ.get('ARTIFACT_ACCEL_REDIRECT_PREFIX', '/protected/')
+
+# Editor autosaves are buffered in Redis and written to storage once a file has been quiet for AUTOSAVE_FLUSH_DELAY
+# seconds, or at most AUTOSAVE_MAX_FLUSH_DELAY seconds after the first unwritten save. A periodic sweep queues the
+# flush again if its task is lost, and buffered saves which still never get flushed expire after AUTOSAVE_BUFFER_TTL
+# seconds.
+AUTOSAVE_BUFFER_ENABLED = 'AUTOSAVE_BUFFER_DISABLED' not in _environ and not TESTING
+AUTOSAVE_FLUSH_DELAY = int(_environ.get('AUTOSAVE_FLUSH_DELAY', 10))
+AUTOSAVE_MAX_FLUSH_DELAY = int(_environ.get('AUTOSAVE_MAX_FLUSH_DELAY', 60))
+AUTOSAVE_BUFFER_TTL = int(_environ.get('AUTOSAVE_BUFFER_TTL', 7 * 24 * 3600))
+
+# How long, in seconds, the serialised files and resources of each revision of a project are kept for project_info.
+PROJECT_INFO_CACHE_TTL = int(_environ.get('PROJECT_INFO_CACHE_TTL', 24 * 3600))
+
+# Projects with at least this many source files keep a packed snapshot of them in S3, so that builds, exports and
+# pushes can fetch every source file with one request. 0 disables snapshots.
+SOURCE_SNAPSHOT_MIN_FILES = int(_environ.get('SOURCE_SNAPSHOT_MIN_FILES', 20))
+
+# File contents are stored once per distinct content. Blobs nothing refers to are kept for this many seconds before
+# being deleted, so that a blob released and then immediately reused is not deleted in between.
+BLOB_GC_GRACE_PERIOD = int(_environ.get('BLOB_GC_GRACE_PERIOD', 24 * 3600))
+
 # Cloud Dev Connection / legacy GitHub auth app
 GITHUB_DEV_CLIENT_ID = _environ.get('GITHUB_DEV_CLIENT_ID', _environ.get('GITHUB_ID', ''))
 GITHUB_DEV_CLIENT_SECRET = _environ.get('GITHUB_DEV_CLIENT_SECRET', _environ.get('GITHUB_SECRET', ''))
@@ -407,6 +468,25 @@ GITHUB_SYNC_CLIENT_SECRET = _environ.get('GITHUB_SYNC_CLIENT_SECRET', '')
 
 GITHUB_HOOK_TEMPLATE = _environ.get('GITHUB_HOOK', PUBLIC_URL.rstrip('/') + '/ide/project/%(project)d/github/push_hook?key=%(key)s')
 
+# How many blobs a push creates on GitHub at once.
+GITHUB_BLOB_CONCURRENCY = int(_environ.get('GITHUB_BLOB_CONCURRENCY', 4))
+
+# Push hooks wait this many seconds before pulling, so that pushes in quick succession are pulled together.
+GITHUB_HOOK_DELAY = int(_environ.get('GITHUB_HOOK_DELAY', 5))
+
+GITHUB_API_URL = _environ.get('GITHUB_API_URL', 'https://api.github.com')
+# How long, in seconds, a GitHub token is trusted after it was last checked.
+GITHUB_TOKEN_CACHE_TTL = int(_environ.get('GITHUB_TOKEN_CACHE_TTL', 300))
+# How long, in seconds, GitHub API responses are kept for conditional requests.
+GITHUB_CACHE_TTL = int(_environ.get('GITHUB_CACHE_TTL', 24 * 3600))
+
+# Imported gists are cached for GIST_CACHE_TTL seconds, and used without asking GitHub whether they have changed for
+# GIST_CACHE_FRESH seconds.
+GIST_CACHE_TTL = int(_environ.get('GIST_CACHE_TTL', 7 * 24 * 3600))
+GIST_CACHE_FRESH = int(_environ.get('GIST_CACHE_FRESH', 300))
+# Raw gist files bigger than this many bytes are fetched each time rather than being kept in Redis.
+GIST_RAW_CACHE_MAX_SIZE = int(_environ.get('GIST_RAW_CACHE_MAX_SIZE', 64 * 1024))
+
 SDK2_PEBBLE_WAF = _environ.get('SDK2_PEBBLE_WAF', '/sdk2/pebble/waf')
 SDK3_PEBBLE_WAF = _environ.get('SDK3_PEBBLE_WAF', '/sdk3/pebble/waf')
 
@@ -422,6 +502,19 @@ MAILCHIMP_API_KEY = _environ.get('MAILCHIMP_API_KEY', None)
 MAILCHIMP_LIST_ID = _environ.get('MAILCHIMP_LIST_ID', None)
 
 AWS_ENABLED = 'AWS_ENABLED' in _environ
+# Where source files, builds and exports are kept: 's3', 'local' or 'memory'. Defaults to 's3' if AWS_ENABLED is set
+# and 'local' otherwise. See utils/storage.py.
+STORAGE_BACKEND = _environ.get('STORAGE_BACKEND', None)
+# A dictionary of bucket name -> directory for the local backend. None uses FILE_STORAGE, MEDIA_ROOT and EXPORT_DIRECTORY.
+LOCAL_STORAGE_ROOTS = None
+# How each kind of text object is compressed at rest: 'gzip', or None to store it as-is. Objects written before a
+# kind was compressed are still read correctly.
+_compression = None if 'STORAGE_COMPRESSION_DISABLED' in _environ else 'gzip'
+STORAGE_COMPRESSION = {
+    'source': _compression,
+    'build_log': _compression,
+    'debug_info': _compression,
+}
 AWS_ACCESS_KEY_ID = _environ.get('AWS_ACCESS_KEY_ID', None)
 AWS_SECRET_ACCESS_KEY = _environ.get('AWS_SECRET_ACCESS_KEY', None)
 
@@ -432,6 +525,15 @@ AWS_S3_HOST = _environ.get('AWS_S3_HOST', None)
 AWS_S3_FAKE_S3 = _environ.get('AWS_S3_FAKE_S3', None) or None
 AWS_S3_ENDPOINT_URL = _environ.get('AWS_S3_ENDPOINT_URL', None) or None
 
+# Bulk S3 operations share one client connection pool; keep it at least as large as the concurrency.
+AWS_S3_MAX_CONCURRENCY = int(_environ.get('AWS_S3_MAX_CONCURRENCY', 16))
+AWS_S3_MAX_POOL_CONNECTIONS = int(_environ.get('AWS_S3_MAX_POOL_CONNECTIONS', max(AWS_S3_MAX_CONCURRENCY, 10)))
+AWS_S3_MAX_ATTEMPTS = int(_environ.get('AWS_S3_MAX_ATTEMPTS', 5))
+# Uploads larger than the threshold are sent as multipart uploads, several parts at a time.
+AWS_S3_MULTIPART_THRESHOLD = int(_environ.get('AWS_S3_MULTIPART_THRESHOLD', 16 * 1024 * 1024))
+AWS_S3_MULTIPART_CHUNKSIZE = int(_environ.get('AWS_S3_MULTIPART_CHUNKSIZE', 16 * 1024 * 1024))
+AWS_S3_MULTIPART_CONCURRENCY = int(_environ.get('AWS_S3_MULTIPART_CONCURRENCY', 8))
+
 TYPOGRAPHY_CSS = _environ.get('TYPOGRAPHY_CSS', None)
 
 LIBPEBBLE_PROXY = _environ.get('LIBPEBBLE_PROXY', 'wss://cloudpebble-proxy.repebble.com/tool')
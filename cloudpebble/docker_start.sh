@@ -31,6 +31,10 @@ if [ ! -z "$RUN_WEB" ]; then
 elif [ ! -z "$RUN_CELERY" ]; then
 	sleep 2
 	C_FORCE_ROOT=true /usr/local/bin/celery -A cloudpebble worker --loglevel=info
+elif [ ! -z "$RUN_BEAT" ]; then
+	# Exactly one beat process may run, or every periodic task is queued once per copy.
+	sleep 2
+	/usr/local/bin/celery -A cloudpebble beat --loglevel=info --schedule=/tmp/celerybeat-schedule
 else
 	echo "Doing nothing!"
 	exit 1
@@ -7,6 +7,7 @@ from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
 from django.views.decorators.http import require_POST, require_safe
 from ide.models.project import Project
+from ide.utils.progress import PROGRESS_STATE
 
 __author__ = 'katharine'
 
@@ -76,12 +77,13 @@ def proxy_keen(request, project_id):
 @require_safe
 def check_task(request, task_id):
     result = AsyncResult(task_id)
-    return json_response({
-        'state': {
-            'status': result.status,
-            'result': result.result if result.status == 'SUCCESS' else str(result.result)
-        }
-    })
+    state = {
+        'status': result.status,
+        'result': result.result if result.status == 'SUCCESS' else str(result.result)
+    }
+    if result.status == PROGRESS_STATE:
+        state['progress'] = result.info
+    return json_response({'state': state})
 
 
 @require_POST
@@ -1,5 +1,6 @@
 import re
 import json
+import hashlib
 import time
 import logging
 import os
@@ -8,22 +9,30 @@ import uuid as uuid_module
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.db import transaction, IntegrityError
+from django.db.models import OuterRef, Subquery
 from django.shortcuts import get_object_or_404
 from django.http import HttpResponse
 from django.views.decorators.http import require_safe, require_POST
+from django.utils.cache import get_conditional_response
+from django.utils.timezone import now
 from django.utils.translation import gettext as _
 
 from ide.models.build import BuildResult
 from ide.models.project import Project, TemplateProject
 from ide.models.files import SourceFile, ResourceFile, PublishedMedia
-from ide.tasks.archive import create_archive, do_import_archive
+from ide.models.s3file import batched_deletes
+from ide.tasks.archive import create_archive, do_import_archive, current_export, export_url
 from ide.tasks.build import run_compile
 from ide.tasks.gist import import_gist
 from ide.tasks.git import do_import_github
+from ide.utils import autosave, uploads
 from ide.utils.alloy_templates import list_alloy_templates, build_template_archive
 from ide.utils.c_templates import list_c_templates, build_c_template_archive
+from ide.utils.pagination import paginate, page_size
+from utils.downloads import serve_artifact, CACHE_IMMUTABLE
+from utils.redis_helper import redis_client
 from utils.td_helper import send_td_event
-from utils.jsonview import json_view, BadRequest
+from utils.jsonview import json_view, json_dumps, BadRequest
 
 __author__ = 'katharine'
 logger = logging.getLogger(__name__)
@@ -403,14 +412,62 @@ Pebble.addEventListener("ready", function(e) {
 """
 
 
+def _timestamp(modified):
+    return time.mktime(modified.utctimetuple())
+
+
+def _project_contents(project):
+    """ Serialise a project's files, resources, dependencies and published media for project_info.
+    Changing any of these bumps the project's last_modified, so the result is cached in Redis against it. Buffered
+    autosaves don't, so the caller must apply them to the source files' lastModified times.
+    """
+    key = 'project-info-{0}-{1}'.format(project.id, project.last_modified.isoformat())
+    cached = redis_client.get(key)
+    if cached is not None:
+        return json.loads(cached)
+    # Going through the related managers lets each file share the project instance, instead of loading its own.
+    source_files = list(project.source_files.order_by('file_name'))
+    resources = list(project.resources.order_by('file_name').prefetch_related('identifiers', 'variants'))
+    contents = {
+        'app_dependencies': project.get_dependencies(include_interdependencies=False),
+        'interdependencies': list(project.project_dependencies.values_list('id', flat=True)),
+        'menu_icon': next((x.id for x in resources if x.is_menu_icon), None),
+        'source_files': [{
+                             'name': f.file_name,
+                             'id': f.id,
+                             'target': f.target,
+                             'file_path': f.project_path,
+                             'is_binary': f.is_binary_source,
+                             'is_editable': f.is_editable_text,
+                             'lastModified': _timestamp(f.last_modified)
+                         } for f in source_files],
+        'resources': [{
+                          'id': x.id,
+                          'file_name': x.file_name,
+                          'kind': x.kind,
+                          'identifiers': [y.resource_id for y in x.identifiers.all()],
+                          'extra': {y.resource_id: y.get_options_dict(with_id=False) for y in x.identifiers.all()},
+                          'variants': [y.get_tags() for y in x.variants.all()],
+                      } for x in resources],
+        'has_embeddedjs': any(f.target == 'embeddedjs' for f in source_files),
+        'published_media': _serialize_published_media(project),
+    }
+    redis_client.set(key, json.dumps(contents), ex=settings.PROJECT_INFO_CACHE_TTL)
+    return contents
+
+
 @require_safe
 @login_required
 @json_view
 def project_info(request, project_id):
     project = get_object_or_404(Project, pk=project_id, owner=request.user)
-    source_files = SourceFile.objects.filter(project=project).order_by('file_name')
-    resources = ResourceFile.objects.filter(project=project).order_by('file_name')
-    return {
+    contents = _project_contents(project)
+    buffered = autosave.modified_times(f['id'] for f in contents['source_files'])
+    for f in contents['source_files']:
+        if f['id'] in buffered:
+            f['lastModified'] = max(f['lastModified'], _timestamp(buffered[f['id']]))
+    info = {
+        'success': True,
         'type': project.project_type,
         'name': project.name,
         'last_modified': str(project.last_modified),
@@ -426,29 +483,9 @@ def project_info(request, project_id):
         'app_is_shown_on_communication': project.app_is_shown_on_communication,
         'app_capabilities': project.app_capabilities,
         'app_jshint': project.app_jshint,
-        'app_dependencies': project.get_dependencies(include_interdependencies=False),
-        'interdependencies': [p.id for p in project.project_dependencies.all()],
         'sdk_version': project.sdk_version,
         'app_platforms': project.app_platforms,
         'app_modern_multi_js': project.app_modern_multi_js,
-        'menu_icon': project.menu_icon.id if project.menu_icon else None,
-        'source_files': [{
-                             'name': f.file_name,
-                             'id': f.id,
-                             'target': f.target,
-                             'file_path': f.project_path,
-                             'is_binary': f.is_binary_source,
-                             'is_editable': f.is_editable_text,
-                             'lastModified': time.mktime(f.last_modified.utctimetuple())
-                         } for f in source_files],
-        'resources': [{
-                          'id': x.id,
-                          'file_name': x.file_name,
-                          'kind': x.kind,
-                          'identifiers': [y.resource_id for y in x.identifiers.all()],
-                          'extra': {y.resource_id: y.get_options_dict(with_id=False) for y in x.identifiers.all()},
-                          'variants': [y.get_tags() for y in x.variants.all()],
-                      } for x in resources],
         'github': {
             'repo': "github.com/%s" % project.github_repo if project.github_repo is not None else None,
             'branch': project.github_branch if project.github_branch is not None else None,
@@ -458,9 +495,17 @@ def project_info(request, project_id):
             'auto_pull': project.github_hook_uuid is not None
         },
         'supported_platforms': project.supported_platforms,
-        'has_embeddedjs': project.has_embeddedjs_files,
-        'published_media': _serialize_published_media(project),
     }
+    info.update(contents)
+    # The editor asks for this whenever a project is opened, so let it revalidate with a cheap 304.
+    content = json_dumps(info)
+    etag = '"%s"' % hashlib.md5(content.encode('utf-8')).hexdigest()
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
 
 
 @require_POST
@@ -473,7 +518,7 @@ def compile_project(request, project_id):
     return {"build_id": build.id, "task_id": task.task_id}
 
 
-def _serialize_build(build, project):
+def _serialize_build(build, project, with_sizes=True):
     if getattr(settings, 'AWS_S3_ENDPOINT_URL', None):
         download_file = 'package.tar.gz' if project.project_type == 'package' else 'watchface.pbw'
         download = '/ide/project/%d/build/%d/download/%s' % (project.id, build.id, download_file)
@@ -481,7 +526,7 @@ def _serialize_build(build, project):
     else:
         download = build.package_url if project.project_type == 'package' else build.pbw_url
         log = build.build_log_url
-    return {
+    data = {
         'uuid': build.uuid,
         'state': build.state,
         'started': str(build.started),
@@ -490,8 +535,19 @@ def _serialize_build(build, project):
         'download': download,
         'log': log,
         'build_dir': build.get_url(),
-        'sizes': build.get_sizes(),
     }
+    if with_sizes:
+        data['sizes'] = build.get_sizes()
+    return data
+
+
+def _builds_with_sizes(request, builds):
+    """ Apply the '?sizes=0' option, which polling clients can use to omit builds' sizes.
+    :return: A tuple of (queryset, whether to include sizes). Sizes are prefetched in a single query.
+    """
+    if request.GET.get('sizes') == '0':
+        return builds, False
+    return builds.prefetch_related('sizes'), True
 
 
 @require_safe
@@ -499,29 +555,27 @@ def _serialize_build(build, project):
 @json_view
 def last_build(request, project_id):
     project = get_object_or_404(Project, pk=project_id, owner=request.user)
-    try:
-        build = project.builds.order_by('-started')[0]
-    except (IndexError, BuildResult.DoesNotExist):
+    builds, with_sizes = _builds_with_sizes(request, project.builds.order_by('-started', '-id'))
+    build = builds.first()
+    if build is None:
         return {"build": None}
-    else:
-        b = _serialize_build(build, project)
-        return {"build": b}
+    return {"build": _serialize_build(build, project, with_sizes)}
 
 
 @require_safe
 @login_required
 @json_view
 def build_history(request, project_id):
+    """ Gets a project's builds, newest first. At most '?limit=' builds are returned, 10 by default, along with a 'next'
+    cursor to pass as '?cursor=' to get older builds. """
     project = get_object_or_404(Project, pk=project_id, owner=request.user)
-    try:
-        builds = project.builds.order_by('-started')[:10]
-    except (IndexError, BuildResult.DoesNotExist):
-        return {"build": None}
-
-    out = []
-    for build in builds:
-        out.append(_serialize_build(build, project))
-    return {"builds": out}
+    builds, with_sizes = _builds_with_sizes(request, project.builds.all())
+    builds, next_cursor = paginate(builds, '-started', cursor=request.GET.get('cursor'),
+                                   limit=page_size(request.GET.get('limit'), default=10))
+    return {
+        "builds": [_serialize_build(build, project, with_sizes) for build in builds],
+        "next": next_cursor
+    }
 
 
 @require_safe
@@ -547,8 +601,9 @@ def build_log(request, project_id, build_id):
 @json_view
 def build_info(request, project_id, build_id):
     project = get_object_or_404(Project, pk=project_id, owner=request.user)
-    build = get_object_or_404(BuildResult, project=project, pk=build_id)
-    return {"build": _serialize_build(build, project)}
+    builds, with_sizes = _builds_with_sizes(request, BuildResult.objects.filter(project=project))
+    build = get_object_or_404(builds, pk=build_id)
+    return {"build": _serialize_build(build, project, with_sizes)}
 
 
 DOWNLOAD_CONTENT_TYPES = {
@@ -561,22 +616,19 @@ DOWNLOAD_CONTENT_TYPES = {
 @login_required
 def build_download(request, project_id, build_id, filename):
     """Proxy build artifact downloads from S3/R2 to avoid CORS issues."""
-    import utils.s3 as s3
     project = get_object_or_404(Project, pk=project_id, owner=request.user)
     build = get_object_or_404(BuildResult, project=project, pk=build_id)
 
     if filename == 'watchface.pbw':
-        s3_path = build.pbw
+        path = build.pbw
     elif filename == 'package.tar.gz':
-        s3_path = build.package
+        path = build.package
     else:
         return HttpResponse(status=404)
 
     content_type = DOWNLOAD_CONTENT_TYPES.get(filename, 'application/octet-stream')
-    data = s3.read_file('builds', s3_path)
-    response = HttpResponse(data, content_type=content_type)
-    response['Content-Disposition'] = 'attachment; filename="%s"' % filename
-    return response
+    return serve_artifact(request, 'builds', path, content_type=content_type, filename=filename,
+                          cache_control='private, ' + CACHE_IMMUTABLE)
 
 
 @require_safe
@@ -584,23 +636,7 @@ def build_download(request, project_id, build_id, filename):
 def export_download(request, export_key):
     filename = os.path.basename(export_key) or 'cloudpebble-export.zip'
 
-    if settings.AWS_ENABLED:
-        import utils.s3 as s3
-        data = s3.read_file('export', export_key)
-        response = HttpResponse(data, content_type='application/zip')
-        response['Content-Disposition'] = 'attachment; filename="%s"' % filename
-        return response
-
-    export_root = os.path.abspath(settings.EXPORT_DIRECTORY)
-    export_path = os.path.abspath(os.path.join(export_root, export_key))
-    if not export_path.startswith(export_root + os.sep):
-        return HttpResponse(status=404)
-    if not os.path.exists(export_path):
-        return HttpResponse(status=404)
-    with open(export_path, 'rb') as f:
-        response = HttpResponse(f.read(), content_type='application/zip')
-    response['Content-Disposition'] = 'attachment; filename="%s"' % filename
-    return response
+    return serve_artifact(request, 'export', export_key, content_type='application/zip', filename=filename)
 
 
 @require_POST
@@ -776,6 +812,7 @@ def save_project_settings(request, project_id):
                 old_icon.is_menu_icon = False
                 old_icon.save()
 
+            project.last_modified = now()
             project.save()
     except IntegrityError as e:
         return BadRequest(str(e))
@@ -790,7 +827,8 @@ def regenerate_uuid(request, project_id):
     project = get_object_or_404(Project, pk=project_id, owner=request.user)
     new_uuid = str(uuid_module.uuid4())
     project.app_uuid = new_uuid
-    project.save(update_fields=['app_uuid'])
+    project.last_modified = now()
+    project.save(update_fields=['app_uuid', 'last_modified'])
     return {'uuid': new_uuid}
 
 
@@ -894,7 +932,8 @@ def delete_project(request, project_id):
     project = get_object_or_404(Project, pk=project_id, owner=request.user)
     if not bool(request.POST.get('confirm', False)):
         raise BadRequest(_("Not confirmed"))
-    project.delete()
+    with batched_deletes():
+        project.delete()
     send_td_event('cloudpebble_delete_project', request=request, project=project)
 
 
@@ -903,10 +942,16 @@ def delete_project(request, project_id):
 @json_view
 def begin_export(request, project_id):
     project = get_object_or_404(Project, pk=project_id, owner=request.user)
+    export = current_export(project)
+    if export is not None:
+        return {'url': export_url(export.key)}
     result = create_archive.delay(project.id)
     return {'task_id': result.task_id}
 
 
+PROJECT_SORT_FIELDS = {'id', 'name', 'last_modified'}
+
+
 @login_required
 @require_safe
 @json_view
@@ -916,6 +961,10 @@ def get_projects(request):
     Accepts one possible filter: '?libraries=[id]'. If given, the list of projects
     is limited to packages, and each returned package includes a 'depended_on' attribute
     which is true if it is depended on by the project where pk=[id].
+
+    The list is sorted by '?sort=', which may be 'id', 'name' or 'last_modified', optionally prefixed with '-' to
+    reverse it. If '?limit=' is given, at most that many projects are returned, along with a 'next' cursor to pass as
+    '?cursor=' to get the next page.
     """
     filters = {
         'owner': request.user
@@ -927,10 +976,19 @@ def get_projects(request):
     if libraries_for_project:
         filters['project_type'] = 'package'
         parent_project = get_object_or_404(Project, pk=libraries_for_project, owner=request.user)
-        parent_project_dependencies = parent_project.project_dependencies.all()
+        parent_project_dependencies = set(parent_project.project_dependencies.values_list('id', flat=True))
         exclusions['pk'] = libraries_for_project
 
-    projects = Project.objects.filter(**filters).exclude(**exclusions)
+    sort = request.GET.get('sort', 'id')
+    if sort.lstrip('-') not in PROJECT_SORT_FIELDS:
+        raise BadRequest(_("Invalid sort order."))
+
+    latest_successful_build = BuildResult.objects.filter(
+        project=OuterRef('pk'), state=BuildResult.STATE_SUCCEEDED).order_by('-id').values('finished')[:1]
+    projects = Project.objects.filter(**filters).exclude(**exclusions).annotate(
+        latest_successful_build=Subquery(latest_successful_build))
+    projects, next_cursor = paginate(projects, sort, cursor=request.GET.get('cursor'),
+                                     limit=page_size(request.GET.get('limit')))
 
     def process_project(project):
         data = {
@@ -940,16 +998,15 @@ def get_projects(request):
             'app_version_label': project.app_version_label,
             'latest_successful_build': None
         }
-        try:
-            data['latest_successful_build'] = str(BuildResult.objects.filter(project=project, state=BuildResult.STATE_SUCCEEDED).latest('id').finished)
-        except BuildResult.DoesNotExist:
-            pass
+        if project.latest_successful_build is not None:
+            data['latest_successful_build'] = str(project.latest_successful_build)
         if parent_project:
-            data['depended_on'] = project in parent_project_dependencies
+            data['depended_on'] = project.id in parent_project_dependencies
         return data
 
     return {
-        'projects': [process_project(project) for project in projects]
+        'projects': [process_project(project) for project in projects],
+        'next': next_cursor
     }
 
 
@@ -967,7 +1024,9 @@ def import_zip(request):
         project = Project.objects.create(owner=request.user, name=name, sdk_version=sdk)
     except IntegrityError as e:
         raise BadRequest(str(e))
-    task = do_import_archive.delay(project.id, zip_file.read(), delete_project=True)
+    # Only the staged archive's key goes through the broker.
+    task = do_import_archive.delay(project.id, uploads.stage_archive(zip_file.chunks()), delete_project=True,
+                                   staged=True)
 
     return {'task_id': task.task_id, 'project_id': project.id}
 
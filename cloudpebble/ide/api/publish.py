@@ -14,7 +14,7 @@ from ide.models.build import BuildResult
 from ide.models.project import Project
 from utils.jsonview import json_view, BadRequest
 
-import utils.s3 as s3
+from utils.storage import get_storage
 
 logger = logging.getLogger(__name__)
 
@@ -302,11 +302,7 @@ def publish_submit(request, project_id):
 
 def _read_pbw(build, project):
     """Read PBW binary data from storage."""
-    if settings.AWS_ENABLED:
-        return s3.read_file('builds', build.pbw)
-    else:
-        with open(build.pbw, 'rb') as f:
-            return f.read()
+    return get_storage().read('builds', build.pbw)
 
 
 def _normalize_pbw_uuid(pbw_data, target_uuid):
@@ -1,17 +1,16 @@
 import json
 import os
-from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.db import transaction, IntegrityError
-from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import get_object_or_404
 from django.utils.translation import gettext as _
 from django.views.decorators.http import require_POST, require_safe
 from ide.models.project import Project
 from ide.models.files import ResourceFile, ResourceIdentifier, ResourceVariant
+from ide.utils import uploads
 from utils.td_helper import send_td_event
 from utils.jsonview import json_view, BadRequest
-import utils.s3 as s3
+from utils.downloads import serve_artifact
 
 __author__ = 'katharine'
 
@@ -44,12 +43,19 @@ def create_resource(request, project_id):
     kind = request.POST['kind']
     resource_ids = json.loads(request.POST['resource_ids'])
     posted_file = request.FILES.get('file', None)
+    upload_token = request.POST.get('upload_token', None)
     file_name = request.POST['file_name']
     if kind == 'font':
         ext = os.path.splitext(file_name)[1].lower()
         if ext not in ('.ttf', '.otf'):
             raise BadRequest(_("Font resources must have a .ttf or .otf file extension."))
     new_tags = json.loads(request.POST['new_tags'])
+    staged = None
+    if posted_file is None and upload_token:
+        try:
+            staged = uploads.claim_upload(upload_token, request.user, project, kind=kind)
+        except uploads.UploadError as e:
+            raise BadRequest(str(e))
     resources = []
     try:
         with transaction.atomic():
@@ -60,10 +66,16 @@ def create_resource(request, project_id):
             if posted_file is not None:
                 variant = ResourceVariant.objects.create(resource_file=rf, tags=",".join(str(int(t)) for t in new_tags))
                 variant.save_file(posted_file, file_size=posted_file.size)
+            elif staged is not None:
+                variant = ResourceVariant.objects.create(resource_file=rf, tags=",".join(str(int(t)) for t in new_tags))
+                variant.save_staged(staged)
 
             rf.save()
     except IntegrityError as e:
         raise BadRequest(e)
+    finally:
+        if staged is not None:
+            uploads.discard_upload(staged)
 
     send_td_event('cloudpebble_create_file', data={
         'data': {
@@ -246,15 +258,6 @@ def show_resource(request, project_id, resource_id, variant):
         u'font': 'application/octet-stream',
         u'raw': 'application/octet-stream'
     }
-    content_disposition = "attachment; filename=\"%s\"" % resource.file_name
-    content_type = content_types[resource.kind]
-    if settings.AWS_ENABLED:
-        headers = {
-            'response-content-disposition': content_disposition,
-            'Content-Type': content_type
-        }
-        return HttpResponseRedirect(s3.get_signed_url('source', variant.s3_path, headers=headers))
-    else:
-        response = HttpResponse(open(variant.local_filename), content_type=content_type)
-        response['Content-Disposition'] = content_disposition
-        return response
+    # Variants can be replaced in place, so browsers must revalidate; the ETag makes that a cheap 304.
+    return serve_artifact(request, 'source', variant.storage_key, content_type=content_types[resource.kind],
+                          filename=resource.file_name, cache_control='private, no-cache')
@@ -9,6 +9,7 @@ from django.views.decorators.http import require_POST, require_safe
 from django.utils.translation import gettext as _
 from ide.models.project import Project
 from ide.models.files import SourceFile
+from ide.utils import autosave, uploads
 from utils.td_helper import send_td_event
 from utils.jsonview import json_view, BadRequest
 
@@ -70,6 +71,7 @@ def create_source_file(request, project_id):
 def load_source_file(request, project_id, file_id):
     project = get_object_or_404(Project, pk=project_id, owner=request.user)
     source_file = get_object_or_404(SourceFile, pk=file_id, project=project)
+    autosave.overlay(source_file)
 
     content = source_file.get_contents()
     read_only = not source_file.is_editable_text
@@ -105,6 +107,7 @@ def load_source_file(request, project_id, file_id):
 def source_file_is_safe(request, project_id, file_id):
     project = get_object_or_404(Project, pk=project_id, owner=request.user)
     source_file = get_object_or_404(SourceFile, pk=file_id, project=project)
+    autosave.overlay(source_file)
     client_modified = datetime.datetime.fromtimestamp(int(request.GET["modified"]))
     server_modified = source_file.last_modified.replace(tzinfo=None, microsecond=0)
     is_safe = client_modified >= server_modified
@@ -117,6 +120,7 @@ def source_file_is_safe(request, project_id, file_id):
 def rename_source_file(request, project_id, file_id):
     project = get_object_or_404(Project, pk=project_id, owner=request.user)
     source_file = get_object_or_404(SourceFile, pk=file_id, project=project)
+    autosave.overlay(source_file)
     old_filename = source_file.file_name
 
     if source_file.file_name != request.POST["old_name"]:
@@ -170,6 +174,7 @@ def save_source_file(request, project_id, file_id):
     source_file = get_object_or_404(SourceFile, pk=file_id, project=project)
     if not source_file.is_editable_text:
         raise BadRequest(_("Cannot save binary source files from the editor."))
+    autosave.overlay(source_file)
     if source_file.was_modified_since(int(request.POST["modified"])):
         send_td_event(
             "cloudpebble_save_abort_unsafe",
@@ -178,8 +183,11 @@ def save_source_file(request, project_id, file_id):
             project=project,
         )
         raise Exception(_("Could not save: file has been modified since last save."))
-    source_file.save_text(request.POST["content"])
-    source_file.save_lines(folded_lines=request.POST["folded_lines"])
+    if autosave.enabled():
+        autosave.buffer_save(source_file, request.POST["content"], request.POST["folded_lines"])
+    else:
+        source_file.save_text(request.POST["content"])
+        source_file.save_lines(folded_lines=request.POST["folded_lines"])
 
     send_td_event(
         "cloudpebble_save_file",
@@ -215,10 +223,16 @@ def create_binary_source_file(request, project_id):
             )
 
     posted_file = request.FILES.get("file", None)
+    upload_token = request.POST.get("upload_token", None)
+    staged = None
     if posted_file is None:
-        raise BadRequest(_("No file was uploaded."))
-
-    if posted_file.size > 5 * 1024 * 1024:
+        if not upload_token:
+            raise BadRequest(_("No file was uploaded."))
+        try:
+            staged = uploads.claim_upload(upload_token, request.user, project)
+        except uploads.UploadError as e:
+            raise BadRequest(str(e))
+    elif posted_file.size > 5 * 1024 * 1024:
         raise BadRequest(_("File is too large (max 5MB)."))
 
     try:
@@ -226,9 +240,15 @@ def create_binary_source_file(request, project_id):
             project=project, file_name=file_name, target=target
         )
         # Save as binary data
-        f.save_string(posted_file.read())
+        if staged is not None:
+            f.save_staged(staged)
+        else:
+            f.save_string(posted_file.read())
     except IntegrityError as e:
         raise BadRequest(str(e))
+    finally:
+        if staged is not None:
+            uploads.discard_upload(staged)
 
     send_td_event(
         "cloudpebble_create_file",
@@ -0,0 +1,34 @@
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import get_object_or_404
+from django.utils.translation import gettext as _
+from django.views.decorators.http import require_POST
+
+from ide.models.project import Project
+from ide.utils import uploads
+from utils.jsonview import json_view, BadRequest
+from utils.storage import get_storage
+
+
+@require_POST
+@login_required
+@json_view
+def request_upload(request, project_id):
+    project = get_object_or_404(Project, pk=project_id, owner=request.user)
+    return {'upload': uploads.request_upload(request.user, project)}
+
+
+@require_POST
+@login_required
+@json_view
+def upload_staged(request, token):
+    """ Accept a staged upload for storage backends which can't take one directly from the browser. """
+    try:
+        key = uploads.staged_key(token, request.user)
+    except uploads.UploadError as e:
+        raise BadRequest(str(e))
+    posted_file = request.FILES.get('file', None)
+    if posted_file is None:
+        raise BadRequest(_("No file was uploaded."))
+    if posted_file.size > uploads.MAX_UPLOAD_SIZE:
+        raise BadRequest(_("File is too large (max 5MB)."))
+    get_storage().upload_stream(uploads.BUCKET_NAME, key, posted_file.chunks())
@@ -10,6 +10,8 @@ from django.views.decorators.http import require_POST
 from urllib.parse import urlparse
 
 from ide.models.project import Project
+from ide.models.snapshot import read_project_contents
+from ide.utils import autosave
 from utils.jsonview import json_view
 
 __author__ = 'katharine'
@@ -22,13 +24,15 @@ logger = logging.getLogger(__name__)
 @json_view
 def init_autocomplete(request, project_id):
     project = get_object_or_404(Project, pk=project_id, owner=request.user)
+    autosave.flush_project(project)
     source_files = project.source_files.all()
 
+    text_files = [f for f in source_files if f.is_editable_text]
+    contents = read_project_contents(project, text_files)
+
     file_contents = {}
-    for f in source_files:
-        if not f.is_editable_text:
-            continue
-        content = f.get_contents()
+    for f in text_files:
+        content = contents[f]
         # Ensure content is string, not bytes
         if isinstance(content, bytes):
             content = content.decode('utf-8')
@@ -1,14 +1,22 @@
+import hashlib
 import json
+from urllib.parse import quote
 from urllib.request import urlopen, Request
 from urllib.error import URLError, HTTPError
 import re
 import logging
 
-from github import Github, BadCredentialsException, UnknownObjectException
+from github import Github, BadCredentialsException, UnknownObjectException, GithubException
+from github.Branch import Branch
+from github.GitCommit import GitCommit
+from github.GitTree import GitTree
 from github.NamedUser import NamedUser
+from github.Repository import Repository
+from django.conf import settings
 from django.utils.translation import gettext as _
 
 from ide.models.user import UserGithubRepoSync
+from utils.redis_helper import redis_client
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +32,7 @@ def git_auth_check(f):
             try:
                 logger.warning("Bad credentials; revoking user's GitHub Repo Sync tokens.")
                 github = user.github_repo_sync
+                forget_token(github.token)
                 github.delete()
             except:
                 pass
@@ -32,27 +41,106 @@ def git_auth_check(f):
     return g
 
 
+def _token_hash(token):
+    # Tokens are hashed so that they never appear in Redis keys.
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def _token_key(token):
+    return 'github-token-valid-%s' % _token_hash(token)
+
+
+def forget_token(token):
+    """ Stop treating a token as valid without checking it with GitHub. """
+    if token is not None:
+        redis_client.delete(_token_key(token))
+
+
 def git_verify_tokens(user):
+    """ Check that the user's GitHub token works. Valid tokens are remembered for GITHUB_TOKEN_CACHE_TTL seconds. """
     try:
         token = user.github_repo_sync.token
     except UserGithubRepoSync.DoesNotExist:
         return False
     if token is None:
         return False
+    if redis_client.get(_token_key(token)) is not None:
+        return True
 
-    r = Request('https://api.github.com/user')
+    r = Request(settings.GITHUB_API_URL + '/user')
     r.add_header("Authorization", "token %s" % token)
     try:
         urlopen(r).read()
     except HTTPError as e:
         if e.getcode() == 401:
+            forget_token(token)
             user.github_repo_sync.delete()
         return False
+    redis_client.set(_token_key(token), 1, ex=settings.GITHUB_TOKEN_CACHE_TTL)
     return True
 
 
 def get_github(user):
-    return Github(user.github_repo_sync.token)
+    return Github(user.github_repo_sync.token, base_url=settings.GITHUB_API_URL)
+
+
+class CachingGithub(object):
+    """ Looks up a user's repositories, branches, commits and trees with conditional GETs, keeping each response
+    and its ETag in Redis for GITHUB_CACHE_TTL seconds. GitHub answers a request for something which hasn't changed
+    with a 304, which doesn't count against the rate limit. Commits and trees are looked up by SHA, so they never
+    change, and cached copies are used without asking GitHub at all.
+    Cached copies are kept per token, so no user is ever shown something cached for another.
+    Anything else should be done with the PyGithub client in github, which the returned objects also use.
+    """
+
+    def __init__(self, user):
+        self.token = user.github_repo_sync.token
+        self.github = get_github(user)
+
+    def _get(self, path, immutable=False):
+        key = 'github-get-%s-%s' % (_token_hash(self.token), path)
+        cached = redis_client.get(key)
+        cached = json.loads(cached) if cached is not None else None
+        if cached is not None and immutable:
+            return cached['body']
+        r = Request(settings.GITHUB_API_URL + path)
+        r.add_header("Authorization", "token %s" % self.token)
+        r.add_header("Accept", "application/vnd.github+json")
+        if cached is not None:
+            r.add_header("If-None-Match", cached['etag'])
+        try:
+            response = urlopen(r)
+        except HTTPError as e:
+            if e.code == 304 and cached is not None:
+                redis_client.set(key, json.dumps(cached), ex=settings.GITHUB_CACHE_TTL)
+                return cached['body']
+            if e.code == 401:
+                forget_token(self.token)
+                raise BadCredentialsException(e.code, None, dict(e.headers))
+            if e.code == 404:
+                raise UnknownObjectException(e.code, None, dict(e.headers))
+            raise GithubException(e.code, None, dict(e.headers))
+        body = json.loads(response.read())
+        etag = response.headers.get('ETag')
+        if etag is not None:
+            redis_client.set(key, json.dumps({'etag': etag, 'body': body}), ex=settings.GITHUB_CACHE_TTL)
+        return body
+
+    def get_repo(self, full_name):
+        return self.github.create_from_raw_data(Repository, self._get('/repos/%s' % full_name))
+
+    def get_branch(self, repo, branch_name):
+        return self.github.create_from_raw_data(Branch, self._get('/repos/%s/branches/%s' % (repo.full_name,
+                                                                                               quote(branch_name))))
+
+    def get_git_commit(self, repo, sha):
+        return self.github.create_from_raw_data(GitCommit, self._get('/repos/%s/git/commits/%s' % (repo.full_name, sha),
+                                                                     immutable=True))
+
+    def get_git_tree(self, repo, sha):
+        """ :return: The tree with the given SHA, with its subtrees expanded """
+        return self.github.create_from_raw_data(GitTree, self._get('/repos/%s/git/trees/%s?recursive=1' %
+                                                                   (repo.full_name, sha), immutable=True))
 
 
 def check_repo_access(user, repo):
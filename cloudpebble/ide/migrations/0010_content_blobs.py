@@ -0,0 +1,37 @@
+# Generated by Django 4.2.11 on 2026-10-19 13:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ide', '0009_alter_project_project_type_alter_publishedmedia_name_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentBlob',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('size', models.IntegerField()),
+                ('refcount', models.IntegerField(default=0)),
+                ('released', models.DateTimeField(blank=True, db_index=True, null=True)),
+            ],
+            options={
+                'db_table': 'cloudpebble_content_blobs',
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='resourcevariant',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='ide.contentblob'),
+        ),
+        migrations.AddField(
+            model_name='sourcefile',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='ide.contentblob'),
+        ),
+    ]
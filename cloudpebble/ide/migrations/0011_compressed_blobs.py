@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-19 13:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ide', '0010_content_blobs'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='contentblob',
+            name='sha256',
+            field=models.CharField(max_length=70, primary_key=True, serialize=False),
+        ),
+    ]
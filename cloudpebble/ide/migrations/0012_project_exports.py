@@ -0,0 +1,30 @@
+# Generated by Django 4.2.11 on 2026-10-19 13:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ide', '0011_compressed_blobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectExport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('revision', models.DateTimeField()),
+                ('version', models.PositiveIntegerField()),
+                ('key', models.CharField(max_length=255)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exports', to='ide.project')),
+            ],
+            options={
+                'db_table': 'cloudpebble_project_exports',
+                'abstract': False,
+                'unique_together': {('project', 'revision', 'version')},
+            },
+        ),
+    ]
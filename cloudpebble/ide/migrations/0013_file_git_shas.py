@@ -0,0 +1,23 @@
+# Generated by Django 4.2.11 on 2026-10-19 13:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ide', '0012_project_exports'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resourcevariant',
+            name='git_sha',
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='sourcefile',
+            name='git_sha',
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+    ]
@@ -1,8 +1,5 @@
 import uuid as uuid_module
 import json
-import shutil
-import os
-import os.path
 from django.conf import settings
 from django.db import models
 from ide.models.project import Project
@@ -11,7 +8,7 @@ from django.utils.translation import gettext_lazy as _
 from ide.models.meta import IdeModel
 from ide.utils.regexes import regexes
 
-import utils.s3 as s3
+from utils.storage import get_storage, encode, decode
 __author__ = 'katharine'
 
 
@@ -50,19 +47,13 @@ class BuildResult(IdeModel):
     finished = models.DateTimeField(blank=True, null=True)
 
     def _get_dir(self):
-        if settings.AWS_ENABLED:
+        if not get_storage().is_local:
             return '%s/' % self.uuid
         else:
-            path = '%s%s/%s/%s/' % (settings.MEDIA_ROOT, self.uuid[0], self.uuid[1], self.uuid)
-            if not os.path.exists(path):
-                os.makedirs(path)
-            return path
+            return '%s/%s/%s/' % (self.uuid[0], self.uuid[1], self.uuid)
 
     def get_url(self):
-        if settings.AWS_ENABLED:
-            return "%s%s/" % (settings.MEDIA_URL, self.uuid)
-        else:
-            return '%s%s/%s/%s/' % (settings.MEDIA_URL, self.uuid[0], self.uuid[1], self.uuid)
+        return '%s%s' % (settings.MEDIA_URL, self._get_dir())
 
     @property
     def pbw(self):
@@ -95,50 +86,32 @@ class BuildResult(IdeModel):
     def get_debug_info_filename(self, platform, kind):
         return self._get_dir() + self.DEBUG_INFO_MAP[platform][kind]
 
+    @classmethod
+    def may_be_compressed(cls, filename):
+        """ Whether a build artifact with this file name may have been compressed at rest. """
+        return filename == 'build_log.txt' or filename.endswith('debug_info.json')
+
     def save_build_log(self, text):
-        if not settings.AWS_ENABLED:
-            with open(self.build_log, 'w') as f:
-                f.write(text)
-        else:
-            s3.save_file('builds', self.build_log, text, public=True, content_type='text/plain')
+        data, encoding = encode(text, 'build_log')
+        get_storage().write('builds', self.build_log, data, public=True, content_type='text/plain', content_encoding=encoding)
 
     def read_build_log(self):
-        if not settings.AWS_ENABLED:
-            with open(self.build_log, 'r') as f:
-                return f.read()
-        else:
-            data = s3.read_file('builds', self.build_log)
-            if isinstance(data, bytes):
-                data = data.decode('utf-8', errors='replace')
-            return data
+        data = decode(get_storage().read('builds', self.build_log))
+        return data.decode('utf-8', errors='replace')
 
     def save_debug_info(self, json_info, platform, kind):
-        text = json.dumps(json_info)
-        if not settings.AWS_ENABLED:
-            with open(self.get_debug_info_filename(platform, kind), 'w') as f:
-                f.write(text)
-        else:
-            s3.save_file('builds', self.get_debug_info_filename(platform, kind), text, public=True, content_type='application/json')
+        data, encoding = encode(json.dumps(json_info), 'debug_info')
+        get_storage().write('builds', self.get_debug_info_filename(platform, kind), data, public=True, content_type='application/json', content_encoding=encoding)
 
     def save_package(self, package_path):
-        if not settings.AWS_ENABLED:
-            shutil.move(package_path, self.package)
-        else:
-            filename = '%s.tar.gz' % self.project.app_short_name.replace('/', '-')
-            s3.upload_file('builds', self.package, package_path, public=True, download_filename=filename, content_type='application/gzip')
+        filename = '%s.tar.gz' % self.project.app_short_name.replace('/', '-')
+        get_storage().upload('builds', self.package, package_path, public=True, download_filename=filename, content_type='application/gzip')
 
     def save_pbw(self, pbw_path):
-        if not settings.AWS_ENABLED:
-            shutil.move(pbw_path, self.pbw)
-        else:
-            s3.upload_file('builds', self.pbw, pbw_path, public=True, download_filename='%s.pbw' % self.project.app_short_name.replace('/','-'))
+        get_storage().upload('builds', self.pbw, pbw_path, public=True, download_filename='%s.pbw' % self.project.app_short_name.replace('/','-'))
 
     def save_simplyjs(self, javascript):
-        if not settings.AWS_ENABLED:
-            with open(self.simplyjs, 'w') as f:
-                f.write(javascript)
-        else:
-            s3.save_file('builds', self.simplyjs, javascript, public=True, content_type='text/javascript')
+        get_storage().write('builds', self.simplyjs, javascript, public=True, content_type='text/javascript')
 
     class Meta(IdeModel.Meta):
         db_table = 'cloudpebble_build_results'
@@ -0,0 +1,55 @@
+"""
+Cached single-project exports.
+
+Users tend to export a project repeatedly without changing it in between, so each archive create_archive uploads is
+recorded against the project's last_modified time and the version of the archive layout it was built with. Exporting
+the project again before it changes hands back the existing archive. Records (and their archives) are pruned by the
+prune_exports task once they're older than EXPORT_CACHE_TTL, or superseded and older than EXPORT_SUPERSEDED_GRACE, so
+that a download which has only just been handed out still works.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils.timezone import now
+
+from ide.models.meta import IdeModel
+from ide.models.s3file import delete_object
+
+
+class ProjectExport(IdeModel):
+    project = models.ForeignKey('Project', related_name='exports', on_delete=models.CASCADE)
+    revision = models.DateTimeField()
+    version = models.PositiveIntegerField()
+    key = models.CharField(max_length=255)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta(IdeModel.Meta):
+        db_table = 'cloudpebble_project_exports'
+        unique_together = (('project', 'revision', 'version'),)
+
+    @classmethod
+    def expiry_cutoff(cls):
+        return now() - timedelta(seconds=settings.EXPORT_CACHE_TTL)
+
+    @classmethod
+    def superseded_cutoff(cls):
+        return now() - timedelta(seconds=settings.EXPORT_SUPERSEDED_GRACE)
+
+    @classmethod
+    def lookup(cls, project, version):
+        """ Find a current export of a project.
+        :param project: A Project, freshly loaded so that its last_modified time is up to date
+        :param version: The archive layout version the export must have been built with
+        :return: A ProjectExport, or None if there isn't one
+        """
+        return cls.objects.filter(project=project, revision=project.last_modified, version=version,
+                                  created__gte=cls.expiry_cutoff()).first()
+
+
+@receiver(post_delete, sender=ProjectExport)
+def delete_export_archive(sender, instance, **kwargs):
+    # Keep the archive if the deletion rolls back, as the record would still hand it out.
+    delete_object('export', instance.key)
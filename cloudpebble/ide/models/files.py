@@ -9,10 +9,11 @@ from django.utils.translation import gettext as _
 from django.core.validators import RegexValidator, ValidationError
 from django.utils.translation import gettext_lazy as _
 
-from ide.models.s3file import S3File
+from ide.models.s3file import S3File, copy_many_to_paths
 from ide.models.textfile import TextFile
 from ide.models.meta import IdeModel
 from ide.utils.regexes import regexes
+from ide.utils import autosave
 
 __author__ = 'katharine'
 
@@ -51,8 +52,11 @@ class ResourceFile(IdeModel):
     def get_identifiers(self):
         return ResourceIdentifier.objects.filter(resource_file=self)
 
-    def copy_all_variants_to_dir(self, path):
+    def get_variant_targets_in_dir(self, path):
+        """ Get a list of (variant, absolute path) tuples giving where each variant belongs in the directory path,
+        creating any intermediate directories. """
         filename_parts = os.path.splitext(self.file_name)
+        targets = []
         for variant in self.variants.all():
             abs_target = "%s/%s%s%s" % (path, filename_parts[0], variant.get_tags_string(), filename_parts[1])
             if not abs_target.startswith(path):
@@ -60,7 +64,11 @@ class ResourceFile(IdeModel):
             abs_target_dir = os.path.dirname(abs_target)
             if not os.path.exists(abs_target_dir):
                 os.makedirs(abs_target_dir)
-            variant.copy_to_path(abs_target)
+            targets.append((variant, abs_target))
+        return targets
+
+    def copy_all_variants_to_dir(self, path):
+        copy_many_to_paths(self.get_variant_targets_in_dir(path))
 
     def save(self, *args, **kwargs):
         self.clean_fields()
@@ -384,6 +392,20 @@ class SourceFile(TextFile):
         except KeyError:
             Exception("Invalid file type in project")
 
+    def get_contents(self):
+        entry = autosave.get_entry(self.id)
+        if entry is not None:
+            return entry['content']
+        return super(SourceFile, self).get_contents()
+
+    def save_string(self, string):
+        # Anything written directly supersedes what the editor has buffered.
+        autosave.discard(self.id)
+        super(SourceFile, self).save_string(string)
+        # Bump last_modified even when the row itself isn't saved, so that project snapshots notice the change.
+        self.last_modified = now()
+        SourceFile.objects.filter(pk=self.pk).update(last_modified=self.last_modified)
+
     def clean(self):
         super(SourceFile, self).clean()
         if self.project and self.target:
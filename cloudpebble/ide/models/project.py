@@ -4,11 +4,15 @@ import json
 
 from django.contrib.auth.models import User
 from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 from django.core.exceptions import ValidationError
 
-from ide.models.files import ResourceFile, ResourceIdentifier, SourceFile, ResourceVariant
+from ide.models.files import ResourceFile, ResourceIdentifier, SourceFile, ResourceVariant, PublishedMedia
 from ide.models.dependency import Dependency
+from ide.models.snapshot import read_project_contents
 from ide.models.meta import IdeModel
 from ide.utils import generate_half_uuid
 from ide.utils.regexes import regexes
@@ -266,6 +270,33 @@ class Project(IdeModel):
         return u"%s" % self.name
 
 
+# Saving files and resources already bumps their project's last_modified time, which cached exports are keyed on.
+# These catch the remaining changes to a project's contents.
+@receiver([post_save, post_delete], sender=Dependency)
+@receiver([post_save, post_delete], sender=PublishedMedia)
+@receiver(post_delete, sender=SourceFile)
+@receiver(post_delete, sender=ResourceFile)
+def touch_project(sender, instance, **kwargs):
+    Project.objects.filter(pk=instance.project_id).update(last_modified=now())
+
+
+@receiver(post_delete, sender=ResourceVariant)
+@receiver(post_delete, sender=ResourceIdentifier)
+def touch_resource_project(sender, instance, **kwargs):
+    Project.objects.filter(resources__pk=instance.resource_file_id).update(last_modified=now())
+
+
+@receiver(m2m_changed, sender=Project.project_dependencies.through)
+def touch_dependent_project(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        if pk_set:
+            Project.objects.filter(pk__in=pk_set).update(last_modified=now())
+    else:
+        Project.objects.filter(pk=instance.pk).update(last_modified=now())
+
+
 class TemplateProject(Project):
     KIND_TEMPLATE = 1
     KIND_SDK_DEMO = 2
@@ -281,11 +312,19 @@ class TemplateProject(Project):
 
     def copy_into_project(self, project):
         uuid_string = ", ".join(["0x%02X" % ord(b) for b in uuid.uuid4().bytes])
-        for resource in self.resources.all():
+        resources = list(self.resources.all())
+        source_files = list(self.source_files.all())
+        variants = [v for r in resources for v in r.variants.all()]
+        # Blob-backed files are copied by reference, so only the rest need to be read.
+        contents = read_project_contents(self, [v for v in variants if v.blob_id is None] + source_files)
+        for resource in resources:
             new_resource = ResourceFile.objects.create(project=project, file_name=resource.file_name, kind=resource.kind)
             for variant in resource.variants.all():
                 new_variant = ResourceVariant.objects.create(resource_file=new_resource, tags=variant.tags)
-                new_variant.save_string(variant.get_contents())
+                if variant.blob_id is not None:
+                    new_variant.share_contents(variant)
+                else:
+                    new_variant.save_string(contents[variant])
             for i in resource.identifiers.all():
                 ResourceIdentifier.objects.create(
                     resource_file=new_resource,
@@ -299,9 +338,13 @@ class TemplateProject(Project):
                     space_optmization=i.space_optimisation
                 )
 
-        for source_file in self.source_files.all():
+        for source_file in source_files:
             new_file = SourceFile.objects.create(project=project, file_name=source_file.file_name)
-            new_file.save_text(source_file.get_contents().replace("__UUID_GOES_HERE__", uuid_string))
+            text = contents[source_file]
+            if source_file.blob_id is not None and "__UUID_GOES_HERE__" not in text:
+                new_file.share_contents(source_file)
+            else:
+                new_file.save_text(text.replace("__UUID_GOES_HERE__", uuid_string))
 
         # Copy over relevant project properties.
         # NOTE: If new, relevant properties are added, they must be copied here.
@@ -1,86 +1,303 @@
-import shutil
-import os
+import gzip
+import hashlib
 import logging
+import threading
+import zlib
+from collections import Counter
+from contextlib import contextmanager
 
 from django.utils.translation import gettext as _
-from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F, ProtectedError
 from django.utils.timezone import now
 from django.db.models.signals import post_delete
 from django.dispatch import receiver
 
-import utils.s3 as s3
 from ide.models.meta import IdeModel
+from ide.utils.git import git_sha as git_sha_for
+from utils.storage import get_storage, ObjectNotFound, compression_for
 
 logger = logging.getLogger(__name__)
 
+_deletion_batch = threading.local()
+
+
+def _decode_contents(data):
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data
+
+
+class ContentBlob(IdeModel):
+    """ A file's contents, stored once under its SHA-256 no matter how many S3Files have those contents.
+    refcount counts the S3Files referring to the blob. Blobs whose refcount has been zero for BLOB_GC_GRACE_PERIOD
+    seconds are removed by the collect_unreferenced_blobs task.
+    Compressed blobs have COMPRESSED_SUFFIX appended to their key, so the same contents stored compressed and
+    uncompressed are separate blobs and a blob's key alone says how to read it. """
+    bucket_name = 'source'
+    COMPRESSED_SUFFIX = '.gz'
+
+    sha256 = models.CharField(max_length=70, primary_key=True)
+    size = models.IntegerField()
+    refcount = models.IntegerField(default=0)
+    released = models.DateTimeField(blank=True, null=True, db_index=True)
+
+    @staticmethod
+    def path_for(sha256):
+        return 'blobs/%s/%s' % (sha256[:2], sha256)
+
+    @classmethod
+    def is_compressed(cls, sha256):
+        return sha256.endswith(cls.COMPRESSED_SUFFIX)
+
+    @classmethod
+    def decode(cls, sha256, data):
+        """ Turn the stored data of a blob back into the contents it was acquired with. """
+        return gzip.decompress(data) if cls.is_compressed(sha256) else data
+
+    def _write(self, data):
+        if self.is_compressed(self.sha256):
+            get_storage().write(self.bucket_name, self.path_for(self.sha256), gzip.compress(data, mtime=0),
+                                content_encoding='gzip')
+        else:
+            get_storage().write(self.bucket_name, self.path_for(self.sha256), data)
+
+    @classmethod
+    def _delete_contents(cls, sha256):
+        # The blob may have been acquired again between its row being deleted and this running.
+        if not cls.objects.filter(pk=sha256).exists():
+            get_storage().delete(cls.bucket_name, cls.path_for(sha256))
+
+    @classmethod
+    def _acquire(cls, sha256, size, write):
+        with transaction.atomic():
+            # The row lock keeps the garbage collector from removing the blob while we take our reference.
+            blob, created = cls.objects.select_for_update().get_or_create(sha256=sha256, defaults={'size': size})
+            if created:
+                write(blob)
+            cls.objects.filter(pk=sha256).update(refcount=F('refcount') + 1)
+        return sha256
+
+    @classmethod
+    def acquire(cls, data, compress=False):
+        """ Take a reference to the blob holding data, uploading it only if no such blob exists yet.
+        :param compress: If True, use a blob which stores data gzip-compressed
+        :return: The blob's key: its SHA-256, plus COMPRESSED_SUFFIX if compressed
+        """
+        sha256 = hashlib.sha256(data).hexdigest()
+        if compress:
+            sha256 += cls.COMPRESSED_SUFFIX
+        return cls._acquire(sha256, len(data), lambda blob: blob._write(data))
+
+    @classmethod
+    def acquire_stored(cls, key, compress=False):
+        """ As acquire(), for contents which are already stored, uncompressed, at key in this bucket. They are hashed
+        (and compressed, if need be) a chunk at a time as they are read back, and an uncompressed blob is made by
+        copying them within storage, so they are never held in memory whole.
+        :return: A tuple of (the blob's key, the contents' git SHA)
+        :raises ObjectNotFound: if there is nothing at key
+        """
+        storage = get_storage()
+        size = storage.size(cls.bucket_name, key)
+        sha256 = hashlib.sha256()
+        git_sha = hashlib.sha1(('blob %d\x00' % size).encode('utf-8'))
+        # The same format as gzip.compress(data, mtime=0).
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 31) if compress else None
+        compressed = []
+        for chunk in storage.stream(cls.bucket_name, key):
+            sha256.update(chunk)
+            git_sha.update(chunk)
+            if compressor is not None:
+                compressed.append(compressor.compress(chunk))
+
+        def write(blob):
+            if compressor is not None:
+                compressed.append(compressor.flush())
+                storage.write(cls.bucket_name, cls.path_for(blob.sha256), b''.join(compressed),
+                              content_encoding='gzip')
+            else:
+                storage.copy(cls.bucket_name, key, cls.path_for(blob.sha256))
+
+        blob_key = sha256.hexdigest() + (cls.COMPRESSED_SUFFIX if compress else '')
+        return cls._acquire(blob_key, size, write), git_sha.hexdigest()
+
+    @classmethod
+    def acquire_many(cls, contents, compress=False):
+        """ Take a reference to the blob holding each of several contents, with a fixed number of queries however
+        many there are. Contents with no blob yet are uploaded concurrently.
+        :param contents: A list of bytes
+        :param compress: If True, use blobs which store the contents gzip-compressed
+        :return: A list of the blobs' keys, in the same order as contents
+        """
+        keys = []
+        data_for_key = {}
+        for data in contents:
+            sha256 = hashlib.sha256(data).hexdigest()
+            if compress:
+                sha256 += cls.COMPRESSED_SUFFIX
+            keys.append(sha256)
+            data_for_key[sha256] = data
+        if not keys:
+            return keys
+        with transaction.atomic():
+            existing = set(cls.objects.select_for_update().filter(pk__in=data_for_key).values_list('pk', flat=True))
+            missing = [sha256 for sha256 in data_for_key if sha256 not in existing]
+            if missing:
+                # Another import may insert some of the same blobs between our SELECT and INSERT. Its rows are kept,
+                # rather than failing the whole import with an IntegrityError.
+                cls.objects.bulk_create([cls(sha256=sha256, size=len(data_for_key[sha256])) for sha256 in missing],
+                                        ignore_conflicts=True)
+                # The database doesn't say which rows were skipped, but an import takes its references in the same
+                # transaction as it inserts, so any row which already has references was not created by this call.
+                missing = list(cls.objects.select_for_update().filter(pk__in=missing, refcount=0)
+                               .values_list('pk', flat=True))
+            if missing:
+                if compress:
+                    values = {cls.path_for(sha256): gzip.compress(data_for_key[sha256], mtime=0) for sha256 in missing}
+                    get_storage().write_many(cls.bucket_name, values, content_encoding='gzip')
+                else:
+                    values = {cls.path_for(sha256): data_for_key[sha256] for sha256 in missing}
+                    get_storage().write_many(cls.bucket_name, values)
+            # As in batched_deletes(), every blob gaining the same number of references is handled by one UPDATE.
+            by_count = {}
+            for sha256, count in Counter(keys).items():
+                by_count.setdefault(count, []).append(sha256)
+            for count, blob_ids in by_count.items():
+                cls.objects.filter(pk__in=blob_ids).update(refcount=F('refcount') + count)
+        return keys
+
+    @classmethod
+    def add_references(cls, sha256, count=1):
+        cls.objects.filter(pk=sha256).update(refcount=F('refcount') + count)
+
+    @classmethod
+    def release(cls, sha256, count=1):
+        cls.objects.filter(pk=sha256).update(refcount=F('refcount') - count, released=now())
+
+    @classmethod
+    def delete_if_unreferenced(cls, sha256):
+        """ Delete a blob if nothing refers to it, and its contents once that has been committed.
+        :return: True if the blob was deleted
+        """
+        try:
+            with transaction.atomic():
+                blob = cls.objects.select_for_update().filter(pk=sha256, refcount__lte=0).first()
+                if blob is None:
+                    return False
+                # The row goes first, so that if a file still refers to the blob despite its refcount, PROTECT stops
+                # the deletion before any contents are lost.
+                blob.delete()
+                transaction.on_commit(lambda: cls._delete_contents(sha256))
+        except ProtectedError:
+            logger.warning("Blob %s has no counted references but is still in use; not deleting it", sha256)
+            return False
+        return True
+
+    class Meta(IdeModel.Meta):
+        db_table = 'cloudpebble_content_blobs'
+
 
 class S3File(IdeModel):
     bucket_name = 'source'
     folder = None
     project = None
     _create_local_if_not_exists = False
+    # The kind of object this is for settings.STORAGE_COMPRESSION, or None if it is never compressed.
+    compression_kind = None
+
+    # Files written since content-addressed storage was introduced keep their contents in a shared blob. Older files
+    # still have theirs at an ID-based path until they are next written.
+    blob = models.ForeignKey(ContentBlob, blank=True, null=True, on_delete=models.PROTECT, related_name='+')
+    # The git blob SHA of the file's contents, so that they can be compared with a git tree without being read.
+    # Files whose contents were last written before this was introduced have none.
+    git_sha = models.CharField(max_length=40, blank=True, null=True)
 
     @property
     def padded_id(self):
         return '%05d' % self.id
 
-    @property
-    def local_filename(self):
-        padded_id = self.padded_id
-        return '%s%s/%s/%s/%s' % (settings.FILE_STORAGE, self.folder, padded_id[0], padded_id[1], padded_id)
-
     @property
     def s3_id(self):
         return self.id
 
     @property
     def s3_path(self):
+        if self.blob_id is not None:
+            return ContentBlob.path_for(self.blob_id)
+        return self._id_s3_path
+
+    @property
+    def _id_s3_path(self):
         return '%s/%s' % (self.folder, self.s3_id)
 
-    def _get_contents_local(self):
-        try:
-            with open(self.local_filename, 'rb') as handle:
-                data = handle.read()
-            try:
-                return data.decode('utf-8')
-            except UnicodeDecodeError:
-                return data
-        except IOError:
-            if self._create_local_if_not_exists:
-                return ''
-            else:
-                raise
+    @property
+    def storage_key(self):
+        """ The key of this file's contents in the configured storage backend. """
+        return self._key_in(get_storage())
 
-    def _save_string_local(self, string):
-        if not os.path.exists(os.path.dirname(self.local_filename)):
-            os.makedirs(os.path.dirname(self.local_filename))
-        with open(self.local_filename, 'wb') as out:
-            out.write(string)
+    def _key_in(self, storage):
+        if self.blob_id is not None:
+            return ContentBlob.path_for(self.blob_id)
+        return self._id_storage_key(storage)
 
-    def _copy_to_path_local(self, path):
-        try:
-            shutil.copy(self.local_filename, path)
-        except IOError as err:
-            if err.errno == 2 and self._crete_local_if_not_exists:
-                open(path, 'w').close()  # create the file if it's missing.
-            else:
-                raise
+    def _id_storage_key(self, storage):
+        # Local storage has always used a directory layout that keeps any one directory from getting too big.
+        if storage.is_local:
+            padded_id = self.padded_id
+            return '%s/%s/%s/%s' % (self.folder, padded_id[0], padded_id[1], padded_id)
+        return self._id_s3_path
 
     def get_contents(self):
-        if not settings.AWS_ENABLED:
-            return self._get_contents_local()
-        else:
-            data = s3.read_file(self.bucket_name, self.s3_path)
-            try:
-                return data.decode('utf-8')
-            except UnicodeDecodeError:
-                return data
+        storage = get_storage()
+        try:
+            return _decode_contents(self._decode(storage.read(self.bucket_name, self._key_in(storage))))
+        except ObjectNotFound:
+            if self._create_local_if_not_exists and storage.is_local:
+                return ''
+            raise
+
+    def _decode(self, data):
+        if self.blob_id is None:
+            return data
+        return ContentBlob.decode(self.blob_id, data)
+
+    def _set_blob(self, sha256, git_sha):
+        """ Point this file at a blob which a reference has already been taken for, releasing the old contents. """
+        with transaction.atomic():
+            old_blob_id = self.blob_id
+            if self.pk is not None:
+                # Release whatever the row points at now, rather than what this instance last saw, so that concurrent
+                # saves of the same file each release a different blob.
+                current = type(self).objects.select_for_update().filter(pk=self.pk).values_list('blob_id', flat=True)
+                old_blob_id = next(iter(current), old_blob_id)
+            # Rows which existed before blobs were introduced may still have contents at their ID-based path.
+            id_based = old_blob_id is None and self.pk is not None and not getattr(self, '_created_with_blobs', False)
+            id_based_key = self._id_storage_key(get_storage()) if id_based else None
+            self.blob_id = sha256
+            self.git_sha = git_sha
+            if self.pk is not None:
+                type(self).objects.filter(pk=self.pk).update(blob=sha256, git_sha=git_sha)
+            if old_blob_id is not None:
+                ContentBlob.release(old_blob_id)
+            elif id_based:
+                delete_object(self.bucket_name, id_based_key)
 
     def save_string(self, string):
-        if not settings.AWS_ENABLED:
-            self._save_string_local(string)
-        else:
-            s3.save_file(self.bucket_name, self.s3_path, string)
+        self._set_blob(ContentBlob.acquire(string, compress=self._compressed), git_sha_for(string))
+        self._touch_project()
+
+    def save_staged(self, key):
+        """ Store contents which were uploaded straight to storage, at key in this file's bucket, without fetching
+        them whole. The staged object is left in place for the caller to delete. """
+        self._set_blob(*ContentBlob.acquire_stored(key, compress=self._compressed))
+        self._touch_project()
+
+    @property
+    def _compressed(self):
+        return self.compression_kind is not None and compression_for(self.compression_kind) == 'gzip'
+
+    def _touch_project(self):
         if self.project:
             self.project.last_modified = now()
             self.project.save()
@@ -93,26 +310,147 @@ class S3File(IdeModel):
     def save_text(self, content):
         self.save_string(content.encode('utf-8'))
 
+    def share_contents(self, other):
+        """ Give this file the same contents as another, without copying any data if other is blob-backed. """
+        if other.blob_id is None:
+            self.save_string(other.get_contents_bytes())
+            return
+        ContentBlob.add_references(other.blob_id)
+        self._set_blob(other.blob_id, other.git_sha)
+        self._touch_project()
+
+    def get_contents_bytes(self):
+        contents = self.get_contents()
+        return contents.encode('utf-8') if isinstance(contents, str) else contents
+
     def copy_to_path(self, path):
-        if not settings.AWS_ENABLED:
-            self._copy_to_path_local(path)
-        else:
-            s3.read_file_to_filesystem(self.bucket_name, self.s3_path, path)
+        storage = get_storage()
+        try:
+            if self.blob_id is not None and ContentBlob.is_compressed(self.blob_id):
+                with open(path, 'wb') as out:
+                    out.write(self._decode(storage.read(self.bucket_name, self._key_in(storage))))
+            else:
+                storage.download(self.bucket_name, self._key_in(storage), path)
+        except ObjectNotFound:
+            if self._create_local_if_not_exists and storage.is_local:
+                open(path, 'w').close()  # create the file if it's missing.
+            else:
+                raise
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self._created_with_blobs = True
+        super(S3File, self).save(*args, **kwargs)
 
     class Meta(IdeModel.Meta):
         abstract = True
 
 
+def read_contents_many(files):
+    """ Fetch the contents of several S3Files at once.
+    On S3 this issues the GETs concurrently, so it takes about one round trip regardless of the number of files.
+    :param files: An iterable of S3File instances
+    :return: A dictionary of S3File -> contents, where contents are decoded as in S3File.get_contents()
+    """
+    files = list(files)
+    storage = get_storage()
+    if storage.is_local:
+        return {f: f.get_contents() for f in files}
+    by_bucket = {}
+    for f in files:
+        by_bucket.setdefault(f.bucket_name, []).append(f)
+    contents = {}
+    for bucket_name, bucket_files in by_bucket.items():
+        keys = {f: f._key_in(storage) for f in bucket_files}
+        data = storage.read_many(bucket_name, set(keys.values()))
+        for f in bucket_files:
+            contents[f] = _decode_contents(f._decode(data[keys[f]]))
+    return contents
+
+
+def copy_many_to_paths(files_and_paths, contents=None):
+    """ Copy several S3Files to the local filesystem at once.
+    :param files_and_paths: An iterable of (S3File, destination path) tuples
+    :param contents: Optionally, the files' contents as already fetched by read_contents_many()
+    """
+    files_and_paths = list(files_and_paths)
+    if contents is None:
+        if get_storage().is_local:
+            for f, path in files_and_paths:
+                f.copy_to_path(path)
+            return
+        contents = read_contents_many(f for f, path in files_and_paths)
+    for f, path in files_and_paths:
+        data = contents[f]
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with open(path, 'wb') as out:
+            out.write(data)
+
+
+@contextmanager
+def batched_deletes():
+    """ Within this context, stored objects belonging to deleted S3Files are collected and then removed with
+    batched DeleteObjects requests, rather than with one request per deleted row. As with delete_object(), nothing is
+    removed until the rows' deletion has committed, so rolling back, or leaving the context with an exception inside
+    a transaction which then rolls back, keeps every object. """
+    if getattr(_deletion_batch, 'pending', None) is not None:
+        # Already batching; the outermost context does the deleting.
+        yield
+        return
+    pending = _deletion_batch.pending = {}
+    releases = _deletion_batch.releases = Counter()
+    try:
+        yield
+    finally:
+        _deletion_batch.pending = _deletion_batch.releases = None
+        # Each deletion adds itself to the batch when it commits, and on_commit callbacks run in the order they were
+        # registered, so this sees every deletion which was committed and none which were rolled back. Outside a
+        # transaction, everything has already been committed and this runs straight away.
+        transaction.on_commit(lambda: _finish_batch(pending, releases))
+
+
+def _finish_batch(pending, releases):
+    storage = get_storage()
+    for bucket_name, paths in pending.items():
+        try:
+            storage.delete_many(bucket_name, paths)
+        except:
+            logger.exception("Failed to delete stored files")
+    # Group the releases so that every blob losing the same number of references is handled by one UPDATE.
+    by_count = {}
+    for sha256, count in releases.items():
+        by_count.setdefault(count, []).append(sha256)
+    for count, blob_ids in by_count.items():
+        ContentBlob.objects.filter(pk__in=blob_ids).update(refcount=F('refcount') - count, released=now())
+
+
+def delete_object(bucket_name, path):
+    """ Delete a stored object once the current transaction commits, so that nothing is lost if it rolls back, or
+    add it to the batch if inside batched_deletes(). Failures are logged. """
+    pending = getattr(_deletion_batch, 'pending', None)
+    if pending is not None:
+        transaction.on_commit(lambda: pending.setdefault(bucket_name, []).append(path))
+        return
+    transaction.on_commit(lambda: _delete_now(bucket_name, path))
+
+
+def _delete_now(bucket_name, path):
+    try:
+        get_storage().delete(bucket_name, path)
+    except:
+        logger.exception("Failed to delete stored file")
+
+
 @receiver(post_delete)
 def delete_file(sender, instance, **kwargs):
     if issubclass(sender, S3File):
-        if settings.AWS_ENABLED:
-            try:
-                s3.delete_file(sender.bucket_name, instance.s3_path)
-            except:
-                logger.exception("Failed to delete S3 file")
+        if instance.blob_id is not None:
+            releases = getattr(_deletion_batch, 'releases', None)
+            blob_id = instance.blob_id
+            if releases is not None:
+                transaction.on_commit(lambda: releases.update([blob_id]))
+            else:
+                ContentBlob.release(blob_id)
         else:
-            try:
-                os.unlink(instance.local_filename)
-            except OSError:
-                pass
+            delete_object(sender.bucket_name, instance.storage_key)
@@ -0,0 +1,154 @@
+"""
+Packed per-project source snapshots.
+
+Each source file is stored as its own object, so reading a whole project costs one GET per file. For projects with
+at least SOURCE_SNAPSHOT_MIN_FILES source files we additionally keep a single snapshot object holding all of their
+contents, which whole-project readers (builds, exports, git pushes, autocompletion) fetch instead.
+
+The snapshot is never trusted blindly: each entry records the last_modified time of the file it was taken from, and
+any file whose last_modified has since changed is read from its own object instead. The snapshot is then rewritten,
+reusing the compressed data of the entries which were still current, so it is rebuilt incrementally as files change.
+
+Snapshot layout:
+    MAGIC, then a version byte and the index length as a big-endian uint32,
+    then the index as JSON: {"files": {"<source file id>": ["<last_modified>", offset, length]}},
+    then the zlib-compressed contents of each file, at the given offsets relative to the end of the index.
+"""
+import json
+import logging
+import struct
+import zlib
+
+from django.conf import settings
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from ide.models.files import SourceFile
+from ide.models.s3file import read_contents_many, delete_object, _decode_contents
+from utils.storage import get_storage, ObjectNotFound
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'CPSNAP'
+VERSION = 1
+_HEADER = struct.Struct('>BI')
+
+BUCKET_NAME = 'source'
+
+
+def snapshot_path(project_id):
+    return 'snapshots/%d' % project_id
+
+
+def _version_stamp(source_file):
+    return source_file.last_modified.isoformat() if source_file.last_modified else ''
+
+
+def pack_snapshot(entries):
+    """ Serialise a snapshot.
+    :param entries: A dictionary of source file ID -> (version stamp, compressed contents)
+    :return: The snapshot as bytes
+    """
+    index = {}
+    chunks = []
+    offset = 0
+    for file_id, (stamp, compressed) in entries.items():
+        index[str(file_id)] = [stamp, offset, len(compressed)]
+        chunks.append(compressed)
+        offset += len(compressed)
+    index_bytes = json.dumps({'files': index}).encode('utf-8')
+    return MAGIC + _HEADER.pack(VERSION, len(index_bytes)) + index_bytes + b''.join(chunks)
+
+
+def unpack_snapshot(data):
+    """ Parse a snapshot produced by pack_snapshot.
+    :return: A dictionary of source file ID -> (version stamp, compressed contents)
+    :raises ValueError: if the snapshot is malformed or has an unknown version
+    """
+    if not data.startswith(MAGIC):
+        raise ValueError("Not a source snapshot")
+    version, index_length = _HEADER.unpack_from(data, len(MAGIC))
+    if version != VERSION:
+        raise ValueError("Unsupported snapshot version %d" % version)
+    index_start = len(MAGIC) + _HEADER.size
+    data_start = index_start + index_length
+    index = json.loads(data[index_start:data_start].decode('utf-8'))
+    entries = {}
+    for file_id, (stamp, offset, length) in index['files'].items():
+        start = data_start + offset
+        if start + length > len(data):
+            raise ValueError("Truncated snapshot")
+        entries[int(file_id)] = (stamp, data[start:start + length])
+    return entries
+
+
+def _load_snapshot(project_id):
+    try:
+        return unpack_snapshot(get_storage().read(BUCKET_NAME, snapshot_path(project_id)))
+    except ObjectNotFound:
+        pass
+    except (ValueError, struct.error):
+        logger.warning("Ignoring corrupt snapshot for project %d", project_id, exc_info=True)
+    except Exception:
+        # The snapshot is only an optimisation, so fall back to reading the files individually.
+        logger.warning("Failed to read snapshot for project %d", project_id, exc_info=True)
+    return {}
+
+
+def _uses_snapshot(source_files):
+    min_files = settings.SOURCE_SNAPSHOT_MIN_FILES
+    # Local storage has no per-request overhead to save.
+    return not get_storage().is_local and min_files > 0 and len(source_files) >= min_files
+
+
+def read_project_contents(project, files):
+    """ Fetch the contents of a project's files, using the project's snapshot for its source files if it has one.
+    :param project: The Project the files belong to
+    :param files: An iterable of S3Files belonging to the project. These should have been freshly loaded from the
+    database, since their last_modified times are used to decide whether the snapshot is current.
+    :return: A dictionary of S3File -> contents, as returned by read_contents_many()
+    """
+    files = list(files)
+    source_files = [f for f in files if isinstance(f, SourceFile)]
+    if not _uses_snapshot(source_files):
+        return read_contents_many(files)
+
+    snapshot = _load_snapshot(project.id)
+    entries = {}
+    contents = {}
+    stale = []
+    for f in source_files:
+        stamp = _version_stamp(f)
+        entry = snapshot.get(f.id)
+        if entry is not None and entry[0] == stamp:
+            entries[f.id] = entry
+            contents[f] = _decode_contents(zlib.decompress(entry[1]))
+        else:
+            stale.append(f)
+
+    others = [f for f in files if not isinstance(f, SourceFile)]
+    contents.update(read_contents_many(stale + others))
+
+    if stale:
+        # Keep entries for source files which weren't asked for this time, unless they have since been deleted.
+        requested = {f.id for f in source_files}
+        unrequested = set(snapshot) - requested
+        if unrequested:
+            existing = set(project.source_files.filter(id__in=unrequested).values_list('id', flat=True))
+            entries.update((file_id, snapshot[file_id]) for file_id in existing)
+        for f in stale:
+            data = contents[f]
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            entries[f.id] = (_version_stamp(f), zlib.compress(data))
+        try:
+            get_storage().write(BUCKET_NAME, snapshot_path(project.id), pack_snapshot(entries))
+        except Exception:
+            logger.warning("Failed to write snapshot for project %d", project.id, exc_info=True)
+    return contents
+
+
+@receiver(post_delete, sender='ide.Project')
+def delete_snapshot(sender, instance, **kwargs):
+    if not get_storage().is_local and settings.SOURCE_SNAPSHOT_MIN_FILES > 0:
+        delete_object(BUCKET_NAME, snapshot_path(instance.id))
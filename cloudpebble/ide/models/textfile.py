@@ -11,6 +11,7 @@ class TextFile(S3File):
     last_modified = models.DateTimeField(blank=True, null=True, auto_now=True)
     folded_lines = models.TextField(default="[]")
     _create_local_if_not_exists = True
+    compression_kind = 'source'
 
     def was_modified_since(self, expected_modification_time):
         if isinstance(expected_modification_time, int):
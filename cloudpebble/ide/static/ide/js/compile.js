@@ -284,14 +284,17 @@ CloudPebble.Compile = (function() {
     };
 
     var wait_for_build = function(build_id) {
-        return Ajax.Get('/ide/project/' + PROJECT_ID + '/build/' + build_id + '/info').then(function(data) {
+        // Poll without sizes, which aren't known until the build is done, then fetch the finished build in full.
+        return Ajax.Get('/ide/project/' + PROJECT_ID + '/build/' + build_id + '/info', {sizes: 0}).then(function(data) {
             var build = data.build;
             if(build.state == 1) {
                 return Promise.delay(1000).then(function() {
                     return wait_for_build(build_id);
                 });
             }
-            return build;
+            return Ajax.Get('/ide/project/' + PROJECT_ID + '/build/' + build_id + '/info').then(function(data) {
+                return data.build;
+            });
         });
     };
 
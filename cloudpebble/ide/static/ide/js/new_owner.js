@@ -22,9 +22,19 @@
             dialog.find('.progress').addClass('progress-warning');
             dialog.find('p').text("This isn't going too well…");
         }
+        function show_progress(progress) {
+            var percent = progress.total ? Math.floor(100 * progress.done / progress.total) : 0;
+            dialog.find('.bar').css('width', percent + '%');
+            if (progress.stage == 'packing') {
+                dialog.find('p').text("Packing project " + progress.done + " of " + progress.total + "…");
+            } else {
+                dialog.find('p').text("Uploading… " + percent + "%");
+            }
+        }
         Ajax.Post('/ide/transition/export', {}).then(function(data) {
-            return CloudPebble.PollTask(data.task_id, {on_bad_request: show_warning});
+            return Ajax.PollTask(data.task_id, {on_bad_request: show_warning, on_progress: show_progress});
         }).then(function(result) {
+            dialog.find('.bar').css('width', '100%');
             dialog.find('.progress').removeClass('progress-striped').addClass('progress-success');
             dialog.find('p').html("<a href='" + result + "' class='btn btn-primary'>Download</a>");
         }).catch(function(error) {
@@ -294,7 +294,6 @@ CloudPebble.Resources = (function() {
         if (file) {
             var arr = $.makeArray(new_tags)[0];
             form_data.append("new_tags", JSON.stringify(arr ? arr[1] : []));
-            form_data.append("file", file);
         }
         if (!is_new) {
             form_data.append("variants", JSON.stringify($.makeArray(variant_tags)));
@@ -305,14 +304,22 @@ CloudPebble.Resources = (function() {
             form_data.append("replacement_files[]", file);
         });
 
-
-        return Ajax.Ajax({
-            url: url,
-            type: "POST",
-            data: form_data,
-            processData: false,
-            contentType: false,
-            dataType: 'json'
+        // New resources are uploaded straight to storage; the view just picks them up from there.
+        return Promise.resolve(file && is_new ? Ajax.Upload(PROJECT_ID, file) : null).then(function(upload_token) {
+            if (upload_token) {
+                form_data.append("upload_token", upload_token);
+            }
+            else if (file) {
+                form_data.append("file", file);
+            }
+            return Ajax.Ajax({
+                url: url,
+                type: "POST",
+                data: form_data,
+                processData: false,
+                contentType: false,
+                dataType: 'json'
+            });
         });
     }
 
@@ -1016,12 +1023,14 @@ CloudPebble.Resources = (function() {
             replace_status.text(gettext('Uploading...')).css('color', '#999');
 
             var form_data = new FormData();
-            form_data.append('file', files[0]);
             form_data.append('name', file.name);
             form_data.append('target', 'embeddedjs');
 
-            // Delete old, create new (replace)
-            Ajax.Post('/ide/project/' + PROJECT_ID + '/source/' + file.id + '/delete').then(function() {
+            // Upload, then delete old and create new (replace)
+            Ajax.Upload(PROJECT_ID, files[0]).then(function(upload_token) {
+                form_data.append('upload_token', upload_token);
+                return Ajax.Post('/ide/project/' + PROJECT_ID + '/source/' + file.id + '/delete');
+            }).then(function() {
                 return $.ajax({
                     url: '/ide/project/' + PROJECT_ID + '/create_binary_source_file',
                     type: 'POST',
@@ -1155,23 +1164,20 @@ CloudPebble.Resources = (function() {
                 btn.prop('disabled', true);
 
                 var form_data = new FormData();
-                form_data.append('file', file_input.files[0]);
                 form_data.append('name', full_name);
                 form_data.append('target', 'embeddedjs');
 
-                $.ajax({
-                    url: '/ide/project/' + PROJECT_ID + '/create_binary_source_file',
-                    type: 'POST',
-                    data: form_data,
-                    processData: false,
-                    contentType: false,
-                    dataType: 'json'
-                }).done(function(data) {
-                    if (data.success === false) {
-                        error.text(data.error || gettext('Upload failed.')).show();
-                        btn.prop('disabled', false);
-                        return;
-                    }
+                Ajax.Upload(PROJECT_ID, file_input.files[0]).then(function(upload_token) {
+                    form_data.append('upload_token', upload_token);
+                    return Ajax.Ajax({
+                        url: '/ide/project/' + PROJECT_ID + '/create_binary_source_file',
+                        type: 'POST',
+                        data: form_data,
+                        processData: false,
+                        contentType: false,
+                        dataType: 'json'
+                    });
+                }).then(function(data) {
                     prompt.modal('hide');
                     btn.prop('disabled', false);
 
@@ -1181,13 +1187,8 @@ CloudPebble.Resources = (function() {
                     edit_alloy_asset(file_data);
 
                     ga('send', 'event', 'resource', 'create_alloy_asset');
-                }).fail(function(xhr) {
-                    var msg = gettext('Upload failed.');
-                    try {
-                        var resp = JSON.parse(xhr.responseText);
-                        if (resp.error) msg = resp.error;
-                    } catch(e) {}
-                    error.text(msg).show();
+                }).catch(function(err) {
+                    error.text(err.message || gettext('Upload failed.')).show();
                     btn.prop('disabled', false);
                 });
             });
@@ -275,9 +275,19 @@ CloudPebble.Settings = (function() {
             function show_warning() {
                 dialog.find('.progress').addClass('progress-warning');
             }
+            function show_progress(progress) {
+                if (progress.stage == 'packing' && progress.total) {
+                    dialog.find('.bar').css('width', Math.floor(100 * progress.done / progress.total) + '%');
+                }
+            }
             return Ajax.Post('/ide/project/' + PROJECT_ID + '/export', {}).then(function(data) {
-                return Ajax.PollTask(data.task_id, {on_bad_request: show_warning});
+                // If the project hasn't changed since it was last exported, we get the existing export straight away.
+                if (data.url) {
+                    return data.url;
+                }
+                return Ajax.PollTask(data.task_id, {on_bad_request: show_warning, on_progress: show_progress});
             }).then(function(result) {
+                dialog.find('.bar').css('width', '100%');
                 dialog.find('.progress').removeClass('progress-striped').addClass('progress-success');
                 dialog.find('.download-btn').attr('href', result).show();
             }).catch(function() {
@@ -1,6 +1,8 @@
 from django.conf import settings
 
 from ide.tasks.archive import add_project_to_archive, do_import_archive
+from ide.tasks.autosave import flush_autosave
+from ide.tasks.blobs import collect_unreferenced_blobs
 from ide.tasks.build import run_compile
 from ide.tasks.git import github_push, github_pull
 from ide.tasks.gist import import_gist
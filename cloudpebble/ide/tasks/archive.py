@@ -1,24 +1,32 @@
+import io
 import json
 import logging
 import os
 import re
-import shutil
-import tempfile
 import uuid
 import zipfile
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
 
 from celery import shared_task
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import SuspiciousOperation
-from django.db import transaction
+from django.db import connections, transaction
+from django.db.models import F, Q
 
-import utils.s3 as s3
-from ide.models.files import SourceFile, ResourceFile, ResourceIdentifier, ResourceVariant
+from ide.models.export import ProjectExport
+from ide.models.files import SourceFile, ResourceFile, ResourceVariant
 from ide.models.project import Project
+from ide.models.snapshot import read_project_contents
+from ide.utils import autosave, uploads
+from ide.utils.bulk_import import ProjectImport
+from ide.utils.progress import TaskProgress
 from ide.utils.project import find_project_root_and_manifest, InvalidProjectArchiveException, MANIFEST_KINDS, BaseProjectItem
 from ide.utils.sdk import generate_manifest, generate_wscript_file, generate_jshint_file, manifest_name_for_project, load_manifest_dict
+from ide.utils.zipmerge import merge_zips
+from utils.storage import get_storage, ObjectNotFound
 from utils.td_helper import send_td_event
 
 __author__ = 'katharine'
@@ -26,83 +34,229 @@ __author__ = 'katharine'
 logger = logging.getLogger(__name__)
 
 
-def _public_export_url(path):
+# Bump this whenever project_archive_entries() changes what goes into an export, so that cached exports are rebuilt.
+ARCHIVE_VERSION = 1
+
+
+def export_url(path):
     return "/ide/export/%s" % path.lstrip('/')
 
 
-def add_project_to_archive(z, project, prefix='', suffix=''):
-    source_files = SourceFile.objects.filter(project=project)
+class _ZipBuffer(object):
+    """ A write-only file which holds what ZipFile writes to it until it's taken. Since it can't tell() or seek(),
+    ZipFile writes each entry's sizes after its data, so the archive comes out in a single pass. """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(entries):
+    """ Build a zip archive without a temporary file.
+    :param entries: An iterable of (path, contents) tuples
+    :return: A generator of byte strings which together make up the archive
+    """
+    buf = _ZipBuffer()
+    with zipfile.ZipFile(buf, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+        for path, contents in entries:
+            z.writestr(path, contents)
+            data = buf.take()
+            if data:
+                yield data
+    yield buf.take()
+
+
+def archive_prefix(project):
+    return re.sub(r'[^\w]+', '_', project.name).strip('_').lower()
+
+
+def project_archive_entries(project, prefix='', suffix='', progress=None):
+    """ :param progress: A TaskProgress whose 'packing' stage counts the files once each has been consumed
+    :return: A generator of (path, contents) tuples for each file in a project's export """
+    autosave.flush_project(project)
+    source_files = list(SourceFile.objects.filter(project=project))
     resources = ResourceFile.objects.filter(project=project)
-    prefix += re.sub(r'[^\w]+', '_', project.name).strip('_').lower()
+    prefix += archive_prefix(project)
     prefix += suffix
 
-    for source in source_files:
-        path = os.path.join(prefix, source.project_path)
-        z.writestr(path, source.get_contents())
+    variants = [variant for resource in resources for variant in resource.variants.all()]
+    contents = read_project_contents(project, source_files + variants)
 
-    for resource in resources:
-        for variant in resource.variants.all():
-            z.writestr('%s/%s/%s' % (prefix, project.resources_path, variant.path), variant.get_contents())
+    def entries():
+        for source in source_files:
+            yield os.path.join(prefix, source.project_path), contents[source]
 
-    manifest = generate_manifest(project, resources)
-    manifest_name = manifest_name_for_project(project)
-    z.writestr('%s/%s' % (prefix, manifest_name), manifest)
-    if project.is_standard_project_type:
-        # This file is always the same, but needed to build.
-        z.writestr('%s/wscript' % prefix, generate_wscript_file(project, for_export=True))
-        z.writestr('%s/jshintrc' % prefix, generate_jshint_file(project))
+        for variant in variants:
+            yield '%s/%s/%s' % (prefix, project.resources_path, variant.path), contents[variant]
 
+        manifest = generate_manifest(project, resources)
+        manifest_name = manifest_name_for_project(project)
+        yield '%s/%s' % (prefix, manifest_name), manifest
+        if project.is_standard_project_type:
+            # This file is always the same, but needed to build.
+            yield '%s/wscript' % prefix, generate_wscript_file(project, for_export=True)
+            yield '%s/jshintrc' % prefix, generate_jshint_file(project)
 
-@shared_task(acks_late=True)
-def create_archive(project_id):
+    if progress is None:
+        yield from entries()
+        return
+    progress.stage('packing', len(source_files) + len(variants) + (3 if project.is_standard_project_type else 1))
+    for entry in entries():
+        yield entry
+        progress.advance()
+
+
+def add_project_to_archive(z, project, prefix='', suffix=''):
+    for path, contents in project_archive_entries(project, prefix, suffix):
+        z.writestr(path, contents)
+
+
+def current_export(project):
+    """ :return: The ProjectExport of the project as it is now, or None if it needs exporting again """
+    # Unflushed saves aren't reflected in last_modified yet, and interdependencies' package URLs change as they build.
+    if autosave.has_unflushed_saves(project) or project.project_dependencies.exists():
+        return None
+    return ProjectExport.lookup(project, ARCHIVE_VERSION)
+
+
+def export_project(project, progress=None):
+    """ Build and upload an archive of a project, recording it so that it can be handed out until the project changes.
+    :param progress: As for project_archive_entries()
+    :return: The ProjectExport
+    """
+    # Flushing buffered saves bumps last_modified, so do it before taking the revision the export is recorded under.
+    autosave.flush_project(project)
+    revision = Project.objects.values_list('last_modified', flat=True).get(pk=project.pk)
+    outfile = '%s/%s.zip' % (uuid.uuid4().hex, archive_prefix(project))
+    get_storage().upload_stream('export', outfile, stream_zip(project_archive_entries(project, progress=progress)),
+                                public=True, content_type='application/zip')
+    export, created = ProjectExport.objects.get_or_create(project=project, revision=revision, version=ARCHIVE_VERSION,
+                                                          defaults={'key': outfile})
+    if not created:
+        # Someone else exported the same revision while we were working; keep theirs.
+        get_storage().delete('export', outfile)
+    return export
+
+
+@shared_task(bind=True, acks_late=True)
+def create_archive(self, project_id):
+    progress = TaskProgress(self)
     project = Project.objects.get(pk=project_id)
-    prefix = re.sub(r'[^\w]+', '_', project.name).strip('_').lower()
-    with tempfile.NamedTemporaryFile(suffix='.zip', delete=False) as temp:
-        filename = temp.name
-        with zipfile.ZipFile(filename, 'w', compression=zipfile.ZIP_DEFLATED) as z:
-            add_project_to_archive(z, project)
-
-        # Generate a URL
-        u = uuid.uuid4().hex
-
-        send_td_event('cloudpebble_export_project', project=project)
-
-        if not settings.AWS_ENABLED:
-            outfile = '%s%s/%s.zip' % (settings.EXPORT_DIRECTORY, u, prefix)
-            os.makedirs(os.path.dirname(outfile), 0o755)
-            shutil.copy(filename, outfile)
-            os.chmod(outfile, 0o644)
-            return _public_export_url('%s/%s.zip' % (u, prefix))
-        else:
-            outfile = '%s/%s.zip' % (u, prefix)
-            s3.upload_file('export', outfile, filename, public=True, content_type='application/zip')
-            return _public_export_url(outfile)
 
+    send_td_event('cloudpebble_export_project', project=project)
 
-@shared_task(acks_late=True)
-def export_user_projects(user_id):
+    # The archive is uploaded as it's built, so we don't know its size until it's done, but we do know how many files
+    # go into it.
+    export = export_project(project, progress=progress)
+    return export_url(export.key)
+
+
+def _project_export_key(project):
+    """ Get the key of an archive of a project, reusing its current export if it has one. """
+    export = current_export(project)
+    if export is not None:
+        try:
+            get_storage().open('export', export.key).close()
+            return export.key
+        except ObjectNotFound:
+            pass
+    return export_project(project).key
+
+
+def _run_in_thread(func, *args):
+    try:
+        return func(*args)
+    finally:
+        # Each thread gets its own database connection, which nothing else will close.
+        connections.close_all()
+
+
+def _map_concurrently(func, items, concurrency):
+    """ Call func on each item using a pool of threads, yielding (item, result) tuples as they finish.
+    Items are taken up only as earlier results are yielded, and no more than concurrency calls are running or waiting
+    to be yielded at once, so however many items there are, only about that many results are held at a time. """
+    if concurrency <= 1:
+        for item in items:
+            yield item, func(item)
+        return
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(_run_in_thread, func, item): item for item in islice(items, concurrency)}
+        try:
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = futures.pop(future)
+                    result = future.result()
+                    # Start on the next item before handing this result over, so the pool stays busy meanwhile.
+                    for next_item in islice(items, 1):
+                        futures[executor.submit(_run_in_thread, func, next_item)] = next_item
+                    yield item, result
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+@shared_task(ignore_result=True)
+def prune_exports(limit=1000):
+    """ Delete cached exports which have expired, or been superseded by changes to their project for long enough that
+    nobody should still be downloading them. """
+    stale = ProjectExport.objects.filter(
+        Q(created__lt=ProjectExport.expiry_cutoff()) |
+        (Q(created__lt=ProjectExport.superseded_cutoff()) & ~Q(revision=F('project__last_modified')))
+    ).values_list('pk', flat=True)
+    # The post_delete handler deletes each archive once its record's deletion commits.
+    deleted, _ = ProjectExport.objects.filter(pk__in=list(stale[:limit])).delete()
+    logger.info("Deleted %d stale exports", deleted)
+    return deleted
+
+
+@shared_task(bind=True, acks_late=True)
+def export_user_projects(self, user_id):
+    """ Export all of a user's projects in one archive.
+    Each project is exported separately, several at a time, as for create_archive(); those which haven't changed since
+    they were last exported aren't exported again. The project archives are merged into the final one without being
+    recompressed as they finish, while it is uploaded. If the task is interrupted and retried, projects which were
+    already exported are reused, so it picks up roughly where it left off.
+    """
+    progress = TaskProgress(self)
     user = User.objects.get(pk=user_id)
-    projects = Project.objects.filter(owner=user)
-    with tempfile.NamedTemporaryFile(suffix='.zip', delete=False) as temp:
-        filename = temp.name
-        with zipfile.ZipFile(filename, 'w', compression=zipfile.ZIP_DEFLATED) as z:
-            for project in projects:
-                add_project_to_archive(z, project, prefix='cloudpebble-export/', suffix='-%d' % project.id)
-
-        send_td_event('cloudpebble_export_all_projects', user=user)
-
-        # Generate a URL
-        u = uuid.uuid4().hex
-        if not settings.AWS_ENABLED:
-            outfile = '%s%s/%s.zip' % (settings.EXPORT_DIRECTORY, u, 'cloudpebble-export')
-            os.makedirs(os.path.dirname(outfile), 0o755)
-            shutil.copy(filename, outfile)
-            os.chmod(outfile, 0o644)
-            return _public_export_url('%s/%s.zip' % (u, 'cloudpebble-export'))
-        else:
-            outfile = '%s/%s.zip' % (u, 'cloudpebble-export')
-            s3.upload_file('export', outfile, filename, public=True, content_type='application/zip')
-            return _public_export_url(outfile)
+    projects = list(Project.objects.filter(owner=user))
+    progress.stage('packing', len(projects))
+
+    def project_archives():
+        # Each project's archive is read from storage as it is merged, rather than being held in memory.
+        for project, key in _map_concurrently(_project_export_key, projects, settings.ACCOUNT_EXPORT_CONCURRENCY):
+            old_prefix = archive_prefix(project)
+            new_prefix = 'cloudpebble-export/%s-%d' % (old_prefix, project.id)
+            try:
+                archive = get_storage().open('export', key)
+            except ObjectNotFound:
+                # The export was pruned after we found it.
+                archive = get_storage().open('export', export_project(project).key)
+            with archive:
+                yield archive, lambda name, old=old_prefix, new=new_prefix: '%s/%s' % (new, name[len(old):].lstrip('/'))
+            progress.advance()
+
+    send_td_event('cloudpebble_export_all_projects', user=user)
+
+    # Generate a URL
+    u = uuid.uuid4().hex
+    outfile = '%s/%s.zip' % (u, 'cloudpebble-export')
+    get_storage().upload_stream('export', outfile, merge_zips(project_archives()), public=True,
+                                content_type='application/zip')
+    return export_url(outfile)
 
 
 def get_filename_variant(file_name, resource_suffix_map):
@@ -121,6 +275,95 @@ def get_filename_variant(file_name, resource_suffix_map):
     return ids, root_file_name
 
 
+def apply_manifest(project, manifest_dict, manifest_kind):
+    """ Set a project's options and dependencies from the contents of its manifest.
+    :return: The manifest's media map
+    """
+    project_options, media_map, dependencies = load_manifest_dict(manifest_dict, manifest_kind)
+
+    for k, v in project_options.items():
+        setattr(project, k, v)
+    if project.project_type == 'alloy':
+        # Some upstream Alloy examples still ship object-style app keys.
+        # Normalize to array format before model validation.
+        app_keys = json.loads(project.app_keys)
+        if isinstance(app_keys, dict):
+            if all(isinstance(v, int) for v in app_keys.values()):
+                app_keys = [k for k, _ in sorted(app_keys.items(), key=lambda item: item[1])]
+            else:
+                app_keys = list(app_keys.keys())
+            project.app_keys = json.dumps(app_keys)
+    project.full_clean()
+    project.set_dependencies(dependencies)
+    return media_map
+
+
+def plan_resources(project, media_map):
+    """ Work out which resource files a project's media map describes.
+    :return: An OrderedDict, in manifest order, of root file name (the manifest's path, without tags) -> dictionary
+    of 'file_name' (the ResourceFile's file_name), 'kind', 'is_menu_icon' and 'resources' (its media map entries)
+    """
+    tag_map = {v: k for k, v in ResourceVariant.VARIANT_STRINGS.items() if v}
+    desired_resources = OrderedDict()
+
+    # Go through the media map and look for resources
+    for resource in media_map:
+        file_name = resource['file']
+        identifier = resource['name']
+        # Pebble.js and simply.js both have some internal resources that we don't import.
+        if project.project_type in {'pebblejs', 'simplyjs'}:
+            if identifier in {'MONO_FONT_14', 'IMAGE_MENU_ICON', 'IMAGE_LOGO_SPLASH', 'IMAGE_TILE_SPLASH'}:
+                continue
+        tags, root_file_name = get_filename_variant(file_name, tag_map)
+        if (len(tags) != 0):
+            raise ValueError("Generic resource filenames cannot contain a tilde (~)")
+        if root_file_name not in desired_resources:
+            desired_resources[root_file_name] = {
+                'resources': [],
+                'kind': resource['type'],
+                'is_menu_icon': resource.get('menuIcon', False),
+            }
+        else:
+            # A single root resource maps to one ResourceFile row, so key properties must match.
+            if desired_resources[root_file_name]['kind'] != resource['type']:
+                raise ValueError("Inconsistent resource type for %s" % root_file_name)
+            if desired_resources[root_file_name]['is_menu_icon'] != resource.get('menuIcon', False):
+                raise ValueError("Inconsistent menuIcon for %s" % root_file_name)
+
+        desired_resources[root_file_name]['resources'].append(resource)
+
+    # Collect all DIR_MAP prefixes (e.g. "images/", "fonts/", "data/").
+    all_dir_prefixes = set(v + '/' for v in ResourceFile.DIR_MAP.values())
+    for root_file_name, resource_info in desired_resources.items():
+        # Strip whichever DIR_MAP prefix the path actually starts with,
+        # since get_path() re-adds the prefix for the resource's kind.
+        # The manifest path may use a different prefix than the kind implies
+        # (e.g. a "raw" resource at "images/foo.pdc").
+        file_name = root_file_name
+        for prefix in all_dir_prefixes:
+            if root_file_name.startswith(prefix):
+                file_name = root_file_name[len(prefix):]
+                break
+        resource_info['file_name'] = file_name
+    return desired_resources
+
+
+def identifier_options(resource):
+    """ :return: The ResourceIdentifier fields for an entry in a media map """
+    return {
+        'resource_id': resource['name'],
+        'target_platforms': json.dumps(resource['targetPlatforms']) if 'targetPlatforms' in resource else None,
+        # Font options
+        'character_regex': resource.get('characterRegex', None),
+        'tracking': resource.get('trackingAdjust', None),
+        'compatibility': resource.get('compatibility', None),
+        # Bitmap options
+        'memory_format': resource.get('memoryFormat', None),
+        'storage_format': resource.get('storageFormat', None),
+        'space_optimisation': resource.get('spaceOptimization', None),
+    }
+
+
 def make_filename_variant(file_name, variant):
     file_name_parts = os.path.splitext(file_name)
     return file_name_parts[0] + variant + file_name_parts[1]
@@ -144,14 +387,26 @@ def ends_with_any(s, options):
     return any(s.endswith(end) for end in options)
 
 
+def _open_archive(archive, staged):
+    if staged:
+        return uploads.open_staged(archive)
+    if isinstance(archive, bytes):
+        return io.BytesIO(archive)
+    return archive
+
+
 @shared_task(acks_late=True)
-def do_import_archive(project_id, archive, delete_project=False):
+def do_import_archive(project_id, archive, delete_project=False, staged=False):
+    """ Import a zipped project into an existing project.
+    :param archive: The archive, as bytes or a seekable file object, or the key of an archive staged with
+    ide.utils.uploads.stage_archive() if staged is True. Tasks sent to the broker should always use a staged archive.
+    :param delete_project: Delete the project if the import fails
+    :param staged: True if archive is a staged archive's key. The staged archive is deleted once the import finishes.
+    """
     project = Project.objects.get(pk=project_id)
     try:
-        with tempfile.NamedTemporaryFile(suffix='.zip') as archive_file:
-            archive_file.write(archive)
-            archive_file.flush()
-            with zipfile.ZipFile(str(archive_file.name), 'r') as z:
+        with _open_archive(archive, staged) as archive_file:
+            with zipfile.ZipFile(archive_file, 'r') as z:
                 contents = z.infolist()
                 # Requirements:
                 # - Find the folder containing the project. This may or may not be at the root level.
@@ -202,138 +457,69 @@ def do_import_archive(project_id, archive, delete_project=False):
 
                 with transaction.atomic():
                     # We have a resource map! We can now try importing things from it.
-                    project_options, media_map, dependencies = load_manifest_dict(manifest_dict, manifest_kind)
-
-                    for k, v in project_options.items():
-                        setattr(project, k, v)
-                    if project.project_type == 'alloy':
-                        # Some upstream Alloy examples still ship object-style app keys.
-                        # Normalize to array format before model validation.
-                        app_keys = json.loads(project.app_keys)
-                        if isinstance(app_keys, dict):
-                            if all(isinstance(v, int) for v in app_keys.values()):
-                                app_keys = [k for k, _ in sorted(app_keys.items(), key=lambda item: item[1])]
-                            else:
-                                app_keys = list(app_keys.keys())
-                            project.app_keys = json.dumps(app_keys)
-                    project.full_clean()
-                    project.set_dependencies(dependencies)
+                    media_map = apply_manifest(project, manifest_dict, manifest_kind)
 
                     RES_PATH = project.resources_path
 
                     tag_map = {v: k for k, v in ResourceVariant.VARIANT_STRINGS.items() if v}
 
-                    desired_resources = OrderedDict()
-                    resources_files = {}
-                    file_exists_for_root = {}
-
-                    # Go through the media map and look for resources
-                    for resource in media_map:
-                        file_name = resource['file']
-                        identifier = resource['name']
-                        # Pebble.js and simply.js both have some internal resources that we don't import.
-                        if project.project_type in {'pebblejs', 'simplyjs'}:
-                            if identifier in {'MONO_FONT_14', 'IMAGE_MENU_ICON', 'IMAGE_LOGO_SPLASH', 'IMAGE_TILE_SPLASH'}:
-                                continue
-                        tags, root_file_name = get_filename_variant(file_name, tag_map)
-                        if (len(tags) != 0):
-                            raise ValueError("Generic resource filenames cannot contain a tilde (~)")
-                        if root_file_name not in desired_resources:
-                            desired_resources[root_file_name] = {
-                                'resources': [],
-                                'kind': resource['type'],
-                                'is_menu_icon': resource.get('menuIcon', False),
-                            }
-                        else:
-                            # A single root resource maps to one ResourceFile row, so key properties must match.
-                            if desired_resources[root_file_name]['kind'] != resource['type']:
-                                raise ValueError("Inconsistent resource type for %s" % root_file_name)
-                            if desired_resources[root_file_name]['is_menu_icon'] != resource.get('menuIcon', False):
-                                raise ValueError("Inconsistent menuIcon for %s" % root_file_name)
-
-                        desired_resources[root_file_name]['resources'].append(resource)
-                        file_exists_for_root[root_file_name] = False
+                    desired_resources = plan_resources(project, media_map)
+                    file_exists_for_root = {root_file_name: False for root_file_name in desired_resources}
+                    importer = ProjectImport(project)
 
                     # Create ResourceFile rows in manifest order so generated manifests preserve declared media order.
-                    # Collect all DIR_MAP prefixes (e.g. "images/", "fonts/", "data/").
-                    all_dir_prefixes = set(v + '/' for v in ResourceFile.DIR_MAP.values())
-                    for root_file_name, resource_info in desired_resources.items():
-                        # Strip whichever DIR_MAP prefix the path actually starts with,
-                        # since get_path() re-adds the prefix for the resource's kind.
-                        # The manifest path may use a different prefix than the kind implies
-                        # (e.g. a "raw" resource at "images/foo.pdc").
-                        file_name = root_file_name
-                        for prefix in all_dir_prefixes:
-                            if root_file_name.startswith(prefix):
-                                file_name = root_file_name[len(prefix):]
-                                break
-                        resources_files[root_file_name] = ResourceFile.objects.create(
-                            project=project,
-                            file_name=file_name,
-                            kind=resource_info['kind'],
-                            is_menu_icon=resource_info['is_menu_icon'])
+                    resources_files = OrderedDict(
+                        (root_file_name, importer.add_resource_file(file_name=resource_info['file_name'],
+                                                                    kind=resource_info['kind'],
+                                                                    is_menu_icon=resource_info['is_menu_icon']))
+                        for root_file_name, resource_info in desired_resources.items())
 
                     # Go through the zip file process all resource and source files.
-                    for filename, entry in filtered_contents:
-                        if filename.startswith(RES_PATH):
-                            base_filename = filename[len(RES_PATH) + 1:]
-                            # Let's just try opening the file
-                            try:
-                                extracted = z.open("%s%s/%s" % (base_dir, RES_PATH, base_filename))
-                            except KeyError:
-                                logger.debug("Failed to open %s", base_filename)
-                                continue
-
-                            # Now we know the file exists and is in the resource directory - is it the one we want?
-                            tags, root_file_name = get_filename_variant(base_filename, tag_map)
-                            tags_string = ",".join(str(int(t)) for t in tags)
-
-                            if root_file_name in desired_resources:
-                                variant = ResourceVariant.objects.create(
-                                    resource_file=resources_files[root_file_name],
-                                    tags=tags_string
-                                )
-                                variant.save_file(extracted)
-                                file_exists_for_root[root_file_name] = True
-                        else:
-                            try:
-                                base_filename, target = SourceFile.get_details_for_path(project.project_type, filename)
-                            except ValueError:
-                                # We'll just ignore any out of place files.
-                                continue
-                            source = SourceFile.objects.create(project=project, file_name=base_filename, target=target)
-
-                            with z.open(entry.filename) as f:
-                                raw = f.read()
-                                if source.is_editable_text:
-                                    source.save_text(raw.decode('utf-8'))
-                                else:
-                                    source.save_string(raw)
+                    with importer.timed('read'):
+                        for filename, entry in filtered_contents:
+                            if filename.startswith(RES_PATH):
+                                base_filename = filename[len(RES_PATH) + 1:]
+                                # Let's just try opening the file
+                                try:
+                                    extracted = z.open("%s%s/%s" % (base_dir, RES_PATH, base_filename))
+                                except KeyError:
+                                    logger.debug("Failed to open %s", base_filename)
+                                    continue
+
+                                # Now we know the file exists and is in the resource directory - is it the one we want?
+                                tags, root_file_name = get_filename_variant(base_filename, tag_map)
+                                tags_string = ",".join(str(int(t)) for t in tags)
+
+                                if root_file_name in desired_resources:
+                                    with extracted:
+                                        importer.add_variant(resources_files[root_file_name], tags_string,
+                                                             extracted.read())
+                                    file_exists_for_root[root_file_name] = True
+                            else:
+                                try:
+                                    base_filename, target = SourceFile.get_details_for_path(project.project_type, filename)
+                                except ValueError:
+                                    # We'll just ignore any out of place files.
+                                    continue
+                                with z.open(entry.filename) as f:
+                                    importer.add_source_file(base_filename, target, f.read())
 
                     # Now add all the resource identifiers
                     for root_file_name, resource_info in desired_resources.items():
                         for resource in resource_info['resources']:
-                            target_platforms = json.dumps(resource['targetPlatforms']) if 'targetPlatforms' in resource else None
-                            ResourceIdentifier.objects.create(
-                                resource_file=resources_files[root_file_name],
-                                resource_id=resource['name'],
-                                target_platforms=target_platforms,
-                                # Font options
-                                character_regex=resource.get('characterRegex', None),
-                                tracking=resource.get('trackingAdjust', None),
-                                compatibility=resource.get('compatibility', None),
-                                # Bitmap options
-                                memory_format=resource.get('memoryFormat', None),
-                                storage_format=resource.get('storageFormat', None),
-                                space_optimisation=resource.get('spaceOptimization', None)
-                            )
+                            importer.add_identifier(resources_files[root_file_name], **identifier_options(resource))
 
                     # Check that at least one variant of each specified resource exists.
                     for root_file_name, loaded in file_exists_for_root.items():
                         if not loaded:
                             raise KeyError("No file was found to satisfy the manifest filename: {}".format(root_file_name))
-                    project.save()
-                    send_td_event('cloudpebble_zip_import_succeeded', project=project)
+                    importer.commit()
+                    send_td_event('cloudpebble_zip_import_succeeded', data={
+                        'data': {
+                            'files': importer.file_count,
+                            'timings': importer.timings
+                        }
+                    }, project=project)
 
         # At this point we're supposed to have successfully created the project.
         return True
@@ -349,3 +535,6 @@ def do_import_archive(project_id, archive, delete_project=False):
             }
         }, user=project.owner)
         raise
+    finally:
+        if staged:
+            uploads.discard_upload(archive)
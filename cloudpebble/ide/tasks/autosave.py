@@ -0,0 +1,32 @@
+from celery import shared_task
+
+from ide.models.files import SourceFile
+from ide.utils import autosave
+
+
+# Only acknowledged once it has run, so that a flush which dies with its worker is delivered again.
+@shared_task(ignore_result=True, acks_late=True)
+def flush_autosave(file_id):
+    """ Write a buffered editor save to storage once the file has stopped changing. """
+    entry = autosave.get_entry(file_id)
+    if entry is not None and entry['dirty']:
+        wait = autosave.seconds_until_due(entry)
+        if wait > 0:
+            # The file was saved again since this flush was scheduled, so wait for it to go quiet.
+            autosave.keep_pending(file_id)
+            flush_autosave.apply_async(args=[file_id], countdown=wait)
+            return
+    # Clear the marker before flushing, so that a save which arrives while we are writing schedules another flush.
+    autosave.clear_pending(file_id)
+    try:
+        source_file = SourceFile.objects.select_related('project').get(pk=file_id)
+    except SourceFile.DoesNotExist:
+        autosave.discard(file_id)
+        return
+    autosave.flush(source_file)
+
+
+@shared_task(ignore_result=True)
+def sweep_autosaves():
+    """ Queue flushes again for buffered saves whose flush task was lost, before they expire. """
+    autosave.reschedule_stranded()
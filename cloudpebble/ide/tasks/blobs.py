@@ -0,0 +1,57 @@
+import logging
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.utils.timezone import now
+
+from ide.models.s3file import ContentBlob
+from utils.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(ignore_result=True)
+def collect_unreferenced_blobs(limit=1000):
+    """ Delete blobs which nothing has referred to for at least BLOB_GC_GRACE_PERIOD seconds. """
+    cutoff = now() - timedelta(seconds=settings.BLOB_GC_GRACE_PERIOD)
+    candidates = ContentBlob.objects.filter(refcount__lte=0, released__lt=cutoff).values_list('pk', flat=True)
+    deleted = 0
+    for sha256 in list(candidates[:limit]):
+        try:
+            if ContentBlob.delete_if_unreferenced(sha256):
+                deleted += 1
+        except Exception:
+            logger.exception("Failed to delete blob %s", sha256)
+    logger.info("Deleted %d unreferenced blobs", deleted)
+    return deleted
+
+
+def _orphans(paths):
+    """ :param paths: A dictionary of blob key -> stored path
+    :return: The paths of those blobs which have no row """
+    existing = set(ContentBlob.objects.filter(pk__in=list(paths)).values_list('pk', flat=True))
+    return [path for sha256, path in paths.items() if sha256 not in existing]
+
+
+@shared_task(ignore_result=True)
+def sweep_orphaned_blob_contents(batch_size=1000):
+    """ Delete stored blob contents which have no ContentBlob row. These are left behind when a transaction which
+    created blobs rolls back, since their contents are written before it commits. Only contents older than
+    BLOB_GC_GRACE_PERIOD are considered, so that blobs whose transactions are still open are left alone. """
+    cutoff = now() - timedelta(seconds=settings.BLOB_GC_GRACE_PERIOD)
+    storage = get_storage()
+    orphans = []
+    batch = {}
+    for path, modified in storage.list(ContentBlob.bucket_name, 'blobs/'):
+        if modified < cutoff:
+            batch[path.rsplit('/', 1)[-1]] = path
+        if len(batch) >= batch_size:
+            orphans += _orphans(batch)
+            batch = {}
+    if batch:
+        orphans += _orphans(batch)
+    if orphans:
+        storage.delete_many(ContentBlob.bucket_name, orphans)
+    logger.info("Deleted %d orphaned blob contents", len(orphans))
+    return len(orphans)
@@ -14,6 +14,7 @@ from django.utils.timezone import now
 import apptools.addr2lines
 from ide.models.build import BuildResult, BuildSize
 from ide.models.dependency import validate_dependency_version
+from ide.utils import autosave
 from ide.utils.sdk.project_assembly import assemble_project
 from utils.td_helper import send_td_event
 
@@ -63,6 +64,9 @@ def run_compile(build_result):
     build_result = BuildResult.objects.get(pk=build_result)
     project = build_result.project
 
+    # Make sure the build sees anything the editor has saved but not yet written out.
+    autosave.flush_project(project)
+
     # Assemble the project somewhere
     base_dir = tempfile.mkdtemp(dir=os.path.join(settings.CHROOT_ROOT, 'tmp') if settings.CHROOT_ROOT else None)
 
@@ -1,30 +1,29 @@
 import json
 
-import github
 from celery import shared_task
+from github import UnknownObjectException
 from django.db import transaction
 from django.conf import settings
 
 from ide.models.user import User
 from ide.models.project import Project
 from ide.utils.sdk import load_manifest_dict
-from ide.models.files import SourceFile, ResourceFile, ResourceIdentifier, ResourceVariant
+from ide.models.files import ResourceVariant
 from ide.utils.project import APPINFO_MANIFEST, PACKAGE_MANIFEST
 from ide.utils import generate_half_uuid
+from ide.utils.bulk_import import ProjectImport
+from ide.utils.gist import get_gist, read_raw
 from utils.td_helper import send_td_event
 from collections import defaultdict
-from urllib.request import urlopen, Request
-from urllib.error import URLError, HTTPError
 
 
 @shared_task(acks_late=True)
 def import_gist(user_id, gist_id):
     user = User.objects.get(pk=user_id)
-    g = github.Github()
 
     try:
-        gist = g.get_gist(gist_id)
-    except github.UnknownObjectException:
+        gist = get_gist(gist_id)
+    except UnknownObjectException:
         send_td_event('cloudpebble_gist_not_found', data={'data': {'gist_id': gist_id}}, user=user)
         raise Exception("Couldn't find gist to import.")
 
@@ -97,6 +96,7 @@ def import_gist(user_id, gist_id):
         project = Project.objects.create(**project_settings)
         project.set_dependencies(dependencies)
         project_type = project.project_type
+        importer = ProjectImport(project)
 
         if project_type == 'package':
             raise Exception("Gist imports are not yet support for packages.")
@@ -114,8 +114,7 @@ def import_gist(user_id, gist_id):
                 elif project_type == 'rocky':
                     if filename == 'app.js':
                         target = 'pkjs'
-                source_file = SourceFile.objects.create(project=project, file_name=filename, target=target)
-                source_file.save_text(gist.files[filename].content)
+                importer.add_source_file(filename, target, gist.files[filename].content)
 
             resources = {}
             for resource in media:
@@ -133,14 +132,14 @@ def import_gist(user_id, gist_id):
                     continue
 
                 if filename not in resources:
-                    resources[filename] = ResourceFile.objects.create(project=project, file_name=filename, kind=kind,
-                                                                      is_menu_icon=is_menu_icon)
+                    resources[filename] = importer.add_resource_file(filename, kind, is_menu_icon=is_menu_icon)
                     # We already have this as a unicode string in .content, but it shouldn't have become unicode
                     # in the first place.
-                    default_variant = ResourceVariant.objects.create(resource_file=resources[filename], tags=ResourceVariant.TAGS_DEFAULT)
-                    default_variant.save_file(urlopen(gist.files[filename].raw_url))
-                ResourceIdentifier.objects.create(
-                    resource_file=resources[filename],
+                    with importer.timed('read'):
+                        data = read_raw(gist, filename)
+                    importer.add_variant(resources[filename], ResourceVariant.TAGS_DEFAULT, data)
+                importer.add_identifier(
+                    resources[filename],
                     resource_id=def_name,
                     character_regex=regex,
                     tracking=tracking,
@@ -150,8 +149,14 @@ def import_gist(user_id, gist_id):
                     space_optimisation=space_optimisation
                 )
         else:
-            source_file = SourceFile.objects.create(project=project, file_name='app.js')
-            source_file.save_text(gist.files['simply.js'].content)
-
-    send_td_event('cloudpebble_gist_import', data={'data': {'gist_id': gist_id}}, project=project)
+            importer.add_source_file('app.js', 'app', gist.files['simply.js'].content)
+        importer.commit()
+
+    send_td_event('cloudpebble_gist_import', data={
+        'data': {
+            'gist_id': gist_id,
+            'revision': gist.revision,
+            'timings': importer.timings
+        }
+    }, project=project)
     return project.id
@@ -1,4 +1,3 @@
-import base64
 from urllib.request import urlopen, Request
 from urllib.error import URLError, HTTPError
 import json
@@ -6,17 +5,24 @@ import os
 import logging
 
 from celery import shared_task
+from django.conf import settings
+from django.db import transaction
 from django.utils.timezone import now
-from github.GithubObject import NotSet
-from github import Github, GithubException, InputGitTreeElement
+from github import GithubException, InputGitTreeElement
 
-from ide.git import git_auth_check, get_github
+from ide.git import git_auth_check, get_github, CachingGithub
 from ide.models.build import BuildResult
 from ide.models.project import Project
+from ide.models.files import SourceFile, ResourceFile, ResourceVariant, ResourceIdentifier
+from ide.models.s3file import batched_deletes
+from ide.models.snapshot import read_project_contents
 from ide.tasks import do_import_archive, run_compile
-from ide.utils.git import git_sha, git_blob
-from ide.utils.project import find_project_root_and_manifest, BaseProjectItem, InvalidProjectArchiveException
-from ide.utils.sdk import generate_manifest_dict, generate_manifest, generate_wscript_file, manifest_name_for_project
+from ide.tasks.archive import apply_manifest, plan_resources, identifier_options, get_filename_variant
+from ide.utils import autosave, uploads
+from ide.utils.git import git_sha, git_blob, create_git_blobs, read_git_blobs
+from ide.utils.project import find_project_root_and_manifest, BaseProjectItem, InvalidProjectArchiveException, MANIFEST_KINDS
+from ide.utils.sdk import generate_manifest_dict, generate_manifest, generate_wscript_file, manifest_name_for_project, load_manifest_dict
+from utils.redis_helper import redis_client
 from utils.td_helper import send_td_event
 
 __author__ = 'katharine'
@@ -60,7 +66,8 @@ def do_import_github(project_id, github_user, github_project, github_branch, del
                 % (github_user, github_project, github_branch)
             )
 
-        return do_import_archive(project_id, archive.read())
+        with uploads.spool(archive) as archive_file:
+            return do_import_archive(project_id, archive_file)
     except Exception as e:
         if delete_project and project is not None:
             try:
@@ -102,16 +109,29 @@ def get_authenticated_archive_url(user, github_user, github_project, github_bran
 
 @git_auth_check
 def github_push(user, commit_message, repo_name, project):
-    g = Github(user.github_repo_sync.token)
-    repo = g.get_repo(repo_name)
+    autosave.flush_project(project)
+    cached = CachingGithub(user)
+    g = cached.github
+    repo = cached.get_repo(repo_name)
     try:
-        branch = repo.get_branch(project.github_branch or repo.default_branch)
+        branch = cached.get_branch(repo, project.github_branch or repo.default_branch)
     except GithubException:
         raise Exception("Unable to get branch.")
-    commit = repo.get_git_commit(branch.commit.sha)
-    tree = repo.get_git_tree(commit.tree.sha, recursive=True)
+    commit = cached.get_git_commit(repo, branch.commit.sha)
+    tree = cached.get_git_tree(repo, commit.tree.sha)
 
-    next_tree = {x.path: InputGitTreeElement(path=x.path, mode=x.mode, type=x.type, sha=x.sha) for x in tree.tree}
+    # Only the entries which change are sent; everything else is kept from the current tree.
+    remote_tree = {x.path: x for x in tree.tree}
+    changes = {}
+
+    def change(path, mode='100644', **kwargs):
+        if path in remote_tree:
+            mode = remote_tree[path].mode
+        changes[path] = InputGitTreeElement(path=path, mode=mode, type='blob', **kwargs)
+
+    def delete(path):
+        item = remote_tree[path]
+        changes[path] = InputGitTreeElement(path=path, mode=item.mode, type=item.type, sha=None)
 
     try:
         root, manifest_item = find_project_root_and_manifest([GitProjectItem(repo, x) for x in tree.tree])
@@ -122,80 +142,63 @@ def github_push(user, commit_message, repo_name, project):
     expected_paths = set()
 
     def update_expected_paths(new_path):
-        # This adds the path *and* its parent directories to the list of expected paths.
-        # The parent directories are already keys in next_tree, so if they aren't present in expected_paths
-        # then, when iterating over next_tree to see which files have been deleted, we would have to treat
-        # directories as special cases.
+        # This adds the path *and* its parent directories to the list of expected paths, so that directories
+        # don't need to be treated as special cases when looking for deleted files.
         split_path = new_path.split('/')
         expected_paths.update('/'.join(split_path[:p]) for p in range(2, len(split_path) + 1))
 
-    project_sources = project.source_files.all()
-    has_changed = False
-    for source in project_sources:
-        repo_path = os.path.join(root, source.project_path)
+    project_sources = list(project.source_files.all())
+    resources = project.resources.all()
+    variants = [(res, variant) for res in resources for variant in res.variants.all()]
+    resource_root = project.resources_path
+    source_paths = [(source, os.path.join(root, source.project_path)) for source in project_sources]
+    variant_paths = [(variant, os.path.join(resource_root, variant.path)) for res, variant in variants]
+
+    # Files whose stored git SHA matches the remote tree are unchanged, so only the rest need to be read.
+    to_read = [f for f, repo_path in source_paths + variant_paths
+               if f.git_sha is None or repo_path not in remote_tree or f.git_sha != remote_tree[repo_path].sha]
+    contents = read_project_contents(project, to_read)
+    store_git_shas(contents)
+
+    def current_sha(f):
+        return git_sha(contents[f]) if f in contents else f.git_sha
 
+    # Binary contents are uploaded as blobs, all together once every change is known.
+    new_blobs = {}
+    for source, repo_path in source_paths:
         update_expected_paths(repo_path)
-        our_content = source.get_contents()
-        if repo_path not in next_tree:
-            has_changed = True
-            if isinstance(our_content, bytes):
-                blob = repo.create_git_blob(base64.b64encode(our_content).decode('ascii'), 'base64')
-                logger.debug("Created blob %s for binary source %s", blob.sha, repo_path)
-                next_tree[repo_path] = InputGitTreeElement(path=repo_path, mode='100644', type='blob', sha=blob.sha)
-            else:
-                next_tree[repo_path] = InputGitTreeElement(path=repo_path, mode='100644', type='blob',
-                                                           content=our_content)
-            logger.debug("New file: %s", repo_path)
+        if repo_path in remote_tree and current_sha(source) == remote_tree[repo_path].sha:
+            continue
+        logger.debug("%s file: %s", "Updated" if repo_path in remote_tree else "New", repo_path)
+        our_content = contents[source]
+        if isinstance(our_content, bytes):
+            new_blobs[repo_path] = our_content
         else:
-            sha = next_tree[repo_path]._InputGitTreeElement__sha
-            expected_sha = git_sha(our_content)
-            if expected_sha != sha:
-                logger.debug("Updated file: %s", repo_path)
-                if isinstance(our_content, bytes):
-                    blob = repo.create_git_blob(base64.b64encode(our_content).decode('ascii'), 'base64')
-                    logger.debug("Created blob %s for binary source %s", blob.sha, repo_path)
-                    next_tree[repo_path]._InputGitTreeElement__content = NotSet
-                    next_tree[repo_path]._InputGitTreeElement__sha = blob.sha
-                else:
-                    next_tree[repo_path]._InputGitTreeElement__sha = NotSet
-                    next_tree[repo_path]._InputGitTreeElement__content = our_content
-                has_changed = True
+            change(repo_path, content=our_content)
 
     # Now try handling resource files.
-    resources = project.resources.all()
-    resource_root = project.resources_path
-    for res in resources:
-        for variant in res.variants.all():
-            repo_path = os.path.join(resource_root, variant.path)
-            update_expected_paths(repo_path)
-            if repo_path in next_tree:
-                content = variant.get_contents()
-                if git_sha(content) != next_tree[repo_path]._InputGitTreeElement__sha:
-                    logger.debug("Changed resource: %s", repo_path)
-                    has_changed = True
-                    blob = repo.create_git_blob(base64.b64encode(content).decode('ascii'), 'base64')
-                    logger.debug("Created blob %s", blob.sha)
-                    next_tree[repo_path]._InputGitTreeElement__sha = blob.sha
-            else:
-                logger.debug("New resource: %s", repo_path)
-                has_changed = True
-                blob = repo.create_git_blob(base64.b64encode(variant.get_contents()).decode('ascii'), 'base64')
-                logger.debug("Created blob %s", blob.sha)
-                next_tree[repo_path] = InputGitTreeElement(path=repo_path, mode='100644', type='blob', sha=blob.sha)
+    for variant, repo_path in variant_paths:
+        update_expected_paths(repo_path)
+        if repo_path in remote_tree and current_sha(variant) == remote_tree[repo_path].sha:
+            continue
+        logger.debug("%s resource: %s", "Changed" if repo_path in remote_tree else "New", repo_path)
+        new_blobs[repo_path] = content_bytes(contents[variant])
+
+    for repo_path, sha in create_git_blobs(g, repo, new_blobs, settings.GITHUB_BLOB_CONCURRENCY).items():
+        logger.debug("Created blob %s for %s", sha, repo_path)
+        change(repo_path, sha=sha)
 
-    # Manage deleted files
+    # Manage deleted files. Directories disappear along with the last file in them.
     src_root = os.path.join(root, 'src')
     worker_src_root = os.path.join(root, 'worker_src')
-    paths_to_remove = []
-    for path in next_tree.keys():
+    for path, item in remote_tree.items():
+        if item.type == 'tree':
+            continue
         if not (any(path.startswith(root+'/') for root in (src_root, resource_root, worker_src_root))):
             continue
         if path not in expected_paths:
-            paths_to_remove.append(path)
-    for path in paths_to_remove:
-        del next_tree[path]
-        logger.debug("Deleted file: %s", path)
-        has_changed = True
+            delete(path)
+            logger.debug("Deleted file: %s", path)
 
     # Compare the resource dicts
     remote_manifest_path = root + manifest_name_for_project(project)
@@ -206,7 +209,7 @@ def github_push(user, commit_message, repo_name, project):
         their_res_dict = their_manifest_dict.get('resources', their_manifest_dict.get('pebble', their_manifest_dict).get('resources', {'media': []}))
         # If the manifest needs a new path (e.g. it is now package.json), delete the old one
         if manifest_item.path != remote_manifest_path:
-            del next_tree[manifest_item.path]
+            delete(manifest_item.path)
     else:
         their_manifest_dict = {}
         their_res_dict = {'media': []}
@@ -216,55 +219,32 @@ def github_push(user, commit_message, repo_name, project):
 
     if our_res_dict != their_res_dict:
         logger.debug("Resources mismatch.")
-        has_changed = True
         # Try removing things that we've deleted, if any
         to_remove = set(x['file'] for x in their_res_dict['media']) - set(x['file'] for x in our_res_dict['media'])
         for path in to_remove:
             repo_path = resource_root + path
-            if repo_path in next_tree:
+            if repo_path in remote_tree:
                 logger.debug("Deleted resource: %s", repo_path)
-                del next_tree[repo_path]
+                delete(repo_path)
 
     # This one is separate because there's more than just the resource map changing.
     if their_manifest_dict != our_manifest_dict:
-        has_changed = True
-        if remote_manifest_path in next_tree:
-            next_tree[remote_manifest_path]._InputGitTreeElement__sha = NotSet
-            next_tree[remote_manifest_path]._InputGitTreeElement__content = generate_manifest(project, resources)
-        else:
-            next_tree[remote_manifest_path] = InputGitTreeElement(path=remote_manifest_path, mode='100644', type='blob',
-                                                                  content=generate_manifest(project, resources))
+        change(remote_manifest_path, content=generate_manifest(project, resources))
 
-    if project.project_type == 'native' and remote_wscript_path not in next_tree:
-        next_tree[remote_wscript_path] = InputGitTreeElement(path=remote_wscript_path, mode='100644', type='blob',
-                                                             content=generate_wscript_file(project, True))
-        has_changed = True
+    if project.project_type == 'native' and remote_wscript_path not in remote_tree:
+        change(remote_wscript_path, content=generate_wscript_file(project, True))
 
     # Add .gitignore if the repo doesn't have one
     gitignore_path = os.path.join(root, '.gitignore') if root else '.gitignore'
-    if gitignore_path not in next_tree:
-        next_tree[gitignore_path] = InputGitTreeElement(
-            path=gitignore_path, mode='100644', type='blob',
-            content="build/\nnode_modules/\n")
-        has_changed = True
+    if gitignore_path not in remote_tree:
+        change(gitignore_path, content="build/\nnode_modules/\n")
 
     # Commit the new tree.
-    if has_changed:
-        logger.debug("Has changed; committing")
-        # GitHub seems to choke if we pass the raw directory nodes off to it,
-        # so we delete those.
-        paths_to_remove = []
-        for x in next_tree.keys():
-            if next_tree[x]._InputGitTreeElement__mode == '040000':
-                paths_to_remove.append(x)
-        for path in paths_to_remove:
-            del next_tree[path]
-            logger.debug("removing subtree node %s", path)
-
-        logger.debug([x._InputGitTreeElement__mode for x in next_tree.values()])
+    if changes:
+        logger.debug("Has changed; committing %d entries", len(changes))
         branch_name = project.github_branch or repo.default_branch
         try:
-            git_tree = repo.create_git_tree(next_tree.values())
+            git_tree = repo.create_git_tree(list(changes.values()), base_tree=tree)
             logger.debug("Created tree %s", git_tree.sha)
             git_commit = repo.create_git_commit(commit_message, git_tree, [commit])
             logger.debug("Created commit %s", git_commit.sha)
@@ -295,6 +275,172 @@ def github_push(user, commit_message, repo_name, project):
     return False
 
 
+def content_bytes(content):
+    return content.encode('utf-8') if isinstance(content, str) else content
+
+
+def store_git_shas(contents):
+    """ Record the git SHAs of files which were written before git SHAs were stored, now that they have been read.
+    :param contents: A dictionary of S3File -> contents, as returned by read_project_contents()
+    """
+    missing = {}
+    for f, content in contents.items():
+        if f.git_sha is None:
+            f.git_sha = git_sha(content)
+            missing.setdefault(type(f), []).append(f)
+    for model, files in missing.items():
+        model.objects.bulk_update(files, ['git_sha'])
+
+
+def fetch_changes(github, repo, project, tree, root, manifest_item):
+    """ Work out how to bring a project up to date with a git tree by creating, updating and deleting only the files
+    which differ from it, as told by their stored git SHAs, and fetch the blobs for new or changed files.
+    Nothing is changed, so this can be done before opening the transaction which apply_changes() is called in.
+    :param root: The project's directory in the tree, as returned by find_project_root_and_manifest()
+    :param manifest_item: The project's manifest in the tree, as returned by find_project_root_and_manifest()
+    :return: A dictionary to pass to apply_changes(), or None if the project can't be updated this way and must be
+    reimported
+    """
+    manifest_kind = manifest_item.path[len(root):]
+    manifest_dict = json.loads(manifest_item.read())
+    project_options, media_map, dependencies = load_manifest_dict(manifest_dict, manifest_kind)
+    if project_options['project_type'] != project.project_type:
+        # Every file's location depends on the project type.
+        return None
+    source_files, resource_files, variants = _current_files(project)
+    if any(f.git_sha is None for f in source_files.values()) or \
+            any(v.git_sha is None for tags in variants.values() for v in tags.values()):
+        # Files written before git SHAs were stored can't be compared without reading them all.
+        return None
+
+    desired_resources = plan_resources(project, media_map)
+    resource_path = project.resources_path + '/'
+    tag_map = {v: k for k, v in ResourceVariant.VARIANT_STRINGS.items() if v}
+
+    # Find where each file in the tree belongs, as do_import_archive would.
+    remote_sources = {}
+    remote_variants = {root_file_name: {} for root_file_name in desired_resources}
+    for item in tree.tree:
+        if item.type != 'blob' or not item.path.startswith(root):
+            continue
+        filename = item.path[len(root):]
+        if filename in MANIFEST_KINDS:
+            continue
+        if filename.startswith(resource_path):
+            tags, root_file_name = get_filename_variant(filename[len(resource_path):], tag_map)
+            if root_file_name in remote_variants:
+                remote_variants[root_file_name][",".join(str(int(t)) for t in tags)] = item.sha
+        else:
+            try:
+                remote_sources[SourceFile.get_details_for_path(project.project_type, filename)] = item.sha
+            except ValueError:
+                # We'll just ignore any out of place files.
+                continue
+    for root_file_name, found in remote_variants.items():
+        if not found:
+            raise KeyError("No file was found to satisfy the manifest filename: {}".format(root_file_name))
+
+    changes = {
+        'manifest_dict': manifest_dict,
+        'manifest_kind': manifest_kind,
+        'desired_resources': desired_resources,
+        'remote_sources': remote_sources,
+        'remote_variants': remote_variants,
+        'blobs': {},
+    }
+    changes['blobs'].update(read_git_blobs(github, repo, _wanted_blobs(changes, source_files, variants),
+                                           settings.GITHUB_BLOB_CONCURRENCY))
+    return changes
+
+
+def _current_files(project):
+    source_files = {(f.file_name, f.target): f for f in project.source_files.all()}
+    resource_files = {r.file_name: r for r in project.resources.prefetch_related('variants', 'identifiers')}
+    variants = {r.file_name: {v.tags: v for v in r.variants.all()} for r in resource_files.values()}
+    return source_files, resource_files, variants
+
+
+def _wanted_blobs(changes, source_files, variants):
+    """ :return: The SHAs of the blobs which are needed to apply changes, but haven't been fetched """
+    def stored_sha(f):
+        return f.git_sha if f is not None else None
+
+    wanted = {sha for key, sha in changes['remote_sources'].items() if stored_sha(source_files.get(key)) != sha}
+    for root_file_name, found in changes['remote_variants'].items():
+        ours = variants.get(changes['desired_resources'][root_file_name]['file_name'], {})
+        wanted.update(sha for tags, sha in found.items() if stored_sha(ours.get(tags)) != sha)
+    return wanted - set(changes['blobs'])
+
+
+def apply_changes(github, repo, project, changes):
+    """ Update a project as worked out by fetch_changes(). This should be called inside a transaction.
+    :param changes: The dictionary returned by fetch_changes()
+    """
+    desired_resources = changes['desired_resources']
+    remote_sources = changes['remote_sources']
+    remote_variants = changes['remote_variants']
+    apply_manifest(project, changes['manifest_dict'], changes['manifest_kind'])
+    source_files, resource_files, variants = _current_files(project)
+    blobs = changes['blobs']
+    missing = _wanted_blobs(changes, source_files, variants)
+    if missing:
+        # Files were changed while the blobs were being fetched.
+        blobs.update(read_git_blobs(github, repo, missing, settings.GITHUB_BLOB_CONCURRENCY))
+
+    with batched_deletes():
+        for key, source in source_files.items():
+            if key not in remote_sources:
+                logger.debug("Deleted file: %s", source.file_name)
+                source.delete()
+        for (file_name, target), sha in remote_sources.items():
+            source = source_files.get((file_name, target))
+            if source is None:
+                source = SourceFile.objects.create(project=project, file_name=file_name, target=target)
+            elif source.git_sha == sha:
+                continue
+            logger.debug("Updated file: %s", file_name)
+            source.save_string(blobs[sha])
+
+        desired_file_names = {info['file_name'] for info in desired_resources.values()}
+        for file_name, resource_file in resource_files.items():
+            if file_name not in desired_file_names:
+                logger.debug("Deleted resource: %s", file_name)
+                resource_file.delete()
+        for root_file_name, info in desired_resources.items():
+            resource_file = resource_files.get(info['file_name'])
+            if resource_file is None:
+                resource_file = ResourceFile.objects.create(project=project, file_name=info['file_name'],
+                                                            kind=info['kind'], is_menu_icon=info['is_menu_icon'])
+                identifiers = []
+            else:
+                if (resource_file.kind, resource_file.is_menu_icon) != (info['kind'], info['is_menu_icon']):
+                    resource_file.kind = info['kind']
+                    resource_file.is_menu_icon = info['is_menu_icon']
+                    resource_file.save()
+                identifiers = list(resource_file.identifiers.all())
+
+            ours = variants.get(info['file_name'], {})
+            for tags, variant in ours.items():
+                if tags not in remote_variants[root_file_name]:
+                    variant.delete()
+            for tags, sha in remote_variants[root_file_name].items():
+                variant = ours.get(tags)
+                if variant is None:
+                    variant = ResourceVariant.objects.create(resource_file=resource_file, tags=tags)
+                elif variant.git_sha == sha:
+                    continue
+                logger.debug("Updated resource: %s", variant.path)
+                variant.save_string(blobs[sha])
+
+            desired_identifiers = [identifier_options(resource) for resource in info['resources']]
+            current_identifiers = [{field: getattr(identifier, field) for field in options}
+                                   for identifier, options in zip(identifiers, desired_identifiers)]
+            if len(identifiers) != len(desired_identifiers) or current_identifiers != desired_identifiers:
+                resource_file.identifiers.all().delete()
+                for options in desired_identifiers:
+                    ResourceIdentifier.objects.create(resource_file=resource_file, **options)
+
+
 def get_root_path(path):
     path, extension = os.path.splitext(path)
     return path.split('~', 1)[0] + extension
@@ -304,9 +450,13 @@ class GitProjectItem(BaseProjectItem):
     def __init__(self, repo, tree_item):
         self.repo = repo
         self.git_item = tree_item
+        self._contents = None
 
     def read(self):
-        return git_blob(self.repo, self.git_item.sha)
+        # Each read is a blob fetch from GitHub, and the manifest is read again once the project root is found.
+        if self._contents is None:
+            self._contents = git_blob(self.repo, self.git_item.sha)
+        return self._contents
 
     @property
     def path(self):
@@ -315,15 +465,16 @@ class GitProjectItem(BaseProjectItem):
 
 @git_auth_check
 def github_pull(user, project):
-    g = get_github(user)
+    cached = CachingGithub(user)
+    g = cached.github
     repo_name = project.github_repo
     if repo_name is None:
         raise Exception("No GitHub repo defined.")
-    repo = g.get_repo(repo_name)
+    repo = cached.get_repo(repo_name)
     # If somehow we don't have a branch set, this will use the default branch
     branch_name = project.github_branch or repo.default_branch
     try:
-        branch = repo.get_branch(branch_name)
+        branch = cached.get_branch(repo, branch_name)
     except GithubException:
         raise Exception("Unable to get the branch.")
 
@@ -331,8 +482,8 @@ def github_pull(user, project):
         # Nothing to do.
         return False
 
-    commit = repo.get_git_commit(branch.commit.sha)
-    tree = repo.get_git_tree(commit.tree.sha, recursive=True)
+    commit = cached.get_git_commit(repo, branch.commit.sha)
+    tree = cached.get_git_tree(repo, commit.tree.sha)
 
     paths = {x.path: x for x in tree.tree}
     paths_notags = {get_root_path(x) for x in paths}
@@ -356,21 +507,35 @@ def github_pull(user, project):
         if path not in paths_notags:
             raise Exception("Resource %s not found in repo." % path)
 
-    # Now we grab the zip.
-    zip_url = repo.get_archive_link('zipball', branch_name)
-    u = urlopen(zip_url)
-
-    # And wipe the project!
-    # TODO: transaction support for file contents would be nice...
-    project.source_files.all().delete()
-    project.resources.all().delete()
-
-    # This must happen before do_import_archive or we'll stamp on its results.
-    project.github_last_commit = branch.commit.sha
-    project.github_last_sync = now()
-    project.save()
+    # Files are changed in place where possible, fetching only the blobs which differ from what is stored. The blobs
+    # are fetched before the transaction is opened, so that it isn't held open while waiting on GitHub.
+    changes = fetch_changes(g, repo, project, tree, root, manifest_item)
+    import_result = changes is not None
+    if import_result:
+        with transaction.atomic():
+            apply_changes(g, repo, project, changes)
+            project.github_last_commit = branch.commit.sha
+            project.github_last_sync = now()
+            project.save()
+
+    if not import_result:
+        # Otherwise, we grab the zip.
+        zip_url = repo.get_archive_link('zipball', branch_name)
+        u = urlopen(zip_url)
+
+        # And wipe the project!
+        # TODO: transaction support for file contents would be nice...
+        with batched_deletes():
+            project.source_files.all().delete()
+            project.resources.all().delete()
+
+        # This must happen before do_import_archive or we'll stamp on its results.
+        project.github_last_commit = branch.commit.sha
+        project.github_last_sync = now()
+        project.save()
 
-    import_result = do_import_archive(project.id, u.read())
+        with uploads.spool(u) as archive_file:
+            import_result = do_import_archive(project.id, archive_file)
 
     send_td_event('cloudpebble_github_pull', data={
         'data': {
@@ -393,8 +558,44 @@ def do_github_pull(project_id):
     return github_pull(project.owner, project)
 
 
+# How long the newest pushed commit of each project is remembered, to recognise repeated deliveries of a push hook.
+HOOK_TARGET_TTL = 24 * 3600
+
+
+def _hook_target_key(project_id):
+    return 'github-hook-target-{0}'.format(project_id)
+
+
+def _hook_pending_key(project_id):
+    return 'github-hook-pending-{0}'.format(project_id)
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def queue_hooked_commit(project_id, target_commit):
+    """ Schedule hooked_commit for a project whose branch was pushed to.
+    Only one hooked_commit is queued per project at a time; pushes which arrive before it runs just move its target,
+    so a burst of pushes costs one pull and one build.
+    :return: False if the push was a repeated delivery of the newest commit, and was ignored.
+    """
+    # Swap the target in one command, so that of two concurrent deliveries of the same push only one queues a pull.
+    previous = redis_client.set(_hook_target_key(project_id), target_commit, ex=HOOK_TARGET_TTL, get=True)
+    if _decode(previous) == target_commit:
+        return False
+    # If the task is lost, the marker expires and the next push queues a new one.
+    if redis_client.set(_hook_pending_key(project_id), 1, nx=True,
+                        ex=settings.GITHUB_HOOK_DELAY + settings.CELERY_TASK_TIME_LIMIT):
+        hooked_commit.apply_async(args=[project_id], countdown=settings.GITHUB_HOOK_DELAY)
+    return True
+
+
 @shared_task
-def hooked_commit(project_id, target_commit):
+def hooked_commit(project_id, target_commit=None):
+    # Clear the marker before pulling, so that a push which arrives while we are pulling schedules another pull.
+    redis_client.delete(_hook_pending_key(project_id))
+    target_commit = _decode(redis_client.get(_hook_target_key(project_id))) or target_commit
     project = Project.objects.select_related('owner__github').get(pk=project_id)
     did_something = False
     logger.debug("Comparing %s versus %s", project.github_last_commit, target_commit)
@@ -403,8 +604,9 @@ def hooked_commit(project_id, target_commit):
         did_something = True
 
     if project.github_hook_build:
+        # The build runs as its own task, so that this worker is free for the next pull.
         build = BuildResult.objects.create(project=project)
-        run_compile(build.id)
+        run_compile.delay(build.id)
         did_something = True
 
     return did_something
@@ -0,0 +1,86 @@
+""" These tests check that account exports are assembled from per-project archives """
+import io
+import zipfile
+
+import mock
+from django.contrib.auth.models import User
+from django.test import TestCase, SimpleTestCase
+from django.test.utils import override_settings
+
+from ide.models.files import SourceFile
+from ide.models.project import Project
+from ide.tasks import archive
+from ide.tasks.archive import export_user_projects, stream_zip, _map_concurrently
+from ide.utils.zipmerge import merge_zips
+from utils.fakes import FakeRedis
+from utils.storage import get_storage
+
+
+class TestMergeZips(SimpleTestCase):
+    def test_merge_zips(self):
+        """ Check that archives written in one pass are merged into a valid archive with renamed entries """
+        first = b''.join(stream_zip([('a/one.txt', 'one' * 100), ('a/two.txt', b'\x00two')]))
+        second = b''.join(stream_zip([('b/three.txt', 'three')]))
+        merged = b''.join(merge_zips([(io.BytesIO(first), lambda name: 'x/' + name),
+                                      (io.BytesIO(second), lambda name: 'y/' + name)]))
+        with zipfile.ZipFile(io.BytesIO(merged)) as z:
+            self.assertIsNone(z.testzip())
+            self.assertEqual(z.namelist(), ['x/a/one.txt', 'x/a/two.txt', 'y/b/three.txt'])
+            self.assertEqual(z.read('x/a/one.txt'), b'one' * 100)
+            self.assertEqual(z.read('y/b/three.txt'), b'three')
+
+    def test_map_concurrently(self):
+        results = dict(_map_concurrently(lambda x: x * 2, range(20), concurrency=4))
+        self.assertEqual(results, {x: x * 2 for x in range(20)})
+
+    def test_map_concurrently_holds_few_results(self):
+        """ Check that items are only taken up as earlier results are yielded, so few results are held at once """
+        taken = []
+
+        def items():
+            for x in range(20):
+                taken.append(x)
+                yield x
+
+        for yielded, (item, result) in enumerate(_map_concurrently(lambda x: x, items(), concurrency=4), 1):
+            self.assertLessEqual(len(taken) - yielded, 4)
+        self.assertEqual(len(taken), 20)
+
+
+@override_settings(STORAGE_BACKEND='memory', ACCOUNT_EXPORT_CONCURRENCY=1)
+class TestAccountExport(TestCase):
+    def setUp(self):
+        get_storage().reset()
+        self.user = User.objects.create_user('test', 'test@test.test', 'test')
+        self.projects = []
+        for i in range(3):
+            project = Project.objects.create(name='Project %d' % i, owner=self.user, app_short_name='project%d' % i)
+            SourceFile.objects.create(project=project, file_name='main.c').save_text('int main%d;' % i)
+            self.projects.append(project)
+        redis = mock.patch('ide.utils.autosave.redis_client', FakeRedis())
+        redis.start()
+        self.addCleanup(redis.stop)
+
+    def export(self):
+        with mock.patch.object(export_user_projects, 'update_state'):
+            result = export_user_projects.apply(args=[self.user.id])
+        self.assertTrue(result.successful(), result.traceback)
+        with zipfile.ZipFile(io.BytesIO(get_storage().read('export', result.result[len('/ide/export/'):]))) as z:
+            self.assertIsNone(z.testzip())
+            return {name: z.read(name) for name in z.namelist()}
+
+    def test_account_export(self):
+        contents = self.export()
+        for i, project in enumerate(self.projects):
+            prefix = 'cloudpebble-export/project_%d-%d/' % (i, project.id)
+            self.assertEqual(contents[prefix + 'src/c/main.c'], b'int main%d;' % i)
+            self.assertIn(prefix + 'package.json', contents)
+
+    def test_unchanged_projects_are_reused(self):
+        self.export()
+        self.projects[1].source_files.get().save_text('int changed;')
+        with mock.patch('ide.tasks.archive.export_project', wraps=archive.export_project) as export_project:
+            contents = self.export()
+        self.assertEqual([c[0][0].pk for c in export_project.call_args_list], [self.projects[1].pk])
+        self.assertEqual(contents['cloudpebble-export/project_1-%d/src/c/main.c' % self.projects[1].id],
+                         b'int changed;')
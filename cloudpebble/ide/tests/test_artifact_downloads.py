@@ -0,0 +1,200 @@
+""" These tests check that build and export artifacts are streamed with Range and HEAD support """
+import gzip
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+
+import mock
+from botocore.exceptions import ClientError
+from django.contrib.auth.models import User
+from django.test import TestCase, SimpleTestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+
+from utils.downloads import parse_range_header, resolve_range, RangeNotSatisfiable
+
+EXPORT_KEY = '0123456789abcdef0123456789abcdef/test.zip'
+CONTENT = b''.join(bytes([i % 256]) for i in range(200 * 1024))
+
+
+class TestRangeParsing(SimpleTestCase):
+    def test_parse_range_header(self):
+        """ Check that single byte ranges are parsed and anything else is ignored """
+        self.assertEqual(parse_range_header('bytes=0-99'), (0, 99))
+        self.assertEqual(parse_range_header('bytes=100-'), (100, None))
+        self.assertEqual(parse_range_header('bytes=-50'), (None, 50))
+        self.assertIsNone(parse_range_header(None))
+        self.assertIsNone(parse_range_header('bytes=0-1,5-9'))
+        self.assertIsNone(parse_range_header('bytes=9-5'))
+        self.assertIsNone(parse_range_header('lines=1-2'))
+
+    def test_resolve_range(self):
+        """ Check that ranges are clamped to the file size and out-of-range requests are rejected """
+        self.assertEqual(resolve_range((0, 99), 50), (0, 49))
+        self.assertEqual(resolve_range((None, 10), 50), (40, 49))
+        self.assertEqual(resolve_range((None, 100), 50), (0, 49))
+        with self.assertRaises(RangeNotSatisfiable):
+            resolve_range((50, None), 50)
+
+
+class DownloadTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        User.objects.create_user('test', 'test@test.test', 'test')
+        self.assertTrue(self.client.login(username='test', password='test'))
+
+
+class TestLocalExportDownload(DownloadTestCase):
+    def setUp(self):
+        super(TestLocalExportDownload, self).setUp()
+        self.storage = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.storage)
+        export_dir = os.path.join(self.storage, 'export') + '/'
+        os.makedirs(os.path.join(export_dir, os.path.dirname(EXPORT_KEY)))
+        with open(os.path.join(export_dir, EXPORT_KEY), 'wb') as f:
+            f.write(CONTENT)
+        patcher = override_settings(AWS_ENABLED=False, FILE_STORAGE=self.storage + '/', EXPORT_DIRECTORY=export_dir)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+    def test_full_download_is_streamed(self):
+        response = self.client.get('/ide/export/%s' % EXPORT_KEY)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Length'], str(len(CONTENT)))
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="test.zip"')
+        self.assertEqual(b''.join(response.streaming_content), CONTENT)
+
+    def test_range_download(self):
+        response = self.client.get('/ide/export/%s' % EXPORT_KEY, HTTP_RANGE='bytes=1000-1999')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 1000-1999/%d' % len(CONTENT))
+        self.assertEqual(b''.join(response.streaming_content), CONTENT[1000:2000])
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get('/ide/export/%s' % EXPORT_KEY, HTTP_RANGE='bytes=%d-' % len(CONTENT))
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */%d' % len(CONTENT))
+
+    def test_head(self):
+        response = self.client.head('/ide/export/%s' % EXPORT_KEY)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], str(len(CONTENT)))
+
+    def test_missing_export(self):
+        response = self.client.get('/ide/export/0123456789abcdef0123456789abcdef/missing.zip')
+        self.assertEqual(response.status_code, 404)
+
+    def test_conditional_get(self):
+        """ Check that a matching ETag or an unchanged Last-Modified date gives a 304 """
+        response = self.client.get('/ide/export/%s' % EXPORT_KEY)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        response = self.client.get('/ide/export/%s' % EXPORT_KEY, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        response = self.client.get('/ide/export/%s' % EXPORT_KEY, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/ide/export/%s' % EXPORT_KEY, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_range_mismatch_sends_whole_file(self):
+        response = self.client.get('/ide/export/%s' % EXPORT_KEY, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], str(len(CONTENT)))
+        etag = response['ETag']
+        response = self.client.get('/ide/export/%s' % EXPORT_KEY, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+
+    @override_settings(ARTIFACT_DOWNLOAD_MODE='accel', ARTIFACT_ACCEL_REDIRECT_PREFIX='/protected/')
+    def test_accel_redirect(self):
+        response = self.client.get('/ide/export/%s' % EXPORT_KEY)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/export/%s' % EXPORT_KEY)
+        self.assertEqual(response.content, b'')
+
+    @override_settings(ARTIFACT_DOWNLOAD_MODE='accel', ARTIFACT_ACCEL_REDIRECT_PREFIX='/protected/')
+    def test_accel_redirect_compressed_build_log(self):
+        """ Check that nginx is told a gzipped build log's encoding, and clients without gzip get it decoded """
+        builds_dir = os.path.join(self.storage, 'builds') + '/'
+        os.makedirs(os.path.join(builds_dir, 'some-uuid'))
+        with open(os.path.join(builds_dir, 'some-uuid', 'build_log.txt'), 'wb') as f:
+            f.write(gzip.compress(b'built'))
+        with override_settings(MEDIA_ROOT=builds_dir):
+            response = self.client.get('/s3builds/some-uuid/build_log.txt', HTTP_ACCEPT_ENCODING='gzip, deflate')
+            self.assertEqual(response['X-Accel-Redirect'], '/protected/builds/some-uuid/build_log.txt')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertIn('Accept-Encoding', response['Vary'])
+            response = self.client.get('/s3builds/some-uuid/build_log.txt')
+            self.assertFalse(response.has_header('X-Accel-Redirect'))
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertEqual(b''.join(response.streaming_content), b'built')
+
+
+class FakeBody(object):
+    def __init__(self, data):
+        self.data = data
+        self.closed = False
+
+    def iter_chunks(self, chunk_size):
+        for i in range(0, len(self.data), chunk_size):
+            yield self.data[i:i + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+@override_settings(AWS_ENABLED=True)
+class TestS3BuildsProxy(SimpleTestCase):
+    @mock.patch('utils.downloads.s3')
+    def test_streams_object(self, s3):
+        body = FakeBody(CONTENT)
+        s3.open_file.return_value = {'Body': body, 'ContentLength': len(CONTENT)}
+        response = Client().get('/s3builds/some-uuid/watchface.pbw')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), CONTENT)
+        response.close()
+        self.assertTrue(body.closed)
+        s3.read_file.assert_not_called()
+
+    @mock.patch('utils.downloads.s3')
+    def test_passes_range_to_s3(self, s3):
+        s3.open_file.return_value = {'Body': FakeBody(CONTENT[:10]), 'ContentLength': 10,
+                                     'ContentRange': 'bytes 0-9/%d' % len(CONTENT)}
+        response = Client().get('/s3builds/some-uuid/watchface.pbw', HTTP_RANGE='bytes=0-9')
+        s3.open_file.assert_called_once_with('builds', 'some-uuid/watchface.pbw', byte_range='bytes=0-9',
+                                             if_none_match=None, if_modified_since=None)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 0-9/%d' % len(CONTENT))
+
+    @mock.patch('utils.downloads.s3')
+    def test_head_does_not_fetch_body(self, s3):
+        s3.head_file.return_value = {'ContentLength': len(CONTENT)}
+        response = Client().head('/s3builds/some-uuid/watchface.pbw')
+        self.assertEqual(response['Content-Length'], str(len(CONTENT)))
+        s3.open_file.assert_not_called()
+
+    @mock.patch('utils.downloads.s3')
+    def test_cache_headers(self, s3):
+        s3.open_file.return_value = {'Body': FakeBody(CONTENT), 'ContentLength': len(CONTENT), 'ETag': '"abc"',
+                                     'LastModified': datetime(2016, 1, 1, tzinfo=timezone.utc)}
+        response = Client().get('/s3builds/some-uuid/watchface.pbw')
+        self.assertEqual(response['ETag'], '"abc"')
+        self.assertEqual(response['Last-Modified'], 'Fri, 01 Jan 2016 00:00:00 GMT')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+    @mock.patch('utils.downloads.s3')
+    def test_not_modified(self, s3):
+        """ Check that the client's ETag is passed to S3 and a 304 from S3 is passed back """
+        s3.open_file.side_effect = ClientError({'Error': {'Code': '304'},
+                                                'ResponseMetadata': {'HTTPHeaders': {'etag': '"abc"'}}}, 'GetObject')
+        response = Client().get('/s3builds/some-uuid/watchface.pbw', HTTP_IF_NONE_MATCH='"abc"')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], '"abc"')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(s3.open_file.call_args[1]['if_none_match'], '"abc"')
+
+    @mock.patch('utils.downloads.s3')
+    def test_missing_object(self, s3):
+        s3.open_file.side_effect = ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        response = Client().get('/s3builds/some-uuid/watchface.pbw')
+        self.assertEqual(response.status_code, 404)
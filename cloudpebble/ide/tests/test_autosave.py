@@ -0,0 +1,115 @@
+""" These tests check that editor autosaves are buffered in Redis and written to storage when flushed """
+import json
+import time
+
+import mock
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+
+from ide.models.files import SourceFile
+from ide.models.s3file import ContentBlob
+from ide.models.project import Project
+from ide.tasks.autosave import flush_autosave, sweep_autosaves
+from ide.utils import autosave
+from utils.fakes import FakeRedis, FakeS3
+
+fake_s3 = FakeS3()
+
+
+@override_settings(AWS_ENABLED=True, AUTOSAVE_BUFFER_ENABLED=True, AUTOSAVE_FLUSH_DELAY=10, AUTOSAVE_MAX_FLUSH_DELAY=60)
+class TestAutosave(TestCase):
+    def setUp(self):
+        fake_s3.reset()
+        self.redis = FakeRedis()
+        for patcher in (mock.patch('utils.storage.s3', fake_s3),
+                        mock.patch('ide.utils.autosave.redis_client', self.redis)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.apply_async = mock.patch('ide.tasks.autosave.flush_autosave.apply_async').start()
+        self.addCleanup(mock.patch.stopall)
+
+        user = User.objects.create_user('test', 'test@test.test', 'test')
+        self.client = Client()
+        self.assertTrue(self.client.login(username='test', password='test'))
+        self.project = Project.objects.create(name='test', owner=user)
+        self.source_file = SourceFile.objects.create(project=self.project, file_name='main.c')
+        self.source_file.save_text('original')
+        self.modified = time.mktime(SourceFile.objects.get(pk=self.source_file.pk).last_modified.utctimetuple())
+
+    def save(self, content, folded_lines='[]'):
+        """ Save the file as the editor would, passing back the modification time from the last save """
+        url = '/ide/project/%d/source/%d/save' % (self.project.id, self.source_file.id)
+        result = json.loads(self.client.post(url, {
+            'content': content,
+            'folded_lines': folded_lines,
+            'modified': int(self.modified)
+        }).content)
+        self.assertTrue(result['success'], result.get('error'))
+        self.modified = result['modified']
+
+    def load(self):
+        url = '/ide/project/%d/source/%d/load' % (self.project.id, self.source_file.id)
+        return json.loads(self.client.get(url).content)
+
+    def stored_contents(self):
+        source_file = SourceFile.objects.get(pk=self.source_file.pk)
+        return ContentBlob.decode(source_file.blob_id, fake_s3.read_file('source', source_file.s3_path))
+
+    def test_saves_are_buffered(self):
+        """ Check that repeated saves do not touch storage, schedule one flush and are visible to reads """
+        with mock.patch.object(fake_s3, 'save_file') as save_file:
+            self.save('one')
+            self.save('two', folded_lines='[1]')
+        save_file.assert_not_called()
+        self.assertEqual(self.apply_async.call_count, 1)
+        loaded = self.load()
+        self.assertEqual(loaded['source'], 'two')
+        self.assertEqual(loaded['folded_lines'], [1])
+        self.assertEqual(SourceFile.objects.get(pk=self.source_file.pk).get_contents(), 'two')
+
+    def test_flush_writes_latest_save(self):
+        self.save('one')
+        self.save('two', folded_lines='[3]')
+        with mock.patch('ide.utils.autosave.time.time', return_value=time.time() + 11):
+            flush_autosave(self.source_file.id)
+        self.assertEqual(self.stored_contents(), b'two')
+        self.assertEqual(SourceFile.objects.get(pk=self.source_file.pk).folded_lines, '[3]')
+        self.assertFalse(autosave.get_entry(self.source_file.id)['dirty'])
+
+    def test_flush_waits_for_quiet(self):
+        """ Check that a flush which fires while the file is still being edited reschedules itself """
+        self.save('one')
+        self.apply_async.reset_mock()
+        flush_autosave(self.source_file.id)
+        self.assertEqual(self.stored_contents(), b'original')
+        self.assertEqual(self.apply_async.call_count, 1)
+
+    def test_sweep_requeues_lost_flush(self):
+        """ Check that the sweep queues a flush for a save whose flush task was lost, and then forgets the file """
+        self.save('one')
+        sweep_autosaves()
+        self.assertEqual(self.apply_async.call_count, 1)
+        # The pending marker expires once the lost task should have run.
+        self.redis.delete('autosave-pending-%d' % self.source_file.id)
+        sweep_autosaves()
+        self.assertEqual(self.apply_async.call_count, 2)
+        self.apply_async.assert_called_with(args=[self.source_file.id], countdown=10)
+        with mock.patch('ide.utils.autosave.time.time', return_value=time.time() + 11):
+            flush_autosave(self.source_file.id)
+        self.assertEqual(self.stored_contents(), b'one')
+        sweep_autosaves()
+        self.assertEqual(self.apply_async.call_count, 2)
+        self.assertEqual(self.redis.smembers(autosave.DIRTY_SET_KEY), set())
+
+    def test_flush_project(self):
+        self.save('buffered')
+        autosave.flush_project(self.project)
+        self.assertEqual(self.stored_contents(), b'buffered')
+
+    def test_direct_write_discards_buffer(self):
+        self.save('buffered')
+        SourceFile.objects.get(pk=self.source_file.pk).save_text('from git')
+        self.assertIsNone(autosave.get_entry(self.source_file.id))
+        self.assertEqual(self.load()['source'], 'from git')
@@ -0,0 +1,63 @@
+""" These tests check that build listings take a fixed number of queries, and page back through a project's builds """
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
+
+from ide.models.build import BuildResult, BuildSize
+from ide.models.project import Project
+
+
+class TestBuildHistory(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('test', 'test@test.test', 'test')
+        self.project = Project.objects.create(name='test', owner=self.user, app_short_name='test')
+        self.client = Client()
+        self.client.login(username='test', password='test')
+        self.builds = []
+
+    def add_builds(self, count):
+        for i in range(count):
+            build = BuildResult.objects.create(project=self.project, state=BuildResult.STATE_SUCCEEDED)
+            for platform in ('aplite', 'basalt'):
+                BuildSize.objects.create(build=build, platform=platform, total_size=i)
+            self.builds.append(build)
+
+    def get(self, path, **params):
+        response = self.client.get('/ide/project/%d/build/%s' % (self.project.id, path), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def count_queries(self, path, **params):
+        with CaptureQueriesContext(connection) as queries:
+            self.get(path, **params)
+        return len(queries)
+
+    def test_query_count_is_constant(self):
+        self.add_builds(1)
+        queries = self.count_queries('history')
+        self.add_builds(5)
+        self.assertEqual(self.count_queries('history'), queries)
+        self.assertEqual(self.count_queries('history', sizes=0), queries - 1)
+        history = self.get('history')['builds']
+        self.assertEqual(history[0]['id'], self.builds[-1].id)
+        self.assertEqual(set(history[0]['sizes']), {'aplite', 'basalt'})
+
+    def test_history_pages(self):
+        self.add_builds(12)
+        first = self.get('history')
+        self.assertEqual(len(first['builds']), 10)
+        second = self.get('history', cursor=first['next'])
+        self.assertIsNone(second['next'])
+        self.assertEqual([b['id'] for b in first['builds'] + second['builds']],
+                         [b.id for b in reversed(self.builds)])
+        self.assertEqual(len(self.get('history', limit=3)['builds']), 3)
+
+    def test_sizes_can_be_omitted(self):
+        self.add_builds(1)
+        self.assertEqual(self.get('last')['build']['sizes']['basalt']['total'], 0)
+        self.assertNotIn('sizes', self.get('last', sizes=0)['build'])
+        info = '%d/info' % self.builds[0].id
+        self.assertIn('sizes', self.get(info)['build'])
+        self.assertNotIn('sizes', self.get(info, sizes=0)['build'])
@@ -0,0 +1,89 @@
+""" These tests check that imports create their files in bulk """
+import json
+from io import BytesIO
+from zipfile import ZipFile
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import override_settings, CaptureQueriesContext
+
+from ide.models.files import SourceFile, ResourceFile, ResourceVariant
+from ide.models.project import Project
+from ide.models.s3file import ContentBlob
+from ide.tasks.archive import do_import_archive
+from utils.storage import get_storage
+
+
+def make_archive(files, media=()):
+    appinfo = {
+        "appKeys": {},
+        "capabilities": [""],
+        "companyName": "test",
+        "longName": "test",
+        "projectType": "native",
+        "resources": {"media": list(media)},
+        "sdkVersion": "3",
+        "shortName": "test",
+        "uuid": "123e4567-e89b-42d3-a456-426655440000",
+        "versionLabel": "1.0",
+        "watchapp": {"watchface": False}
+    }
+    buf = BytesIO()
+    with ZipFile(buf, 'w') as z:
+        z.writestr('appinfo.json', json.dumps(appinfo))
+        for name, contents in files.items():
+            z.writestr(name, contents)
+    return buf.getvalue()
+
+
+@override_settings(STORAGE_BACKEND='memory')
+class TestBulkImport(TestCase):
+    def setUp(self):
+        get_storage().reset()
+        self.user = User.objects.create_user('test', 'test@test.test', 'test')
+
+    def import_archive(self, archive):
+        project = Project.objects.create(name='test', owner=self.user)
+        do_import_archive(project.id, archive)
+        return Project.objects.get(pk=project.id)
+
+    def test_import_creates_files(self):
+        project = self.import_archive(make_archive({
+            'src/main.c': 'int main;',
+            'src/other.c': 'int main;',
+            'src/js/app.js': 'var x;',
+            'resources/images/blah.png': b'\x89PNG',
+            'resources/images/blah~bw.png': b'\x89PNG~bw',
+        }, media=[{'file': 'images/blah.png', 'name': 'IMAGE_BLAH', 'type': 'bitmap'}]))
+
+        sources = {(f.file_name, f.target): f.get_contents() for f in project.source_files.all()}
+        self.assertEqual(sources, {('main.c', 'app'): 'int main;', ('other.c', 'app'): 'int main;',
+                                   ('app.js', 'pkjs'): 'var x;'})
+        resource = ResourceFile.objects.get(project=project)
+        self.assertEqual(resource.file_name, 'blah.png')
+        self.assertEqual(resource.identifiers.get().resource_id, 'IMAGE_BLAH')
+        variants = {v.tags: v.get_contents_bytes() for v in resource.variants.all()}
+        self.assertEqual(variants, {'': b'\x89PNG', str(ResourceVariant.VARIANT_MONOCHROME): b'\x89PNG~bw'})
+        # Both copies of the same contents share one blob.
+        blob_id = project.source_files.get(file_name='main.c').blob_id
+        self.assertEqual(ContentBlob.objects.get(pk=blob_id).refcount, 2)
+
+    def count_import_queries(self, file_count):
+        archive = make_archive({'src/file%d.c' % i: 'int x%d;' % i for i in range(file_count)})
+        project = Project.objects.create(name='test', owner=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            do_import_archive(project.id, archive)
+        self.assertEqual(SourceFile.objects.filter(project=project).count(), file_count)
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_file_count(self):
+        self.assertEqual(self.count_import_queries(2), self.count_import_queries(40))
+
+    def test_duplicate_files_are_rejected(self):
+        project = Project.objects.create(name='test', owner=self.user)
+        with self.assertRaises(ValidationError):
+            do_import_archive(project.id, make_archive({'src/main.c': 'a', 'src/c/main.c': 'b'}))
+        self.assertFalse(SourceFile.objects.filter(project=project).exists())
+        self.assertFalse(ContentBlob.objects.exists())
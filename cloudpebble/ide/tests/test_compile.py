@@ -51,8 +51,7 @@ const char * world(void);
 
 
 @skipIf(settings.TRAVIS, "Travis cannot run build tests")
-@mock.patch('ide.models.s3file.s3', fake_s3)
-@mock.patch('ide.models.build.s3', fake_s3)
+@mock.patch('utils.storage.s3', fake_s3)
 class TestCompile(ProjectTester):
     def test_native_SDK3_project(self):
         """ Check that an SDK 3 project (with package.json support on) builds successfully """
@@ -0,0 +1,138 @@
+""" These tests check that file contents are stored once per distinct content and collected when unreferenced """
+from datetime import timedelta
+
+import mock
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.timezone import now
+
+from ide.models.files import SourceFile, ResourceFile, ResourceVariant
+from ide.models.project import Project
+from ide.models.s3file import ContentBlob
+from ide.tasks.blobs import collect_unreferenced_blobs, sweep_orphaned_blob_contents
+from utils.fakes import FakeS3
+
+fake_s3 = FakeS3()
+
+
+@override_settings(AWS_ENABLED=True, BLOB_GC_GRACE_PERIOD=3600)
+class TestContentBlobs(TestCase):
+    def setUp(self):
+        fake_s3.reset()
+        patcher = mock.patch('utils.storage.s3', fake_s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user = User.objects.create_user('test', 'test@test.test', 'test')
+        self.project = Project.objects.create(name='test', owner=user)
+
+    def make_file(self, name, content):
+        f = SourceFile.objects.create(project=self.project, file_name=name)
+        f.save_text(content)
+        return f
+
+    def blob_keys(self):
+        return [key for key in fake_s3.dict if key[1].startswith('blobs/')]
+
+    def test_identical_contents_are_stored_once(self):
+        with mock.patch.object(fake_s3, 'save_file', wraps=fake_s3.save_file) as save_file:
+            a = self.make_file('a.c', 'same')
+            b = self.make_file('b.c', 'same')
+        self.assertEqual(save_file.call_count, 1)
+        self.assertEqual(a.s3_path, b.s3_path)
+        self.assertEqual(ContentBlob.objects.get().refcount, 2)
+        self.assertEqual(SourceFile.objects.get(pk=b.pk).get_contents(), 'same')
+
+    def test_rewriting_releases_old_blob(self):
+        f = self.make_file('a.c', 'one')
+        old_blob = f.blob_id
+        f.save_text('two')
+        self.assertEqual(ContentBlob.objects.get(pk=old_blob).refcount, 0)
+        self.assertEqual(ContentBlob.objects.get(pk=f.blob_id).refcount, 1)
+
+    def test_stale_instances_release_what_the_row_points_at(self):
+        """ Check that two saves through stale copies of a file each release the blob the other replaced """
+        f = self.make_file('a.c', 'one')
+        first = f.blob_id
+        a, b = SourceFile.objects.get(pk=f.pk), SourceFile.objects.get(pk=f.pk)
+        a.save_text('two')
+        b.save_text('three')
+        self.assertEqual(ContentBlob.objects.get(pk=first).refcount, 0)
+        self.assertEqual(ContentBlob.objects.get(pk=a.blob_id).refcount, 0)
+        self.assertEqual(ContentBlob.objects.get(pk=b.blob_id).refcount, 1)
+        self.assertEqual(SourceFile.objects.get(pk=f.pk).blob_id, b.blob_id)
+
+    def test_share_contents_copies_nothing(self):
+        resource = ResourceFile.objects.create(project=self.project, file_name='image.png', kind='png')
+        variant = ResourceVariant.objects.create(resource_file=resource, tags='')
+        variant.save_string(b'\x89PNG')
+        copy = ResourceVariant.objects.create(resource_file=resource, tags='1')
+        with mock.patch.object(fake_s3, 'save_file') as save_file, \
+                mock.patch.object(fake_s3, 'read_file') as read_file:
+            copy.share_contents(variant)
+        save_file.assert_not_called()
+        read_file.assert_not_called()
+        self.assertEqual(ContentBlob.objects.get(pk=variant.blob_id).refcount, 2)
+
+    def test_acquire_many_shares_existing_blobs(self):
+        existing = ContentBlob.acquire(b'old')
+        with mock.patch.object(fake_s3, 'save_file', wraps=fake_s3.save_file) as save_file:
+            keys = ContentBlob.acquire_many([b'old', b'new', b'new'])
+        self.assertEqual(keys[0], existing)
+        self.assertEqual([c[0][1] for c in save_file.call_args_list], [ContentBlob.path_for(keys[1])])
+        self.assertEqual(ContentBlob.objects.get(pk=existing).refcount, 2)
+        self.assertEqual(ContentBlob.objects.get(pk=keys[1]).refcount, 2)
+
+    def test_acquire_many_tolerates_concurrent_inserts(self):
+        """ Check that a blob inserted by another import after acquire_many() looked for it is shared, not
+        inserted again or uploaded twice """
+        bulk_create = ContentBlob.objects.bulk_create
+
+        def racing_bulk_create(objs, **kwargs):
+            ContentBlob.acquire(b'racing')
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(ContentBlob.objects, 'bulk_create', side_effect=racing_bulk_create), \
+                mock.patch.object(fake_s3, 'save_file', wraps=fake_s3.save_file) as save_file:
+            keys = ContentBlob.acquire_many([b'racing', b'new'])
+        self.assertEqual([c[0][1] for c in save_file.call_args_list], [ContentBlob.path_for(k) for k in keys])
+        self.assertEqual(ContentBlob.objects.get(pk=keys[0]).refcount, 2)
+        self.assertEqual(ContentBlob.objects.get(pk=keys[1]).refcount, 1)
+        self.assertEqual(ContentBlob.decode(keys[0], fake_s3.read_file('source', ContentBlob.path_for(keys[0]))),
+                         b'racing')
+
+    def test_garbage_collection(self):
+        """ Check that unreferenced blobs are deleted only after the grace period, and referenced ones never are """
+        self.make_file('a.c', 'kept')
+        self.make_file('b.c', 'dropped').delete()
+        self.assertEqual(collect_unreferenced_blobs(), 0)
+        ContentBlob.objects.filter(refcount=0).update(released=now() - timedelta(hours=2))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(collect_unreferenced_blobs(), 1)
+        self.assertEqual(list(ContentBlob.objects.values_list('refcount', flat=True)), [1])
+        self.assertEqual(len(self.blob_keys()), 1)
+
+    def test_blobs_in_use_are_never_collected(self):
+        """ Check that a blob whose refcount has drifted to zero keeps its contents while a file refers to it """
+        f = self.make_file('a.c', 'kept')
+        ContentBlob.objects.update(refcount=0, released=now() - timedelta(hours=2))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(collect_unreferenced_blobs(), 0)
+        self.assertTrue(ContentBlob.objects.filter(pk=f.blob_id).exists())
+        self.assertEqual(SourceFile.objects.get(pk=f.pk).get_contents(), 'kept')
+
+    def test_rolled_back_contents_are_swept(self):
+        kept = self.make_file('a.c', 'kept')
+        try:
+            with transaction.atomic():
+                self.make_file('b.c', 'rolled back')
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(len(self.blob_keys()), 2)
+        self.assertEqual(sweep_orphaned_blob_contents(), 0)
+        for key in fake_s3.modified:
+            fake_s3.modified[key] -= timedelta(hours=2)
+        self.assertEqual(sweep_orphaned_blob_contents(), 1)
+        self.assertEqual(self.blob_keys(), [('source', kept.s3_path)])
@@ -28,8 +28,7 @@ class ExportTester(CloudpebbleTestCase):
         self.assertSetEqual(filenames, expected_filenames)
 
 
-@mock.patch('ide.tasks.archive.s3', fake_s3)
-@mock.patch('ide.models.s3file.s3', fake_s3)
+@mock.patch('utils.storage.s3', fake_s3)
 class TestExport(ExportTester):
     def test_export_sdk_3_project(self):
         """ Ceck that SDK3 projects are exported with package.json files """
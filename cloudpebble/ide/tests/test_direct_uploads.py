@@ -0,0 +1,116 @@
+""" These tests check that files uploaded straight to storage can be attached to projects """
+import json
+
+import mock
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+
+from ide.models.files import ResourceFile, SourceFile
+from ide.models.project import Project
+from ide.utils import uploads
+from ide.utils.git import git_sha
+from utils.storage import get_storage
+
+
+@override_settings(STORAGE_BACKEND='memory')
+class TestDirectUploads(TestCase):
+    def setUp(self):
+        get_storage().reset()
+        self.user = User.objects.create_user('test', 'test@test.test', 'test')
+        self.project = Project.objects.create(name='test', owner=self.user, app_short_name='test')
+        self.client = Client()
+        self.client.login(username='test', password='test')
+
+    def upload(self, content):
+        response = self.client.post('/ide/project/%d/request_upload' % self.project.id)
+        upload = response.json()['upload']
+        # Memory storage can't be posted to directly, so the upload is staged through Django.
+        self.assertEqual(upload['fields'], {})
+        response = self.client.post(upload['url'], {'file': SimpleUploadedFile('file', content)})
+        self.assertTrue(response.json()['success'])
+        return upload['token']
+
+    def create_resource(self, token, kind='raw', file_name='data.bin'):
+        return self.client.post('/ide/project/%d/create_resource' % self.project.id, {
+            'kind': kind,
+            'resource_ids': json.dumps([{'id': 'DATA'}]),
+            'file_name': file_name,
+            'new_tags': json.dumps([]),
+            'upload_token': token
+        }).json()
+
+    def test_create_resource_from_upload(self):
+        result = self.create_resource(self.upload(b'\x00data'))
+        self.assertTrue(result['success'], result.get('error'))
+        variant = ResourceFile.objects.get(project=self.project).variants.get()
+        self.assertEqual(variant.get_contents_bytes(), b'\x00data')
+        # The staged copy is cleaned up once it's attached.
+        self.assertEqual([key for key in get_storage().keys('source') if key.startswith(uploads.STAGING_PREFIX)], [])
+
+    def test_create_binary_source_file_from_upload(self):
+        Project.objects.filter(pk=self.project.pk).update(project_type='alloy')
+        token = self.upload(b'\x89PNG')
+        result = self.client.post('/ide/project/%d/create_binary_source_file' % self.project.id, {
+            'name': 'assets/image.png',
+            'target': 'embeddedjs',
+            'upload_token': token
+        }).json()
+        self.assertTrue(result['success'], result.get('error'))
+        source_file = SourceFile.objects.get(project=self.project)
+        self.assertEqual(source_file.get_contents_bytes(), b'\x89PNG')
+        self.assertEqual(source_file.git_sha, git_sha(b'\x89PNG'))
+
+    def test_uploads_are_not_fetched_whole(self):
+        """ Check that claiming an upload only checks its size, and that its blob is copied within storage """
+        token = self.upload(b'\x00data' * 1000)
+        storage = get_storage()
+        with mock.patch.object(storage, 'read', side_effect=AssertionError):
+            key = uploads.claim_upload(token, self.user, self.project)
+        variant = ResourceFile.objects.create(project=self.project, file_name='data.bin', kind='raw')\
+            .variants.create(tags='')
+        with mock.patch.object(storage, 'copy', wraps=storage.copy) as copy:
+            variant.save_staged(key)
+        self.assertEqual(copy.call_args[0][1], key)
+        self.assertEqual(variant.get_contents_bytes(), b'\x00data' * 1000)
+        self.assertEqual(variant.git_sha, git_sha(b'\x00data' * 1000))
+
+    def test_other_users_token_is_rejected(self):
+        token = self.upload(b'data')
+        other = User.objects.create_user('other', 'other@test.test', 'other')
+        other_project = Project.objects.create(name='other', owner=other, app_short_name='other')
+        with self.assertRaises(uploads.UploadError):
+            uploads.claim_upload(token, other, other_project)
+        # Nor can the token be used for another of the same user's projects.
+        with self.assertRaises(uploads.UploadError):
+            uploads.claim_upload(token, self.user, Project.objects.create(name='second', owner=self.user))
+
+    def test_missing_upload_is_rejected(self):
+        token = uploads.request_upload(self.user, self.project)['token']
+        result = self.create_resource(token)
+        self.assertFalse(result['success'])
+        self.assertFalse(ResourceFile.objects.filter(project=self.project).exists())
+
+    def test_oversized_upload_is_rejected(self):
+        token = uploads.request_upload(self.user, self.project)['token']
+        key = uploads.staged_key(token, self.user)
+        get_storage().write(uploads.BUCKET_NAME, key, b'x' * (uploads.MAX_UPLOAD_SIZE + 1))
+        result = self.create_resource(token)
+        self.assertFalse(result['success'])
+        self.assertNotIn(key, get_storage().keys('source'))
+
+    def test_upload_must_match_kind(self):
+        """ Check that an image resource can't be created from something which isn't a PNG, and the upload is dropped """
+        token = self.upload(b'GIF89a' + b'\x00' * 100)
+        key = uploads.staged_key(token, self.user)
+        result = self.create_resource(token, kind='png', file_name='image.png')
+        self.assertFalse(result['success'])
+        self.assertFalse(ResourceFile.objects.filter(project=self.project).exists())
+        self.assertNotIn(key, get_storage().keys('source'))
+        result = self.create_resource(self.upload(b'true' + b'\x00' * 100), kind='font', file_name='font.ttf')
+        self.assertTrue(result['success'], result.get('error'))
+        result = self.create_resource(self.upload(b'\x89PNG\r\n\x1a\n' + b'\x00' * 100), kind='png',
+                                      file_name='image.png')
+        self.assertTrue(result['success'], result.get('error'))
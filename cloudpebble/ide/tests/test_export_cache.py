@@ -0,0 +1,102 @@
+""" These tests check that unchanged projects reuse their previous export """
+import datetime
+
+import mock
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+from django.utils.timezone import now
+
+from ide.models.dependency import Dependency
+from ide.models.export import ProjectExport
+from ide.models.files import SourceFile
+from ide.models.project import Project
+from ide.tasks.archive import create_archive, prune_exports
+from utils.fakes import FakeRedis
+from utils.storage import get_storage
+
+
+@override_settings(STORAGE_BACKEND='memory')
+class TestExportCache(TestCase):
+    def setUp(self):
+        get_storage().reset()
+        self.user = User.objects.create_user('test', 'test@test.test', 'test')
+        self.project = Project.objects.create(name='test', owner=self.user, app_short_name='test')
+        self.source_file = SourceFile.objects.create(project=self.project, file_name='main.c')
+        self.source_file.save_text('int main;')
+        self.client = Client()
+        self.client.login(username='test', password='test')
+        redis = mock.patch('ide.utils.autosave.redis_client', FakeRedis())
+        redis.start()
+        self.addCleanup(redis.stop)
+
+    def export(self):
+        """ Run create_archive, and return its URL """
+        with mock.patch.object(create_archive, 'update_state'):
+            result = create_archive.apply(args=[self.project.id])
+        self.assertTrue(result.successful(), result.traceback)
+        return result.result
+
+    def begin_export(self):
+        with mock.patch('ide.api.project.create_archive') as task:
+            task.delay.return_value.task_id = 'task'
+            response = self.client.post('/ide/project/%d/export' % self.project.id).json()
+        self.assertTrue(response['success'])
+        return response
+
+    def test_unchanged_project_reuses_export(self):
+        url = self.export()
+        self.assertEqual(self.begin_export()['url'], url)
+
+    def test_changed_project_is_exported_again(self):
+        self.export()
+        self.source_file.save_text('int main2;')
+        self.assertEqual(self.begin_export()['task_id'], 'task')
+
+    def test_deletions_and_dependency_changes_invalidate_export(self):
+        self.export()
+        SourceFile.objects.get(pk=self.source_file.pk).delete()
+        self.assertIn('task_id', self.begin_export())
+        self.export()
+        self.assertIn('url', self.begin_export())
+        Project.objects.get(pk=self.project.pk).set_dependencies({'pebble-events': '^1.0.0'})
+        self.assertIn('task_id', self.begin_export())
+
+    def test_prune_exports(self):
+        old_url = self.export()
+        self.source_file.save_text('int main2;')
+        current_url = self.export()
+        ProjectExport.objects.exclude(key=export_url_key(current_url))\
+            .update(created=now() - datetime.timedelta(hours=1))
+        expired = ProjectExport.objects.create(project=Project.objects.create(name='other', owner=self.user),
+                                               revision=now(), version=1, key='expired.zip')
+        ProjectExport.objects.filter(pk=expired.pk).update(created=now() - datetime.timedelta(days=30))
+        get_storage().write('export', 'expired.zip', b'zip')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(prune_exports(), 2)
+        self.assertEqual([export_url_key(current_url)], get_storage().keys('export'))
+        self.assertNotIn(export_url_key(old_url), get_storage().keys('export'))
+        self.assertEqual(ProjectExport.objects.count(), 1)
+
+    def test_just_superseded_exports_are_kept(self):
+        """ Check that an export which was only just superseded isn't pruned, as it may still be downloading """
+        url = self.export()
+        self.source_file.save_text('int main2;')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(prune_exports(), 0)
+        self.assertEqual([export_url_key(url)], get_storage().keys('export'))
+
+    def test_archive_is_deleted_once_deletion_commits(self):
+        url = self.export()
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            ProjectExport.objects.get().delete()
+        self.assertEqual([export_url_key(url)], get_storage().keys('export'))
+        for callback in callbacks:
+            callback()
+        self.assertEqual([], get_storage().keys('export'))
+
+
+def export_url_key(url):
+    return url[len('/ide/export/'):]
@@ -0,0 +1,100 @@
+""" These tests check that exports report their progress and that uploads can be streamed """
+import io
+import zipfile
+
+import mock
+from django.contrib.auth.models import User
+from django.test import TestCase, SimpleTestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+
+from ide.models.project import Project
+from ide.models.files import SourceFile
+from ide.tasks.archive import create_archive, export_user_projects, stream_zip
+from ide.utils.progress import TaskProgress
+from utils.fakes import FakeRedis, FakeS3
+from utils.storage import S3Storage, get_storage
+
+fake_s3 = FakeS3()
+
+
+class TestTaskProgress(SimpleTestCase):
+    def test_reports_are_rate_limited(self):
+        task = mock.Mock()
+        task.request.id = 'task'
+        progress = TaskProgress(task, interval=3600)
+        progress.stage('uploading', 10)
+        for i in range(10):
+            progress.advance()
+        # Once when the stage starts and once when it completes.
+        self.assertEqual(task.update_state.call_count, 2)
+        task.update_state.assert_called_with(state='PROGRESS', meta={'stage': 'uploading', 'done': 10, 'total': 10})
+
+    def test_synchronous_task_is_not_reported(self):
+        task = mock.Mock()
+        task.request.id = None
+        TaskProgress(task).stage('packing', 1)
+        task.update_state.assert_not_called()
+
+
+@override_settings(AWS_ENABLED=True)
+class TestStreamedUpload(SimpleTestCase):
+    def test_upload_stream(self):
+        """ Check that generated data is handed to S3 as a file-like object without being collected first """
+        progress = mock.Mock()
+        with mock.patch('utils.storage.s3', fake_s3):
+            S3Storage().upload_stream('export', 'key', (b'chunk%d' % i for i in range(3)), progress=progress)
+        self.assertEqual(fake_s3.read_file('export', 'key'), b'chunk0chunk1chunk2')
+        progress.assert_called_once_with(18)
+
+    def test_stream_zip(self):
+        chunks = list(stream_zip(('file%d.txt' % i, 'contents %d' % i) for i in range(3)))
+        # Each entry is produced as soon as it's written, followed by the central directory.
+        self.assertEqual(len(chunks), 4)
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as z:
+            self.assertIsNone(z.testzip())
+            self.assertEqual(z.read('file2.txt'), b'contents 2')
+
+
+# Projects are packed in the test's thread, since other threads' database connections can't see its transaction.
+@override_settings(STORAGE_BACKEND='memory', ACCOUNT_EXPORT_CONCURRENCY=1)
+class TestExportProgress(TestCase):
+    def setUp(self):
+        get_storage().reset()
+        self.user = User.objects.create_user('test', 'test@test.test', 'test')
+        for i in range(3):
+            Project.objects.create(name='project%d' % i, owner=self.user, app_short_name='project%d' % i)
+
+    def test_export_reports_progress(self):
+        with mock.patch.object(export_user_projects, 'update_state') as update_state:
+            result = export_user_projects.apply(args=[self.user.id])
+        self.assertTrue(result.successful(), result.traceback)
+        stages = [(c[1]['meta']['stage'], c[1]['meta']['done']) for c in update_state.call_args_list]
+        self.assertEqual(stages[0], ('packing', 0))
+        self.assertEqual(stages[-1], ('packing', 3))
+        # One archive per project, which can be reused, and the merged archive.
+        self.assertEqual(len(get_storage().keys('export')), 4)
+
+    def test_project_export_is_streamed(self):
+        project = Project.objects.get(name='project0')
+        SourceFile.objects.create(project=project, file_name='main.c').save_text('int main;')
+        with mock.patch('ide.utils.autosave.redis_client', FakeRedis()), \
+                mock.patch.object(create_archive, 'update_state') as update_state:
+            result = create_archive.apply(args=[project.id])
+        self.assertTrue(result.successful(), result.traceback)
+        # One source file, the manifest, wscript and jshintrc.
+        progress = [c[1]['meta'] for c in update_state.call_args_list]
+        self.assertEqual(progress[0], {'stage': 'packing', 'done': 0, 'total': 4})
+        self.assertEqual(progress[-1], {'stage': 'packing', 'done': 4, 'total': 4})
+        key, = get_storage().keys('export')
+        self.assertEqual(result.result, '/ide/export/%s' % key)
+        with zipfile.ZipFile(io.BytesIO(get_storage().read('export', key))) as z:
+            self.assertEqual(z.read('project0/src/c/main.c'), b'int main;')
+            self.assertIn('project0/package.json', z.namelist())
+
+    def test_check_task_includes_progress(self):
+        with mock.patch('ide.api.AsyncResult') as async_result:
+            async_result.return_value.status = 'PROGRESS'
+            async_result.return_value.info = {'stage': 'packing', 'done': 1, 'total': 3}
+            response = Client().get('/ide/task/0123456789abcdef0123456789abcdef')
+        self.assertEqual(response.json()['state']['progress'], {'stage': 'packing', 'done': 1, 'total': 3})
@@ -149,3 +149,26 @@ class TestFindProjectRoot(TestCase):
             "project/src/c/main.c",
             "project/resources/fonts/font.ttf",
         ], "project/", "project/package.json")
+
+    def test_only_reads_candidate_manifests(self):
+        """ Don't read appinfo.json files which have no sources beside them, or anything after a valid manifest """
+        reads = []
+
+        class CountingProjectItem(FakeProjectItem):
+            def read(self):
+                reads.append(self.name)
+                return super(CountingProjectItem, self).read()
+
+        paths = ["examples/%d/appinfo.json" % i for i in range(100)]
+        paths += ["project/appinfo.json", "project/src/c/main.c", "other/package.json", "other/src/c/main.c"]
+        self.run_test([CountingProjectItem(path) for path in paths], "other/", "other/package.json")
+        self.assertEqual(reads, ["other/package.json"])
+
+    def test_prefer_shallowest_project(self):
+        """ Prefer the project closest to the root of the archive """
+        self.run_test([
+            "examples/demo/package.json",
+            "examples/demo/src/c/main.c",
+            "package.json",
+            "src/c/main.c",
+        ], "", "package.json")
@@ -0,0 +1,84 @@
+""" These tests check that get_projects takes a fixed number of queries, and pages through projects in order """
+import datetime
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+
+from ide.models.build import BuildResult
+from ide.models.project import Project
+
+
+class TestGetProjects(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('test', 'test@test.test', 'test')
+        self.client = Client()
+        self.client.login(username='test', password='test')
+        self.finished = now().replace(microsecond=0)
+
+    def add_projects(self, count, **kwargs):
+        start = Project.objects.filter(owner=self.user).count()
+        projects = []
+        for i in range(start, start + count):
+            project = Project.objects.create(name='project %02d' % i, owner=self.user, app_short_name='test',
+                                             **kwargs)
+            BuildResult.objects.create(project=project, state=BuildResult.STATE_SUCCEEDED, finished=self.finished)
+            BuildResult.objects.create(project=project, state=BuildResult.STATE_FAILED,
+                                       finished=self.finished + datetime.timedelta(hours=1))
+            projects.append(project)
+        return projects
+
+    def get_projects(self, status=200, **params):
+        response = self.client.get('/ide/projects', params)
+        self.assertEqual(response.status_code, status)
+        return response.json()
+
+    def count_queries(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            self.get_projects(**params)
+        return len(queries)
+
+    def test_query_count_is_constant(self):
+        parent = Project.objects.create(name='parent', owner=self.user, app_short_name='parent')
+        packages = self.add_projects(1, project_type='package', app_modern_multi_js=True,
+                                     app_version_label='1.0.0')
+        parent.project_dependencies.add(packages[0])
+        queries = self.count_queries(libraries=parent.id)
+        packages += self.add_projects(5, project_type='package', app_modern_multi_js=True,
+                                      app_version_label='1.0.0')
+        self.assertEqual(self.count_queries(libraries=parent.id), queries)
+        listed = {p['id']: p for p in self.get_projects(libraries=parent.id)['projects']}
+        self.assertEqual(set(listed), {p.id for p in packages})
+        self.assertEqual([p['id'] for p in listed.values() if p['depended_on']], [packages[0].id])
+        self.assertEqual(listed[packages[0].id]['latest_successful_build'], str(self.finished))
+
+    def test_pages_are_sorted(self):
+        projects = self.add_projects(5)
+        names, cursor = [], None
+        while True:
+            params = {'sort': '-name', 'limit': 2}
+            if cursor is not None:
+                params['cursor'] = cursor
+            page = self.get_projects(**params)
+            self.assertLessEqual(len(page['projects']), 2)
+            names += [p['name'] for p in page['projects']]
+            cursor = page['next']
+            if cursor is None:
+                break
+        self.assertEqual(names, sorted((p.name for p in projects), reverse=True))
+
+    def test_ties_are_broken_by_id(self):
+        projects = self.add_projects(3)
+        Project.objects.filter(owner=self.user).update(last_modified=now().replace(microsecond=123456))
+        first = self.get_projects(sort='last_modified', limit=2)
+        second = self.get_projects(sort='last_modified', limit=2, cursor=first['next'])
+        self.assertEqual([p['id'] for p in first['projects'] + second['projects']], [p.id for p in projects])
+        self.assertIsNone(second['next'])
+
+    def test_bad_parameters(self):
+        self.get_projects(status=400, sort='owner')
+        self.get_projects(status=400, limit=0)
+        self.get_projects(status=400, cursor='nonsense')
@@ -7,7 +7,7 @@ import json
 from ide.utils.cloudpebble_test import CloudpebbleTestCase
 from ide.models import Project, User
 from ide.tasks.gist import import_gist
-from utils.fakes import FakeS3
+from utils.fakes import FakeS3, FakeRedis
 
 __author__ = 'joe'
 
@@ -18,20 +18,23 @@ FakeFile = namedtuple('FakeFile', ['content', 'raw_url'])
 
 class FakeGist(object):
     def __init__(self, description=None, files=None):
+        self.id = '123'
+        self.revision = 'a' * 40
         self.description = description
         self.files = files or {}
         for name, content in files.items():
             self.files[name] = FakeFile(content, '')
 
 
-@mock.patch('ide.models.s3file.s3', fake_s3)
+@mock.patch('utils.storage.s3', fake_s3)
+@mock.patch('ide.utils.gist.redis_client', FakeRedis())
 class TestImportProject(CloudpebbleTestCase):
     def setUp(self):
         self.login()
 
-    @mock.patch('ide.tasks.gist.github')
-    def runTest(self, files, github, name=None):
-        github.Github.return_value.get_gist.return_value = FakeGist(description=name, files=files)
+    @mock.patch('ide.tasks.gist.get_gist')
+    def runTest(self, files, get_gist, name=None):
+        get_gist.return_value = FakeGist(description=name, files=files)
         imported_id = import_gist(self.user_id, 123)
         project = Project.objects.get(pk=imported_id)
         return project
@@ -112,9 +115,9 @@ class TestImportProject(CloudpebbleTestCase):
         self.assertEqual(project.app_company_name, 'test')
         self.assertEqual(project.app_is_watchface, False)
 
-    @mock.patch('ide.tasks.gist.urlopen')
+    @mock.patch('ide.utils.gist.urlopen')
     def test_native_project_files(self, mock_urlopen):
-        mock_urlopen.return_value.read.return_value = ''
+        mock_urlopen.return_value.read.return_value = b''
         project = self.runTest({
             'main.c': '',
             'package.json': json.dumps({"pebble": {"resources": {"media": [{
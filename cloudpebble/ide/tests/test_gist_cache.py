@@ -0,0 +1,82 @@
+""" These tests check that gists are cached, and that cached gists are revalidated """
+import io
+import json
+from urllib.error import HTTPError
+
+import mock
+from django.test import TestCase
+from django.test.utils import override_settings
+from github import UnknownObjectException
+
+from ide.utils import gist
+from utils.fakes import FakeRedis
+
+
+class FakeGistAPI(object):
+    """ Answers urlopen() calls for a single gist, honouring If-None-Match """
+
+    def __init__(self, gist):
+        self.gist = gist
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request.full_url)
+        if not request.full_url.endswith('/gists/%s' % self.gist['id']):
+            raise HTTPError(request.full_url, 404, 'Not Found', {}, None)
+        etag = '"%s"' % self.gist['history'][0]['version']
+        if request.get_header('If-none-match') == etag:
+            raise HTTPError(request.full_url, 304, 'Not Modified', {'ETag': etag}, None)
+        response = io.BytesIO(json.dumps(self.gist).encode('utf-8'))
+        response.headers = {'ETag': etag}
+        return response
+
+
+class TestGistCache(TestCase):
+    def setUp(self):
+        self.api = FakeGistAPI({
+            'id': '123',
+            'description': 'test',
+            'history': [{'version': 'a' * 40}],
+            'files': {'main.c': {'content': 'content', 'raw_url': 'raw/main.c'}}
+        })
+        for patcher in (mock.patch('ide.utils.gist.redis_client', FakeRedis()),
+                        mock.patch('ide.utils.gist.urlopen', self.api)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_fresh_gists_are_not_fetched(self):
+        self.assertEqual(gist.get_gist('123').files['main.c'].content, 'content')
+        self.assertEqual(gist.get_gist('123').revision, 'a' * 40)
+        self.assertEqual(len(self.api.requests), 1)
+
+    @override_settings(GIST_CACHE_FRESH=0)
+    def test_stale_gists_are_revalidated(self):
+        gist.get_gist('123')
+        self.assertEqual(gist.get_gist('123').files['main.c'].content, 'content')
+        self.api.gist['history'][0]['version'] = 'b' * 40
+        self.api.gist['files']['main.c']['content'] = 'changed'
+        self.assertEqual(gist.get_gist('123').files['main.c'].content, 'changed')
+        self.assertEqual(len(self.api.requests), 3)
+
+    def test_missing_gist(self):
+        with self.assertRaises(UnknownObjectException):
+            gist.get_gist('456')
+
+    def test_raw_files_are_cached_by_revision(self):
+        with mock.patch('ide.utils.gist.urlopen') as urlopen:
+            urlopen.return_value.read.return_value = b'\x89PNG'
+            fetched = gist.Gist('123', 'a' * 40, None, {'img.png': gist.GistFile('', 'raw/img.png')})
+            self.assertEqual(gist.read_raw(fetched, 'img.png'), b'\x89PNG')
+            self.assertEqual(gist.read_raw(fetched, 'img.png'), b'\x89PNG')
+            self.assertEqual(urlopen.call_count, 1)
+            gist.read_raw(fetched._replace(revision='b' * 40), 'img.png')
+            self.assertEqual(urlopen.call_count, 2)
+
+    @override_settings(GIST_RAW_CACHE_MAX_SIZE=4)
+    def test_large_raw_files_are_not_cached(self):
+        with mock.patch('ide.utils.gist.urlopen') as urlopen:
+            urlopen.return_value.read.return_value = b'\x89PNG!'
+            fetched = gist.Gist('123', 'a' * 40, None, {'img.png': gist.GistFile('', 'raw/img.png')})
+            self.assertEqual(gist.read_raw(fetched, 'img.png'), b'\x89PNG!')
+            self.assertEqual(gist.read_raw(fetched, 'img.png'), b'\x89PNG!')
+            self.assertEqual(urlopen.call_count, 2)
@@ -0,0 +1,123 @@
+""" These tests check that ide.tasks.git.github_pull changes only the files which differ from the remote tree """
+import base64
+import io
+import json
+
+import mock
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ide.models.files import SourceFile, ResourceFile, ResourceVariant
+from ide.models.project import Project
+from ide.tasks import git
+from ide.utils.git import git_sha
+from utils.fakes import FakeRedis
+from utils.storage import get_storage
+
+
+def make_appinfo(media):
+    return json.dumps({
+        "appKeys": {},
+        "capabilities": [""],
+        "companyName": "test",
+        "longName": "test",
+        "projectType": "native",
+        "resources": {"media": media},
+        "sdkVersion": "3",
+        "shortName": "test",
+        "uuid": "123e4567-e89b-42d3-a456-426655440000",
+        "versionLabel": "1.0",
+        "watchapp": {"watchface": False}
+    }).encode('utf-8')
+
+
+class FakeTreeItem(object):
+    def __init__(self, path, content):
+        self.path = path
+        self.sha = git_sha(content)
+        self.mode = '100644'
+        self.type = 'blob'
+
+
+@override_settings(STORAGE_BACKEND='memory')
+class TestGithubPull(TestCase):
+    def setUp(self):
+        get_storage().reset()
+        self.user = User.objects.create_user('test', 'test@test.test', 'test')
+        self.project = Project.objects.create(name='test', owner=self.user, app_short_name='test',
+                                              github_repo='test/test', github_branch='main')
+        self.main = SourceFile.objects.create(project=self.project, file_name='main.c')
+        self.main.save_text('int main;')
+        self.other = SourceFile.objects.create(project=self.project, file_name='other.c')
+        self.other.save_text('int other;')
+        for patcher in (mock.patch('ide.utils.autosave.redis_client', FakeRedis()),
+                        mock.patch('ide.git.git_verify_tokens', return_value=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def pull(self, files):
+        """ Pull from a repo containing files, a dictionary of path -> contents, and return the fetched blobs """
+        blobs = {git_sha(content): content for content in files.values()}
+        with mock.patch('ide.tasks.git.CachingGithub') as cached:
+            cached.return_value.github.rate_limiting = (5000, 5000)
+            self.repo = cached.return_value.get_repo.return_value
+            cached.return_value.get_branch.return_value.commit.sha = 'a' * 40
+            cached.return_value.get_git_tree.return_value.tree = [FakeTreeItem(path, content)
+                                                                  for path, content in files.items()]
+            self.repo.get_git_blob.side_effect = lambda sha: mock.Mock(content=base64.b64encode(blobs[sha]))
+            self.assertTrue(git.github_pull(self.user, Project.objects.get(pk=self.project.pk)))
+        return {blobs[c[0][0]] for c in self.repo.get_git_blob.call_args_list}
+
+    def test_pull_changes_files_in_place(self):
+        fetched = self.pull({
+            'appinfo.json': make_appinfo([{'file': 'images/blah.png', 'name': 'IMAGE_BLAH', 'type': 'png'}]),
+            'src/main.c': b'int main;',
+            'src/new.c': b'int new;',
+            'resources/images/blah.png': b'\x89PNG',
+        })
+        self.assertEqual(fetched, {make_appinfo([{'file': 'images/blah.png', 'name': 'IMAGE_BLAH', 'type': 'png'}]),
+                                   b'int new;', b'\x89PNG'})
+        self.assertFalse(self.repo.get_archive_link.called)
+        sources = {f.file_name: f for f in SourceFile.objects.filter(project=self.project)}
+        self.assertEqual(set(sources), {'main.c', 'new.c'})
+        self.assertEqual(sources['main.c'].pk, self.main.pk)
+        self.assertEqual(sources['new.c'].get_contents(), 'int new;')
+        resource = ResourceFile.objects.get(project=self.project)
+        self.assertEqual(resource.identifiers.get().resource_id, 'IMAGE_BLAH')
+        self.assertEqual(resource.variants.get().get_contents_bytes(), b'\x89PNG')
+        self.assertEqual(Project.objects.get(pk=self.project.pk).github_last_commit, 'a' * 40)
+
+    def test_unchanged_resources_are_kept(self):
+        files = {
+            'appinfo.json': make_appinfo([{'file': 'images/blah.png', 'name': 'IMAGE_BLAH', 'type': 'png'}]),
+            'src/main.c': b'int main;',
+            'resources/images/blah.png': b'\x89PNG',
+        }
+        self.pull(files)
+        variant = ResourceVariant.objects.get(resource_file__project=self.project)
+        Project.objects.filter(pk=self.project.pk).update(github_last_commit=None)
+        self.assertEqual(self.pull(files), {files['appinfo.json']})
+        self.assertEqual(ResourceVariant.objects.get(resource_file__project=self.project).pk, variant.pk)
+
+    def test_failed_pull_keeps_stored_files(self):
+        """ Check that a pull which fails part way through deletes nothing from storage """
+        SourceFile.objects.filter(pk=self.other.pk).update(blob=None)
+        get_storage().write('source', SourceFile.objects.get(pk=self.other.pk).storage_key, b'int other;')
+        with self.captureOnCommitCallbacks(execute=True), \
+                mock.patch('ide.tasks.git.ResourceIdentifier.objects.create', side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                self.pull({
+                    'appinfo.json': make_appinfo([{'file': 'images/blah.png', 'name': 'IMAGE_BLAH', 'type': 'png'}]),
+                    'src/main.c': b'int main;',
+                    'resources/images/blah.png': b'\x89PNG',
+                })
+        self.assertEqual(SourceFile.objects.get(pk=self.other.pk).get_contents(), 'int other;')
+
+    def test_files_without_stored_sha_are_reimported(self):
+        SourceFile.objects.filter(pk=self.main.pk).update(git_sha=None)
+        with mock.patch('ide.tasks.git.urlopen', return_value=io.BytesIO(b'zip')), \
+                mock.patch('ide.tasks.git.do_import_archive', return_value=True) as do_import_archive:
+            self.pull({'appinfo.json': make_appinfo([]), 'src/main.c': b'int main;'})
+        self.assertTrue(do_import_archive.called)
+        self.assertFalse(SourceFile.objects.filter(project=self.project).exists())
@@ -0,0 +1,100 @@
+""" These tests check that ide.tasks.git.github_push only reads and sends files which differ from the remote tree """
+import base64
+
+import mock
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ide.models.files import SourceFile, ResourceFile, ResourceVariant
+from ide.models.project import Project
+from ide.tasks import git
+from ide.utils.git import git_sha
+from utils.fakes import FakeRedis
+from utils.storage import get_storage
+
+
+class FakeTreeItem(object):
+    def __init__(self, path, sha, mode='100644', type='blob'):
+        self.path = path
+        self.sha = sha
+        self.mode = mode
+        self.type = type
+
+
+@override_settings(STORAGE_BACKEND='memory')
+class TestGithubPush(TestCase):
+    def setUp(self):
+        get_storage().reset()
+        self.user = User.objects.create_user('test', 'test@test.test', 'test')
+        self.project = Project.objects.create(name='test', owner=self.user, app_short_name='test')
+        self.main = SourceFile.objects.create(project=self.project, file_name='main.c')
+        self.main.save_text('int main;')
+        self.other = SourceFile.objects.create(project=self.project, file_name='other.c')
+        self.other.save_text('int other;')
+        for patcher in (mock.patch('ide.utils.autosave.redis_client', FakeRedis()),
+                        mock.patch('ide.git.git_verify_tokens', return_value=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def push(self, tree, rate_limit=(5000, 5000)):
+        """ Push to a repo with the given remote tree, and return the files whose contents were read """
+        with mock.patch('ide.tasks.git.CachingGithub') as cached, \
+                mock.patch('ide.tasks.git.read_project_contents', wraps=git.read_project_contents) as read:
+            cached.return_value.github.rate_limiting = rate_limit
+            cached.return_value.github.rate_limiting_resettime = 0
+            self.repo = cached.return_value.get_repo.return_value
+            self.tree = cached.return_value.get_git_tree.return_value
+            self.tree.tree = tree
+            self.repo.create_git_commit.return_value.sha = '0' * 40
+            self.repo.create_git_blob.side_effect = lambda content, encoding: mock.Mock(sha='blob:' + content)
+            git.github_push(mock.Mock(), 'message', 'test/test', Project.objects.get(pk=self.project.pk))
+        return {f.file_name if isinstance(f, SourceFile) else f.path for f in read.call_args[0][1]}
+
+    def sent_entries(self):
+        """ :return: A dictionary of path -> entry for the entries sent to create_git_tree """
+        (entries,), kwargs = self.repo.create_git_tree.call_args
+        self.assertIs(kwargs['base_tree'], self.tree)
+        return {entry._identity['path']: entry._identity for entry in entries}
+
+    def test_git_sha_is_stored(self):
+        self.assertEqual(SourceFile.objects.get(pk=self.main.pk).git_sha, git_sha(b'int main;'))
+
+    def test_only_changed_files_are_read(self):
+        read = self.push([FakeTreeItem('src/c/main.c', git_sha(b'int main;')),
+                          FakeTreeItem('src/c/other.c', git_sha(b'int old;'))])
+        self.assertEqual(read, {'other.c'})
+
+    def test_files_without_stored_sha_are_read_once(self):
+        SourceFile.objects.filter(pk=self.main.pk).update(git_sha=None)
+        tree = [FakeTreeItem('src/c/main.c', git_sha(b'int main;')),
+                FakeTreeItem('src/c/other.c', git_sha(b'int other;'))]
+        self.assertEqual(self.push(tree), {'main.c'})
+        self.assertEqual(SourceFile.objects.get(pk=self.main.pk).git_sha, git_sha(b'int main;'))
+        self.assertEqual(self.push(tree), set())
+
+    def test_only_changes_are_sent(self):
+        resource = ResourceFile.objects.create(project=self.project, file_name='blah.png', kind='png')
+        ResourceVariant.objects.create(resource_file=resource, tags='').save_string(b'\x89PNG')
+        self.push([FakeTreeItem('src', None, mode='040000', type='tree'),
+                   FakeTreeItem('src/c', None, mode='040000', type='tree'),
+                   FakeTreeItem('src/c/main.c', git_sha(b'int main;')),
+                   FakeTreeItem('src/c/other.c', git_sha(b'int old;')),
+                   FakeTreeItem('src/c/deleted.c', git_sha(b'int deleted;')),
+                   FakeTreeItem('wscript', 'wscript'),
+                   FakeTreeItem('.gitignore', 'gitignore')])
+        entries = self.sent_entries()
+        self.assertEqual(entries['src/c/other.c']['content'], 'int other;')
+        self.assertIsNone(entries['src/c/deleted.c']['sha'])
+        self.assertEqual(entries['resources/images/blah.png']['sha'], 'blob:' + base64.b64encode(b'\x89PNG').decode())
+        self.assertNotIn('src/c/main.c', entries)
+        self.assertNotIn('src', entries)
+        self.assertEqual(set(entries) - {'appinfo.json', 'package.json'},
+                         {'src/c/other.c', 'src/c/deleted.c', 'resources/images/blah.png'})
+
+    def test_rate_limit_is_checked_before_creating_blobs(self):
+        resource = ResourceFile.objects.create(project=self.project, file_name='blah.png', kind='png')
+        ResourceVariant.objects.create(resource_file=resource, tags='').save_string(b'\x89PNG')
+        with self.assertRaises(Exception):
+            self.push([], rate_limit=(0, 5000))
+        self.assertFalse(self.repo.create_git_blob.called)
@@ -0,0 +1,125 @@
+""" These tests check that GitHub tokens and API responses are cached, and that cached responses are revalidated """
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import mock
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.test.utils import override_settings
+from github import BadCredentialsException
+
+from ide.git import git_verify_tokens, CachingGithub
+from ide.models.user import UserGithubRepoSync
+from utils.fakes import FakeRedis
+
+
+class FakeGithubServer(object):
+    """ A local HTTP server answering GitHub API requests from a dictionary of path -> response body, honouring
+    If-None-Match, so that requests go through urlopen() just as they would to GitHub """
+
+    def __init__(self, token):
+        self.token = token
+        self.responses = {}
+        # (path, If-None-Match header, status) for every request.
+        self.requests = []
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body, etag = api.respond(self.path, self.headers)
+                api.requests.append((self.path, self.headers.get('If-None-Match'), status))
+                self.send_response(status)
+                if etag is not None:
+                    self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def respond(self, path, headers):
+        if headers.get('Authorization') != 'token %s' % self.token:
+            return 401, b'{}', None
+        if path not in self.responses:
+            return 404, b'{}', None
+        body = json.dumps(self.responses[path]).encode('utf-8')
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if headers.get('If-None-Match') == etag:
+            return 304, b'', etag
+        return 200, body, etag
+
+    def paths(self):
+        return [path for path, etag, status in self.requests]
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestGithubCache(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('test', 'test@test.test', 'test')
+        UserGithubRepoSync.objects.create(user=self.user, token='token')
+        self.api = FakeGithubServer('token')
+        self.api.responses = {
+            '/user': {'login': 'test'},
+            '/repos/test/test': {'full_name': 'test/test', 'default_branch': 'main'},
+            '/repos/test/test/branches/main': {'name': 'main', 'commit': {'sha': 'a' * 40}},
+            '/repos/test/test/branches/feature/a%23b': {'name': 'feature/a#b', 'commit': {'sha': 'c' * 40}},
+            '/repos/test/test/git/commits/' + 'a' * 40: {'sha': 'a' * 40, 'tree': {'sha': 'b' * 40}},
+        }
+        self.api.start()
+        self.addCleanup(self.api.stop)
+        settings = override_settings(GITHUB_API_URL=self.api.url)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        patcher = mock.patch('ide.git.redis_client', FakeRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_valid_token_is_checked_once(self):
+        self.assertTrue(git_verify_tokens(self.user))
+        self.assertTrue(git_verify_tokens(self.user))
+        self.assertEqual(self.api.paths(), ['/user'])
+
+    def test_bad_token_is_forgotten(self):
+        self.assertTrue(git_verify_tokens(self.user))
+        self.api.token = 'new token'
+        with self.assertRaises(BadCredentialsException):
+            CachingGithub(self.user).get_repo('test/test')
+        self.assertFalse(git_verify_tokens(self.user))
+        self.assertFalse(UserGithubRepoSync.objects.filter(user=self.user).exists())
+
+    def test_unchanged_responses_are_revalidated(self):
+        github = CachingGithub(self.user)
+        repo = github.get_repo('test/test')
+        self.assertEqual(github.get_branch(repo, 'main').commit.sha, 'a' * 40)
+        self.assertEqual(github.get_branch(repo, 'main').commit.sha, 'a' * 40)
+        self.api.responses['/repos/test/test/branches/main']['commit']['sha'] = 'c' * 40
+        self.assertEqual(github.get_branch(repo, 'main').commit.sha, 'c' * 40)
+        branch_requests = [(etag is not None, status) for path, etag, status in self.api.requests
+                           if path == '/repos/test/test/branches/main']
+        self.assertEqual(branch_requests, [(False, 200), (True, 304), (True, 200)])
+
+    def test_branch_names_are_quoted(self):
+        github = CachingGithub(self.user)
+        repo = github.get_repo('test/test')
+        self.assertEqual(github.get_branch(repo, 'feature/a#b').commit.sha, 'c' * 40)
+        self.assertIn('/repos/test/test/branches/feature/a%23b', self.api.paths())
+
+    def test_commits_are_only_fetched_once(self):
+        github = CachingGithub(self.user)
+        repo = github.get_repo('test/test')
+        self.assertEqual(github.get_git_commit(repo, 'a' * 40).tree.sha, 'b' * 40)
+        self.assertEqual(github.get_git_commit(repo, 'a' * 40).tree.sha, 'b' * 40)
+        self.assertEqual(self.api.paths().count('/repos/test/test/git/commits/' + 'a' * 40), 1)
@@ -0,0 +1,64 @@
+""" These tests check that GitHub push hooks are coalesced per project, and that builds run as their own task """
+import mock
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from ide.models.build import BuildResult
+from ide.models.project import Project
+from ide.tasks import git
+from utils.fakes import FakeRedis
+
+
+class TestGithubHook(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('test', 'test@test.test', 'test')
+        self.project = Project.objects.create(name='test', owner=self.user, app_short_name='test',
+                                              github_repo='test/test', github_last_commit='a' * 40)
+        self.apply_async = mock.Mock()
+        self.redis = FakeRedis()
+        for patcher in (mock.patch('ide.tasks.git.redis_client', self.redis),
+                        mock.patch.object(git.hooked_commit, 'apply_async', self.apply_async)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_hooked_commit(self):
+        with mock.patch('ide.tasks.git.github_pull') as github_pull, \
+                mock.patch('ide.tasks.git.run_compile') as run_compile:
+            git.hooked_commit(self.project.id)
+        return github_pull, run_compile
+
+    def test_pushes_are_coalesced(self):
+        self.assertTrue(git.queue_hooked_commit(self.project.id, 'b' * 40))
+        self.assertTrue(git.queue_hooked_commit(self.project.id, 'c' * 40))
+        self.assertEqual(self.apply_async.call_count, 1)
+        github_pull, run_compile = self.run_hooked_commit()
+        self.assertEqual(github_pull.call_count, 1)
+        self.assertTrue(git.queue_hooked_commit(self.project.id, 'd' * 40))
+        self.assertEqual(self.apply_async.call_count, 2)
+
+    def test_repeated_deliveries_are_ignored(self):
+        self.assertTrue(git.queue_hooked_commit(self.project.id, 'b' * 40))
+        self.run_hooked_commit()
+        self.assertFalse(git.queue_hooked_commit(self.project.id, 'b' * 40))
+        self.assertEqual(self.apply_async.call_count, 1)
+
+    def test_repeat_check_swaps_target_atomically(self):
+        """ Check that the target is read and replaced in one command, rather than a separate GET and SET """
+        with mock.patch.object(self.redis, 'get', side_effect=AssertionError("separate GET")):
+            self.assertTrue(git.queue_hooked_commit(self.project.id, 'b' * 40))
+            self.assertFalse(git.queue_hooked_commit(self.project.id, 'b' * 40))
+            self.assertTrue(git.queue_hooked_commit(self.project.id, 'c' * 40))
+        self.assertEqual(self.apply_async.call_count, 1)
+
+    def test_current_commit_is_not_pulled(self):
+        git.queue_hooked_commit(self.project.id, 'a' * 40)
+        github_pull, run_compile = self.run_hooked_commit()
+        self.assertFalse(github_pull.called)
+
+    def test_build_is_queued_separately(self):
+        Project.objects.filter(pk=self.project.pk).update(github_hook_build=True)
+        git.queue_hooked_commit(self.project.id, 'b' * 40)
+        github_pull, run_compile = self.run_hooked_commit()
+        build = BuildResult.objects.get(project=self.project)
+        run_compile.delay.assert_called_once_with(build.id)
+        self.assertFalse(run_compile.called)
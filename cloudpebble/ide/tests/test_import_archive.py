@@ -15,7 +15,7 @@ __author__ = 'joe'
 fake_s3 = FakeS3()
 
 
-@mock.patch('ide.models.s3file.s3', fake_s3)
+@mock.patch('utils.storage.s3', fake_s3)
 class TestImportArchive(CloudpebbleTestCase):
     def setUp(self):
         self.login()
@@ -204,7 +204,7 @@ class TestImportArchive(CloudpebbleTestCase):
         self.assertEqual(dial_file.get_contents(), b'\x89PNG\r\n')
 
 
-@mock.patch('ide.models.s3file.s3', fake_s3)
+@mock.patch('utils.storage.s3', fake_s3)
 class TestImportLibrary(CloudpebbleTestCase):
     def setUp(self):
         self.login(type='package')
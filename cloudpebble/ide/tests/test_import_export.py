@@ -14,8 +14,7 @@ __author__ = 'joe'
 fake_s3 = FakeS3()
 
 
-@mock.patch('ide.tasks.archive.s3', fake_s3)
-@mock.patch('ide.models.s3file.s3', fake_s3)
+@mock.patch('utils.storage.s3', fake_s3)
 class TestImportExport(CloudpebbleTestCase):
 
     def setUp(self):
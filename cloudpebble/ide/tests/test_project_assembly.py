@@ -34,7 +34,7 @@ def read_tree(path):
     return tree
 
 
-@mock.patch('ide.models.s3file.s3', fake_s3)
+@mock.patch('utils.storage.s3', fake_s3)
 class TestAssemble(ProjectTester):
     @staticmethod
     def make_expected_sdk3_project(**kwargs):
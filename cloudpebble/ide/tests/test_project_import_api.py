@@ -6,26 +6,48 @@ import mock
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test.client import Client
 from django.test import TestCase
+from django.test.utils import override_settings
 from django.contrib.auth.models import User
 
 from ide.models import Project, SourceFile
+from ide.tasks.archive import do_import_archive
+from ide.utils import uploads
+from utils.fakes import FakeRedis
+from utils.storage import get_storage
 
 
-def _make_zip_bytes():
+def _make_zip_bytes(appinfo=None):
     buf = BytesIO()
     with ZipFile(buf, 'w') as zf:
-        zf.writestr('appinfo.json', '{"sdkVersion":"3"}')
+        zf.writestr('appinfo.json', json.dumps(appinfo or {"sdkVersion": "3"}))
         zf.writestr('src/main.c', 'int main(void){return 0;}')
         zf.writestr('wscript', 'def options(ctx): pass')
     return buf.getvalue()
 
 
+_APPINFO = {
+    "appKeys": {},
+    "capabilities": [""],
+    "companyName": "test",
+    "longName": "test",
+    "projectType": "native",
+    "resources": {"media": []},
+    "sdkVersion": "3",
+    "shortName": "test",
+    "uuid": "123e4567-e89b-42d3-a456-426655440000",
+    "versionLabel": "1.0",
+    "watchapp": {"watchface": False}
+}
+
+
 class _FakeTask(object):
     task_id = 'task-123'
 
 
+@override_settings(STORAGE_BACKEND='memory')
 class TestProjectImportApi(TestCase):
     def setUp(self):
+        get_storage().reset()
         self.client = Client()
         self.client.post('/accounts/register', {
             'username': 'test',
@@ -48,6 +70,24 @@ class TestProjectImportApi(TestCase):
         project = Project.objects.get(id=payload['project_id'])
         self.assertEqual(project.sdk_version, '4.9.148')
 
+    @mock.patch('ide.api.project.do_import_archive')
+    def test_import_zip_stages_archive(self, import_archive):
+        """ Check that the task is sent a reference to the archive rather than the archive itself """
+        import_archive.delay.return_value = _FakeTask()
+        bundle = _make_zip_bytes(_APPINFO)
+        response = self.client.post('/ide/import/zip', {
+            'name': 'zip-staged',
+            'archive': SimpleUploadedFile('project.zip', bundle, content_type='application/zip'),
+        })
+        project_id = json.loads(response.content)['project_id']
+        (task_project_id, key), kwargs = import_archive.delay.call_args
+        self.assertEqual((task_project_id, kwargs), (project_id, {'delete_project': True, 'staged': True}))
+        self.assertEqual(get_storage().read(uploads.BUCKET_NAME, key), bundle)
+
+        do_import_archive(project_id, key, staged=True)
+        self.assertEqual(SourceFile.objects.get(project_id=project_id).file_name, 'main.c')
+        self.assertNotIn(key, get_storage().keys(uploads.BUCKET_NAME))
+
     @mock.patch('ide.api.project.do_import_archive')
     def test_import_zip_defaults_to_4927(self, import_archive):
         import_archive.delay.return_value = _FakeTask()
@@ -189,6 +229,7 @@ class TestProjectImportApi(TestCase):
         project = Project.objects.get(id=payload['id'])
         self.assertTrue(SourceFile.objects.filter(project=project, file_name='main.js', target='embeddedjs').exists())
 
+    @mock.patch('ide.api.project.redis_client', FakeRedis())
     def test_project_info_marks_binary_sources_read_only(self):
         response = self.client.post('/ide/project/create', {
             'name': 'alloy-binary-info',
@@ -0,0 +1,74 @@
+""" These tests check that project_info takes a fixed number of queries, and is cached against the project's revision """
+import mock
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings, CaptureQueriesContext
+
+from ide.models.files import SourceFile, ResourceFile, ResourceVariant, ResourceIdentifier
+from ide.models.project import Project
+from utils.fakes import FakeRedis
+from utils.storage import get_storage
+
+
+@override_settings(STORAGE_BACKEND='memory')
+class TestProjectInfo(TestCase):
+    def setUp(self):
+        get_storage().reset()
+        self.user = User.objects.create_user('test', 'test@test.test', 'test')
+        self.project = Project.objects.create(name='test', owner=self.user, app_short_name='test')
+        self.client = Client()
+        self.client.login(username='test', password='test')
+        self.redis = FakeRedis()
+        for patcher in (mock.patch('ide.utils.autosave.redis_client', FakeRedis()),
+                        mock.patch('ide.api.project.redis_client', self.redis)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def add_resources(self, count):
+        start = ResourceFile.objects.filter(project=self.project).count()
+        for i in range(start, start + count):
+            resource = ResourceFile.objects.create(project=self.project, file_name='%d.png' % i, kind='png')
+            ResourceVariant.objects.create(resource_file=resource, tags='').save_string(b'\x89PNG')
+            ResourceIdentifier.objects.create(resource_file=resource, resource_id='IMAGE_%d' % i)
+            SourceFile.objects.create(project=self.project, file_name='%d.c' % i).save_text('int x;')
+
+    def get_info(self, **headers):
+        return self.client.get('/ide/project/%d/info' % self.project.id, **headers)
+
+    def count_queries(self):
+        self.redis.storage.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_info()
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_is_constant(self):
+        self.add_resources(1)
+        queries = self.count_queries()
+        self.add_resources(5)
+        self.assertEqual(self.count_queries(), queries)
+        info = self.get_info().json()
+        self.assertEqual(len(info['resources']), 6)
+        self.assertEqual(info['resources'][0]['identifiers'], ['IMAGE_0'])
+        self.assertEqual(info['resources'][0]['variants'], [[]])
+
+    def test_cached_info_is_used_until_the_project_changes(self):
+        self.add_resources(2)
+        self.get_info()
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.get_info().json()
+        self.assertNotIn('cloudpebble_resource', ' '.join(q['sql'] for q in queries.captured_queries))
+        self.assertEqual(len(cached['resources']), 2)
+        self.add_resources(1)
+        self.assertEqual(len(self.get_info().json()['resources']), 3)
+
+    def test_unchanged_info_is_not_modified(self):
+        self.add_resources(1)
+        response = self.get_info()
+        self.assertEqual(self.get_info(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        Project.objects.filter(pk=self.project.pk).update(name='renamed')
+        renamed = self.get_info(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(renamed.status_code, 200)
+        self.assertEqual(renamed.json()['name'], 'renamed')
@@ -0,0 +1,75 @@
+""" These tests check the requests which the bulk S3 operations make, against a stubbed boto3 client """
+import io
+
+import boto3
+import mock
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+
+from utils import s3
+
+
+# One worker, so that the stubbed responses are consumed in the order the calls are submitted.
+@override_settings(AWS_ENABLED=True, TESTING=False, AWS_S3_MAX_CONCURRENCY=1)
+class TestS3Batches(SimpleTestCase):
+    def setUp(self):
+        buckets = s3.BucketHolder()
+        buckets.s3 = boto3.client('s3', region_name='us-east-1', aws_access_key_id='key_id',
+                                  aws_secret_access_key='secret_key')
+        buckets.bucket_names = {'source': 'source-bucket'}
+        buckets.configured = True
+        self.stubber = Stubber(buckets.s3)
+        self.stubber.activate()
+        self.addCleanup(self.stubber.deactivate)
+        patcher = mock.patch('utils.s3._buckets', buckets)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        s3.stats.reset()
+
+    def add_get(self, key, data):
+        self.stubber.add_response('get_object', {'Body': StreamingBody(io.BytesIO(data), len(data))},
+                                  {'Bucket': 'source-bucket', 'Key': key})
+
+    def test_read_many(self):
+        self.add_get('a', b'one')
+        self.add_get('b', b'two')
+        self.assertEqual(s3.read_many('source', ['a', 'b', 'a']), {'a': b'one', 'b': b'two'})
+        self.stubber.assert_no_pending_responses()
+        stats = s3.stats.snapshot()
+        self.assertEqual((stats['get']['calls'], stats['get']['objects']), (2, 2))
+        self.assertEqual((stats['get_many']['calls'], stats['get_many']['objects']), (1, 2))
+
+    def test_read_many_raises_after_every_read(self):
+        self.stubber.add_client_error('get_object', 'NoSuchKey', http_status_code=404,
+                                      expected_params={'Bucket': 'source-bucket', 'Key': 'a'})
+        self.add_get('b', b'two')
+        with self.assertRaises(ClientError) as e:
+            s3.read_many('source', ['a', 'b'])
+        self.assertEqual(e.exception.response['Error']['Code'], 'NoSuchKey')
+        self.stubber.assert_no_pending_responses()
+
+    def test_write_many_passes_content_encoding(self):
+        for key, value in (('a', b'\x1f\x8bone'), ('b', b'\x1f\x8btwo')):
+            self.stubber.add_response('put_object', {}, {
+                'Bucket': 'source-bucket', 'Key': key, 'Body': value,
+                'ContentType': 'application/octet-stream', 'ContentEncoding': 'gzip'
+            })
+        s3.write_many('source', {'a': b'\x1f\x8bone', 'b': b'\x1f\x8btwo'}, content_encoding='gzip')
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(s3.stats.snapshot()['put']['calls'], 2)
+
+    @mock.patch('utils.s3.DELETE_BATCH_SIZE', 2)
+    def test_delete_many_batches_and_reports_errors(self):
+        self.stubber.add_response('delete_objects', {'Errors': [{'Key': 'b', 'Code': 'AccessDenied'}]}, {
+            'Bucket': 'source-bucket', 'Delete': {'Objects': [{'Key': 'a'}, {'Key': 'b'}], 'Quiet': True}
+        })
+        self.stubber.add_response('delete_objects', {}, {
+            'Bucket': 'source-bucket', 'Delete': {'Objects': [{'Key': 'c'}], 'Quiet': True}
+        })
+        self.assertEqual(s3.delete_many('source', ['a', 'b', 'c', 'a']), ['b'])
+        self.stubber.assert_no_pending_responses()
+        stats = s3.stats.snapshot()
+        self.assertEqual((stats['delete_objects']['calls'], stats['delete_objects']['objects']), (2, 3))
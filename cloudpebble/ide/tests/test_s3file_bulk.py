@@ -0,0 +1,62 @@
+""" These tests check that bulk S3File reads and deletes are routed through the batched S3 API """
+import mock
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ide.models.files import SourceFile
+from ide.models.project import Project
+from ide.models.s3file import read_contents_many, batched_deletes, ContentBlob
+from utils.fakes import FakeS3
+
+fake_s3 = FakeS3()
+
+
+@override_settings(AWS_ENABLED=True)
+class TestBulkS3File(TestCase):
+    def setUp(self):
+        fake_s3.reset()
+        patcher = mock.patch('utils.storage.s3', fake_s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user = User.objects.create_user('test', 'test@test.test', 'test')
+        self.project = Project.objects.create(name='test', owner=user)
+        self.files = []
+        for i in range(3):
+            f = SourceFile.objects.create(project=self.project, file_name='file%d.c' % i)
+            f.save_text('content %d' % i)
+            self.files.append(f)
+
+    def test_read_contents_many(self):
+        """ Check that read_contents_many fetches all files with a single bulk read """
+        with mock.patch.object(fake_s3, 'read_many', wraps=fake_s3.read_many) as read_many:
+            contents = read_contents_many(self.files)
+        self.assertEqual(read_many.call_count, 1)
+        self.assertEqual([contents[f] for f in self.files], ['content 0', 'content 1', 'content 2'])
+
+    def test_binary_contents_are_not_decoded(self):
+        """ Check that non-UTF-8 contents come back as bytes, as with get_contents() """
+        self.files[0].save_string(b'\xff\xfe')
+        self.assertEqual(read_contents_many(self.files[:1])[self.files[0]], b'\xff\xfe')
+
+    def test_batched_deletes(self):
+        """ Check that deleting files inside batched_deletes() issues one bulk delete """
+        # Only files stored before content-addressed blobs have objects of their own to delete.
+        self.project.source_files.update(blob=None)
+        with mock.patch.object(fake_s3, 'delete_file') as delete_file:
+            with mock.patch.object(fake_s3, 'delete_many', wraps=fake_s3.delete_many) as delete_many:
+                with self.captureOnCommitCallbacks(execute=True), batched_deletes():
+                    self.project.source_files.all().delete()
+        delete_file.assert_not_called()
+        self.assertEqual(delete_many.call_count, 1)
+        self.assertEqual(sorted(delete_many.call_args[0][1]), sorted('sources/%d' % f.id for f in self.files))
+
+    def test_batched_deletes_release_blobs(self):
+        """ Check that deleting blob-backed files releases their references without deleting shared contents """
+        SourceFile.objects.create(project=self.project, file_name='copy.c').save_text('content 0')
+        with self.captureOnCommitCallbacks(execute=True), batched_deletes():
+            self.project.source_files.all().delete()
+        self.assertEqual(set(ContentBlob.objects.values_list('refcount', flat=True)), {0})
+        self.assertEqual(len([key for key in fake_s3.dict if key[1].startswith('blobs/')]), 3)
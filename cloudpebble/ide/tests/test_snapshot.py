@@ -0,0 +1,67 @@
+""" These tests check that whole-project reads go through the packed source snapshot and notice changed files """
+import mock
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ide.models.files import SourceFile
+from ide.models.project import Project
+from ide.models.snapshot import read_project_contents, pack_snapshot, unpack_snapshot, snapshot_path
+from utils.fakes import FakeS3
+
+fake_s3 = FakeS3()
+
+
+@override_settings(AWS_ENABLED=True, SOURCE_SNAPSHOT_MIN_FILES=3)
+class TestSnapshot(TestCase):
+    def setUp(self):
+        fake_s3.reset()
+        patcher = mock.patch('utils.storage.s3', fake_s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user = User.objects.create_user('test', 'test@test.test', 'test')
+        self.project = Project.objects.create(name='test', owner=user)
+        for i in range(5):
+            SourceFile.objects.create(project=self.project, file_name='file%d.c' % i).save_text('content %d' % i)
+
+    def read(self):
+        files = list(self.project.source_files.order_by('file_name'))
+        contents = read_project_contents(self.project, files)
+        return [contents[f] for f in files]
+
+    def test_pack_round_trip(self):
+        entries = {1: ('a', b'xyz'), 20: ('b', b'')}
+        self.assertEqual(unpack_snapshot(pack_snapshot(entries)), entries)
+        with self.assertRaises(ValueError):
+            unpack_snapshot(b'garbage')
+
+    def test_second_read_uses_snapshot(self):
+        """ Check that once the snapshot exists, reading the project fetches only the snapshot """
+        self.assertEqual(self.read(), ['content %d' % i for i in range(5)])
+        with mock.patch.object(fake_s3, 'read_many', wraps=fake_s3.read_many) as read_many:
+            with mock.patch.object(fake_s3, 'save_file') as save_file:
+                self.assertEqual(self.read(), ['content %d' % i for i in range(5)])
+        read_many.assert_not_called()
+        save_file.assert_not_called()
+
+    def test_changed_file_is_refetched(self):
+        """ Check that a file written since the snapshot was taken is read individually and the snapshot updated """
+        self.read()
+        self.project.source_files.get(file_name='file2.c').save_text('changed')
+        with mock.patch.object(fake_s3, 'read_many', wraps=fake_s3.read_many) as read_many:
+            self.assertEqual(self.read()[2], 'changed')
+        self.assertEqual(len(read_many.call_args[0][1]), 1)
+        snapshot = unpack_snapshot(fake_s3.read_file('source', snapshot_path(self.project.id)))
+        self.assertEqual(len(snapshot), 5)
+
+    def test_small_projects_skip_snapshot(self):
+        with override_settings(SOURCE_SNAPSHOT_MIN_FILES=10):
+            self.read()
+        self.assertNotIn(('source', snapshot_path(self.project.id)), fake_s3.dict)
+
+    def test_deleting_project_deletes_snapshot(self):
+        self.read()
+        path = snapshot_path(self.project.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.project.delete()
+        self.assertNotIn(('source', path), fake_s3.dict)
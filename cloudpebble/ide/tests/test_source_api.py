@@ -11,7 +11,7 @@ __author__ = 'joe'
 fake_s3 = FakeS3()
 
 
-@mock.patch('ide.models.s3file.s3', fake_s3)
+@mock.patch('utils.storage.s3', fake_s3)
 class TestSource(CloudpebbleTestCase):
     """Tests for the Tests models"""
 
@@ -0,0 +1,149 @@
+""" These tests check that the storage backends behave the same way and that models store their files through them """
+import gzip
+import os
+import shutil
+import tempfile
+
+import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, SimpleTestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+
+from ide.models.build import BuildResult
+from ide.models.files import SourceFile
+from ide.models.project import Project
+from ide.models.s3file import ContentBlob
+from utils.fakes import FakeS3
+from utils.storage import LocalStorage, MemoryStorage, S3Storage, ObjectNotFound, get_storage, STREAM_CHUNK_SIZE
+
+CONTENT = bytes(i % 256 for i in range(3 * STREAM_CHUNK_SIZE + 100))
+
+
+class StorageBackendTests(object):
+    def test_write_and_read(self):
+        self.storage.write('source', 'a/b', CONTENT)
+        self.storage.write('source', 'text', 'hello')
+        self.assertEqual(self.storage.read('source', 'a/b'), CONTENT)
+        self.assertEqual(self.storage.read_many('source', ['a/b', 'text']), {'a/b': CONTENT, 'text': b'hello'})
+
+    def test_missing_object(self):
+        with self.assertRaises(ObjectNotFound):
+            self.storage.read('source', 'missing')
+        # Deleting something which isn't there is not an error.
+        self.storage.delete('source', 'missing')
+
+    def test_stream_range(self):
+        self.storage.write('builds', 'big', CONTENT)
+        self.assertEqual(b''.join(self.storage.stream('builds', 'big')), CONTENT)
+        start, end = STREAM_CHUNK_SIZE - 10, 2 * STREAM_CHUNK_SIZE + 10
+        self.assertEqual(b''.join(self.storage.stream('builds', 'big', start, end)), CONTENT[start:end + 1])
+
+    def test_open(self):
+        self.storage.write('source', 'big', CONTENT)
+        with self.storage.open('source', 'big') as f:
+            f.seek(-100, os.SEEK_END)
+            self.assertEqual(f.read(), CONTENT[-100:])
+            f.seek(STREAM_CHUNK_SIZE)
+            self.assertEqual(f.read(10), CONTENT[STREAM_CHUNK_SIZE:STREAM_CHUNK_SIZE + 10])
+        with self.assertRaises(ObjectNotFound):
+            self.storage.open('source', 'missing')
+
+    def test_copy_download_and_delete(self):
+        self.storage.write('export', 'src', CONTENT)
+        self.storage.copy('export', 'src', 'dest')
+        self.storage.delete_many('export', ['src'])
+        with self.assertRaises(ObjectNotFound):
+            self.storage.read('export', 'src')
+        destination = os.path.join(self.temp_dir, 'downloaded')
+        self.storage.download('export', 'dest', destination)
+        with open(destination, 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+
+
+class TestMemoryStorage(StorageBackendTests, SimpleTestCase):
+    def setUp(self):
+        self.storage = MemoryStorage()
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+
+class TestLocalStorage(StorageBackendTests, SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.storage = LocalStorage({name: os.path.join(self.temp_dir, name) for name in ('source', 'builds', 'export')})
+
+    def test_keys_cannot_escape_bucket(self):
+        with self.assertRaises(ObjectNotFound):
+            self.storage.local_path('export', '../source/secret')
+        with self.assertRaises(ObjectNotFound):
+            self.storage.write('export', '/etc/passwd', b'nope')
+
+
+class TestS3Open(SimpleTestCase):
+    def test_open_reads_ranges(self):
+        """ Check that opening an S3 object fetches only the parts which are read, in buffer-sized pieces """
+        fake_s3 = FakeS3()
+        fake_s3.save_file('source', 'big', CONTENT)
+        with mock.patch('utils.storage.s3', fake_s3), \
+                mock.patch('utils.storage.OPEN_BUFFER_SIZE', STREAM_CHUNK_SIZE), \
+                mock.patch.object(fake_s3, 'open_file', wraps=fake_s3.open_file) as open_file:
+            f = S3Storage().open('source', 'big')
+            f.seek(-100, os.SEEK_END)
+            self.assertEqual(f.read(), CONTENT[-100:])
+            f.seek(10)
+            self.assertEqual(f.read(10), CONTENT[10:20])
+            self.assertEqual(f.read(10), CONTENT[20:30])
+        self.assertEqual([c[1]['byte_range'] for c in open_file.call_args_list],
+                         ['bytes=%d-%d' % (len(CONTENT) - 100, len(CONTENT) - 1),
+                          'bytes=10-%d' % (STREAM_CHUNK_SIZE + 9)])
+
+
+@override_settings(STORAGE_BACKEND='memory')
+class TestModelsUseStorage(TestCase):
+    def setUp(self):
+        get_storage().reset()
+        user = User.objects.create_user('test', 'test@test.test', 'test')
+        self.project = Project.objects.create(name='test', owner=user, app_short_name='test')
+
+    def test_source_file(self):
+        source_file = SourceFile.objects.create(project=self.project, file_name='main.c')
+        source_file.save_text('int main;')
+        self.assertEqual(SourceFile.objects.get(pk=source_file.pk).get_contents(), 'int main;')
+
+    def test_build_result(self):
+        build = BuildResult.objects.create(project=self.project)
+        build.save_build_log('built')
+        self.assertEqual(get_storage().keys('builds'), ['%s/build_log.txt' % build.uuid])
+        self.assertEqual(build.read_build_log(), 'built')
+
+    def test_sources_are_compressed(self):
+        """ Check that source files are stored gzipped, and that files stored before compression are still read """
+        source_file = SourceFile.objects.create(project=self.project, file_name='main.c')
+        source_file.save_text('int main;')
+        self.assertTrue(ContentBlob.is_compressed(source_file.blob_id))
+        self.assertEqual(gzip.decompress(get_storage().read('source', source_file.storage_key)), b'int main;')
+        SourceFile.objects.filter(pk=source_file.pk).update(blob=None)
+        get_storage().write('source', 'sources/%d' % source_file.id, b'int old;')
+        self.assertEqual(SourceFile.objects.get(pk=source_file.pk).get_contents(), 'int old;')
+
+    @override_settings(STORAGE_COMPRESSION={})
+    def test_compression_can_be_disabled(self):
+        source_file = SourceFile.objects.create(project=self.project, file_name='main.c')
+        source_file.save_text('int main;')
+        self.assertEqual(get_storage().read('source', source_file.storage_key), b'int main;')
+
+    def test_compressed_build_log_download(self):
+        """ Check that a compressed build log is passed through to clients accepting gzip and decoded for others """
+        build = BuildResult.objects.create(project=self.project)
+        build.save_build_log('built')
+        url = '/s3builds/%s/build_log.txt' % build.uuid
+        response = Client().get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b'built')
+        response = Client().get(url)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), b'built')
+        self.assertIn('Accept-Encoding', response['Vary'])
@@ -43,6 +43,7 @@ from ide.api.source import (
     delete_source_file,
     rename_source_file,
 )
+from ide.api.upload import request_upload, upload_staged
 from ide.api.user import (
     transition_accept,
     transition_export,
@@ -119,6 +120,12 @@ urlpatterns = [
         create_binary_source_file,
         name="create_binary_source_file",
     ),
+    re_path(
+        r"^project/(?P<project_id>\d+)/request_upload",
+        request_upload,
+        name="request_upload",
+    ),
+    re_path(r"^upload/(?P<token>[\w:.-]+)$", upload_staged, name="upload_staged"),
     re_path(
         r"^project/(?P<project_id>\d+)/source/(?P<file_id>\d+)/load",
         load_source_file,
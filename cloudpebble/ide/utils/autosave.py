@@ -0,0 +1,231 @@
+"""
+Write-behind buffering for editor autosaves.
+
+While the user types, the editor saves the open file every few seconds. Instead of writing every save to storage,
+the latest content and folded lines of each file are kept in Redis and written out once the file has been quiet for
+AUTOSAVE_FLUSH_DELAY seconds, or AUTOSAVE_MAX_FLUSH_DELAY seconds after the first unwritten save if the user never
+stops typing. Reads through SourceFile.get_contents() see the buffered version. Anything which reads the stored
+bytes directly (builds, exports, git pushes) must call flush_project() first. Files with unwritten saves are also
+tracked in a Redis set, so that a periodic sweep can queue the flush again if its task is lost.
+"""
+import datetime
+import json
+import time
+import uuid
+
+from django.conf import settings
+from django.utils.timezone import now
+
+from ide.models.s3file import S3File
+from utils.redis_helper import redis_client
+
+DIRTY_SET_KEY = 'autosave-dirty'
+
+
+def _entry_key(file_id):
+    return 'autosave-file-{0}'.format(file_id)
+
+
+def _flushed_key(file_id):
+    return 'autosave-flushed-{0}'.format(file_id)
+
+
+def _pending_key(file_id):
+    return 'autosave-pending-{0}'.format(file_id)
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def _timestamp_to_datetime(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
+
+
+def _parse_entry(entry, flushed):
+    if entry is None:
+        return None
+    entry = json.loads(_decode(entry))
+    entry['dirty'] = _decode(flushed) != entry['token']
+    return entry
+
+
+def enabled():
+    return settings.AUTOSAVE_BUFFER_ENABLED
+
+
+def get_entry(file_id):
+    """ Get the buffered save for a source file.
+    :return: A dictionary with the keys 'content', 'folded_lines', 'modified', 'since', 'token' and 'dirty',
+    or None if nothing is buffered. 'dirty' is True if the content has not yet been written to storage.
+    """
+    if not enabled():
+        return None
+    return _parse_entry(*redis_client.mget([_entry_key(file_id), _flushed_key(file_id)]))
+
+
+def get_entries(file_ids):
+    """ Get the buffered saves for several source files in one round trip.
+    :return: A dictionary of file ID -> entry, as returned by get_entry(), omitting files with nothing buffered.
+    """
+    file_ids = list(file_ids)
+    if not enabled() or not file_ids:
+        return {}
+    values = redis_client.mget([key for file_id in file_ids for key in (_entry_key(file_id), _flushed_key(file_id))])
+    entries = {}
+    for i, file_id in enumerate(file_ids):
+        entry = _parse_entry(values[i * 2], values[i * 2 + 1])
+        if entry is not None:
+            entries[file_id] = entry
+    return entries
+
+
+def _apply_entry(source_file, entry):
+    source_file.folded_lines = entry['folded_lines']
+    modified = _timestamp_to_datetime(entry['modified'])
+    if source_file.last_modified is None or modified > source_file.last_modified:
+        source_file.last_modified = modified
+
+
+def overlay(source_file):
+    """ Update an unsaved SourceFile instance's last_modified and folded_lines from its buffered save, if any,
+    so that modification checks and the values reported to the editor match what the editor last sent. """
+    entry = get_entry(source_file.id)
+    if entry is not None:
+        _apply_entry(source_file, entry)
+
+
+def overlay_many(source_files):
+    """ As overlay(), for several files at once. """
+    source_files = list(source_files)
+    entries = get_entries(f.id for f in source_files)
+    for f in source_files:
+        if f.id in entries:
+            _apply_entry(f, entries[f.id])
+
+
+def modified_times(file_ids):
+    """ Get the times of the buffered saves of several source files, for callers without SourceFile instances.
+    :return: A dictionary of file ID -> datetime, omitting files with nothing buffered.
+    """
+    return {file_id: _timestamp_to_datetime(entry['modified']) for file_id, entry in get_entries(file_ids).items()}
+
+
+def buffer_save(source_file, content, folded_lines):
+    """ Record an editor save of a source file and schedule it to be written to storage.
+    :param source_file: The SourceFile being saved. Its last_modified and folded_lines are updated but not saved.
+    :param content: The new file content, as a string
+    :param folded_lines: A JSON string describing the folded lines
+    """
+    assert enabled()
+    previous = get_entry(source_file.id)
+    modified = now()
+    timestamp = modified.timestamp()
+    entry = {
+        'content': content,
+        'folded_lines': folded_lines or "[]",
+        'modified': timestamp,
+        # Track when the oldest unwritten save happened, so that continuous typing cannot delay a flush forever.
+        'since': previous['since'] if previous is not None and previous['dirty'] else timestamp,
+        'token': uuid.uuid4().hex
+    }
+    redis_client.set(_entry_key(source_file.id), json.dumps(entry), ex=settings.AUTOSAVE_BUFFER_TTL)
+    source_file.folded_lines = entry['folded_lines']
+    source_file.last_modified = modified
+    redis_client.sadd(DIRTY_SET_KEY, source_file.id)
+    _schedule_flush(source_file.id)
+
+
+def _schedule_flush(file_id):
+    # Only one flush task is queued per file at a time. If the task is lost, the marker expires and the next save or
+    # sweep queues a new one.
+    if redis_client.set(_pending_key(file_id), 1, nx=True, ex=settings.AUTOSAVE_MAX_FLUSH_DELAY * 2):
+        from ide.tasks.autosave import flush_autosave
+        flush_autosave.apply_async(args=[file_id], countdown=settings.AUTOSAVE_FLUSH_DELAY)
+        return True
+    return False
+
+
+def reschedule_stranded():
+    """ Queue a flush for each file with an unwritten save but no flush waiting, and forget files which have
+    nothing left to write.
+    :return: The number of flushes queued
+    """
+    if not enabled():
+        return 0
+    file_ids = [int(_decode(file_id)) for file_id in redis_client.smembers(DIRTY_SET_KEY)]
+    entries = get_entries(file_ids)
+    queued = 0
+    for file_id in file_ids:
+        entry = entries.get(file_id)
+        if entry is None or not entry['dirty']:
+            redis_client.srem(DIRTY_SET_KEY, file_id)
+            # Put the file back if it was saved again between reading its entry and removing it.
+            entry = get_entry(file_id)
+            if entry is None or not entry['dirty']:
+                continue
+            redis_client.sadd(DIRTY_SET_KEY, file_id)
+        if _schedule_flush(file_id):
+            queued += 1
+    return queued
+
+
+def seconds_until_due(entry):
+    """ Return how many seconds remain before a buffered save should be flushed. """
+    current = time.time()
+    quiet = entry['modified'] + settings.AUTOSAVE_FLUSH_DELAY - current
+    overdue = entry['since'] + settings.AUTOSAVE_MAX_FLUSH_DELAY - current
+    return max(0, min(quiet, overdue))
+
+
+def keep_pending(file_id):
+    redis_client.set(_pending_key(file_id), 1, ex=settings.AUTOSAVE_MAX_FLUSH_DELAY * 2)
+
+
+def clear_pending(file_id):
+    redis_client.delete(_pending_key(file_id))
+
+
+def discard(file_id):
+    """ Drop anything buffered for a source file, e.g. because its stored content has been replaced directly. """
+    if enabled():
+        redis_client.delete(_entry_key(file_id), _flushed_key(file_id))
+        redis_client.srem(DIRTY_SET_KEY, file_id)
+
+
+def flush(source_file, entry=None):
+    """ Write a source file's buffered save to storage and the database, if it has not been already.
+    :return: True if anything was written
+    """
+    if entry is None:
+        entry = get_entry(source_file.id)
+    if entry is None or not entry['dirty']:
+        return False
+    # SourceFile.save_string() discards the buffer, which is not what we want here.
+    S3File.save_string(source_file, entry['content'].encode('utf-8'))
+    # Use update() so that auto_now does not move last_modified past the time the editor was told about.
+    type(source_file).objects.filter(pk=source_file.pk).update(
+        folded_lines=entry['folded_lines'],
+        last_modified=_timestamp_to_datetime(entry['modified'])
+    )
+    redis_client.set(_flushed_key(source_file.id), entry['token'], ex=settings.AUTOSAVE_BUFFER_TTL)
+    return True
+
+
+def has_unflushed_saves(project):
+    """ :return: True if any of a project's source files have buffered saves which haven't been written yet. """
+    if not enabled():
+        return False
+    entries = get_entries(project.source_files.values_list('id', flat=True))
+    return any(entry['dirty'] for entry in entries.values())
+
+
+def flush_project(project):
+    """ Write any buffered saves for a project's source files to storage. """
+    if not enabled():
+        return
+    source_files = list(project.source_files.all())
+    entries = get_entries(f.id for f in source_files)
+    for f in source_files:
+        if f.id in entries:
+            flush(f, entries[f.id])
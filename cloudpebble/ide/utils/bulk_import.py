@@ -0,0 +1,135 @@
+"""
+Creating a project's files in bulk.
+
+Creating files one at a time costs several queries each: every IdeModel is full_clean()ed by a pre_save hook, which
+checks foreign keys and uniqueness against the database, and saving a file, resource or identifier also saves its
+project. ProjectImport instead collects the files to create, validates them in memory, uploads their contents
+concurrently with ContentBlob.acquire_many() and inserts the rows with bulk_create(), so committing an import takes a
+fixed number of queries however many files it has. The project's last_modified is touched once, on commit.
+"""
+import logging
+import time
+from collections import OrderedDict, Counter
+from contextlib import contextmanager
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils.timezone import now
+from django.utils.translation import gettext as _
+
+from ide.models.files import ResourceFile, ResourceVariant, ResourceIdentifier, SourceFile
+from ide.models.s3file import ContentBlob
+from ide.utils.git import git_sha
+from utils.storage import compression_for
+
+logger = logging.getLogger(__name__)
+
+MAX_FILE_SIZE = 5 * 1024 * 1024
+
+
+class ProjectImport(object):
+    """ Collects the files to be added to a project, then creates them all at once with commit().
+    Time spent in each stage is recorded in timings, in milliseconds. Callers may time their own stages (such as
+    reading the files) with timed(); commit() times 'validate', 'upload' and 'insert'.
+    """
+
+    def __init__(self, project):
+        self.project = project
+        self.resource_files = []
+        self.variants = []
+        self.source_files = []
+        self.identifiers = []
+        self.timings = OrderedDict()
+
+    @contextmanager
+    def timed(self, stage):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.timings[stage] = self.timings.get(stage, 0) + (time.monotonic() - start) * 1000
+
+    @property
+    def file_count(self):
+        return len(self.variants) + len(self.source_files)
+
+    def add_resource_file(self, file_name, kind, is_menu_icon=False):
+        """ :return: The (unsaved) ResourceFile, to pass to add_variant() and add_identifier() """
+        resource_file = ResourceFile(project=self.project, file_name=file_name, kind=kind, is_menu_icon=is_menu_icon)
+        self.resource_files.append(resource_file)
+        return resource_file
+
+    def add_variant(self, resource_file, tags, data):
+        self.variants.append((ResourceVariant(resource_file=resource_file, tags=tags), data))
+
+    def add_source_file(self, file_name, target, data):
+        """ :param data: The file's contents, as bytes or a string. Text files must be UTF-8. """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        source_file = SourceFile(project=self.project, file_name=file_name, target=target)
+        if source_file.is_editable_text:
+            # Fail the way writing the file with save_text() would.
+            data.decode('utf-8')
+        self.source_files.append((source_file, data))
+
+    def add_identifier(self, resource_file, **options):
+        self.identifiers.append(ResourceIdentifier(resource_file=resource_file, **options))
+
+    def validate(self):
+        """ Check every file as full_clean() would, without touching the database. Uniqueness is checked among
+        the new files only; clashes with existing rows are left to the database's constraints.
+        :raises ValidationError: if anything is invalid
+        """
+        for resource_file in self.resource_files:
+            resource_file.full_clean(exclude=['project'], validate_unique=False)
+        for source_file, data in self.source_files:
+            source_file.full_clean(exclude=['project', 'blob'], validate_unique=False)
+        for variant, data in self.variants:
+            variant.full_clean(exclude=['resource_file', 'blob'], validate_unique=False)
+        for identifier in self.identifiers:
+            identifier.full_clean(exclude=['resource_file'], validate_unique=False)
+        for f, data in self.source_files + self.variants:
+            if len(data) > MAX_FILE_SIZE:
+                raise ValidationError(_("Uploaded file too big."))
+
+        self._check_unique(_("resource"), (r.file_name for r in self.resource_files))
+        self._check_unique(_("source file"), ((f.file_name, f.target) for f, data in self.source_files))
+        self._check_unique(_("resource variant"),
+                           ((id(v.resource_file), v.tags) for v, data in self.variants))
+
+    @staticmethod
+    def _check_unique(kind, keys):
+        duplicates = [key for key, count in Counter(keys).items() if count > 1]
+        if duplicates:
+            raise ValidationError(_("The project contains more than one %s with the same name.") % kind)
+
+    def _acquire_blobs(self, files):
+        """ Take references to blobs holding the contents of (S3File, data) pairs, and point each file at its blob """
+        if not files:
+            return
+        model = type(files[0][0])
+        compress = model.compression_kind is not None and compression_for(model.compression_kind) == 'gzip'
+        keys = ContentBlob.acquire_many([data for f, data in files], compress=compress)
+        for (f, data), sha256 in zip(files, keys):
+            f.blob_id = sha256
+            f.git_sha = git_sha(data)
+
+    def commit(self):
+        """ Validate, upload and insert everything added so far, then save the project. This should be called
+        inside a transaction, so that nothing is created if anything fails. """
+        with self.timed('validate'):
+            self.validate()
+        with transaction.atomic():
+            with self.timed('upload'):
+                self._acquire_blobs(self.source_files)
+                self._acquire_blobs(self.variants)
+            with self.timed('insert'):
+                # Resource files must be inserted first, since variants and identifiers need their IDs.
+                ResourceFile.objects.bulk_create(self.resource_files)
+                SourceFile.objects.bulk_create([f for f, data in self.source_files])
+                ResourceVariant.objects.bulk_create([v for v, data in self.variants])
+                ResourceIdentifier.objects.bulk_create(self.identifiers)
+                self.project.last_modified = now()
+                self.project.save()
+        logger.info("Imported %d files into project %d (%s)", self.file_count, self.project.id,
+                    ", ".join("%s: %.1fms" % item for item in self.timings.items()))
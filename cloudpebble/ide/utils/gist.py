@@ -0,0 +1,93 @@
+"""
+Cached reads of GitHub gists.
+
+Gists are fetched anonymously, which GitHub rate-limits heavily, and popular gists are imported over and over. Each
+gist is kept in Redis for GIST_CACHE_TTL seconds with its ETag. For GIST_CACHE_FRESH seconds after GitHub last
+confirmed it, the cached copy is used without asking GitHub at all; after that it is revalidated with a conditional
+request, which doesn't count against the rate limit if the gist hasn't changed. Raw file contents up to
+GIST_RAW_CACHE_MAX_SIZE bytes are cached by gist revision, so they never need revalidating.
+"""
+import base64
+import hashlib
+import json
+import time
+from collections import namedtuple
+from urllib.error import HTTPError
+from urllib.parse import quote
+from urllib.request import urlopen, Request
+
+from django.conf import settings
+from github import GithubException, UnknownObjectException
+
+from utils.redis_helper import redis_client
+
+Gist = namedtuple('Gist', ['id', 'revision', 'description', 'files'])
+GistFile = namedtuple('GistFile', ['content', 'raw_url'])
+
+
+def _gist_key(gist_id):
+    return 'gist-{0}'.format(gist_id)
+
+
+def _raw_key(gist_id, revision, filename):
+    return 'gist-raw-{0}-{1}-{2}'.format(gist_id, revision, hashlib.sha1(filename.encode('utf-8')).hexdigest())
+
+
+def _summarise(data):
+    """ Keep only the parts of the API's description of a gist which imports need. """
+    history = data.get('history') or [{}]
+    return {
+        'id': data['id'],
+        'revision': history[0].get('version') or data.get('updated_at'),
+        'description': data.get('description'),
+        'files': {name: {'content': f.get('content'), 'raw_url': f.get('raw_url')}
+                  for name, f in data.get('files', {}).items()}
+    }
+
+
+def _to_gist(summary):
+    return Gist(id=summary['id'], revision=summary['revision'], description=summary['description'],
+                files={name: GistFile(**f) for name, f in summary['files'].items()})
+
+
+def get_gist(gist_id):
+    """ Fetch a gist, from the cache if possible.
+    :raises UnknownObjectException: if there is no such gist
+    """
+    key = _gist_key(gist_id)
+    cached = redis_client.get(key)
+    cached = json.loads(cached) if cached is not None else None
+    if cached is not None and time.time() - cached['checked'] < settings.GIST_CACHE_FRESH:
+        return _to_gist(cached['gist'])
+
+    request = Request(settings.GITHUB_API_URL + '/gists/' + quote(str(gist_id), safe=''))
+    request.add_header("Accept", "application/vnd.github+json")
+    if cached is not None and cached['etag'] is not None:
+        request.add_header("If-None-Match", cached['etag'])
+    try:
+        response = urlopen(request)
+    except HTTPError as e:
+        if e.code == 304 and cached is not None:
+            summary, etag = cached['gist'], cached['etag']
+        elif e.code == 404:
+            raise UnknownObjectException(e.code, None, dict(e.headers))
+        else:
+            raise GithubException(e.code, None, dict(e.headers))
+    else:
+        summary, etag = _summarise(json.loads(response.read())), response.headers.get('ETag')
+    redis_client.set(key, json.dumps({'gist': summary, 'etag': etag, 'checked': time.time()}),
+                     ex=settings.GIST_CACHE_TTL)
+    return _to_gist(summary)
+
+
+def read_raw(gist, filename):
+    """ :return: The exact bytes of a file in a gist, from the cache if possible """
+    key = _raw_key(gist.id, gist.revision, filename)
+    cached = redis_client.get(key)
+    if cached is not None:
+        return base64.b64decode(cached)
+    data = urlopen(gist.files[filename].raw_url).read()
+    # Raw files don't count against the API rate limit, so large ones aren't worth the memory.
+    if len(data) <= settings.GIST_RAW_CACHE_MAX_SIZE:
+        redis_client.set(key, base64.b64encode(data).decode('ascii'), ex=settings.GIST_CACHE_TTL)
+    return data
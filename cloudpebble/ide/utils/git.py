@@ -1,8 +1,15 @@
 import base64
+import datetime
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.utils.translation import gettext as _
 
 __author__ = 'katharine'
 
+# Below this fraction of the hourly rate limit remaining, blobs are created one at a time.
+RATE_LIMIT_LOW_WATER = 0.1
+
 
 def git_sha(content):
     if isinstance(content, str):
@@ -12,3 +19,46 @@ def git_sha(content):
 
 def git_blob(repo, sha):
     return base64.b64decode(repo.get_git_blob(sha).content)
+
+
+def _map_within_rate_limit(github, fn, items, concurrency):
+    """ Call fn on each item, several at a time, with each call making one GitHub request.
+    The rate limit GitHub reported in its last response decides how: if it can't cover every call, none are made,
+    and if little of it remains the calls are made one at a time.
+    :return: A list of the results, in the same order as items
+    """
+    items = list(items)
+    if not items:
+        return []
+    remaining, limit = github.rate_limiting
+    if remaining < len(items):
+        reset = datetime.datetime.utcfromtimestamp(github.rate_limiting_resettime)
+        raise Exception(_("GitHub's rate limit has been reached. Try again after %s UTC.") % reset.strftime('%H:%M'))
+    if remaining < limit * RATE_LIMIT_LOW_WATER:
+        concurrency = 1
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(items)))) as executor:
+        return list(executor.map(fn, items))
+
+
+def create_git_blobs(github, repo, contents, concurrency):
+    """ Create a blob in repo for each of several contents, several at a time.
+    :param github: The Github client repo was fetched with
+    :param contents: A dictionary of key -> bytes
+    :param concurrency: The most blobs to create at once
+    :return: A dictionary of key -> blob SHA
+    """
+    def create(item):
+        key, content = item
+        return key, repo.create_git_blob(base64.b64encode(content).decode('ascii'), 'base64').sha
+
+    return dict(_map_within_rate_limit(github, create, contents.items(), concurrency))
+
+
+def read_git_blobs(github, repo, shas, concurrency):
+    """ Fetch several blobs from repo, several at a time.
+    :param github: The Github client repo was fetched with
+    :param shas: An iterable of blob SHAs
+    :param concurrency: The most blobs to fetch at once
+    :return: A dictionary of SHA -> contents, as bytes
+    """
+    return dict(_map_within_rate_limit(github, lambda sha: (sha, git_blob(repo, sha)), set(shas), concurrency))
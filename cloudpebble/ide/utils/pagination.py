@@ -0,0 +1,77 @@
+"""
+Keyset ("cursor") pagination for API listings.
+
+Pages are selected by comparing the sort key with that of the last row on the previous page, rather than with an
+OFFSET, so a page costs the same however deep into the listing it is, and rows added or removed between requests don't
+shift later pages. The cursor passed to clients is an opaque token holding that sort key, and the row's ID, which
+breaks ties between rows with the same sort key.
+"""
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from django.utils.translation import gettext as _
+
+from utils.jsonview import BadRequest
+
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(value, pk):
+    # Datetimes are written in full, since anything truncated would compare unequal to the value it came from.
+    data = json.dumps([value, pk], default=lambda x: x.isoformat())
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """ :return: The (sort key, ID) pair encoded in a cursor
+    :raises BadRequest: if the cursor is malformed
+    """
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return value, int(pk)
+    except (ValueError, TypeError, UnicodeError, binascii.Error):
+        raise BadRequest(_("Invalid cursor."))
+
+
+def page_size(value, default=None):
+    """ Parse a requested page size, which is capped at MAX_PAGE_SIZE. None means no limit unless a default is given.
+    :raises BadRequest: if the page size is not a positive integer
+    """
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise BadRequest(_("Invalid page size."))
+    if limit < 1:
+        raise BadRequest(_("Invalid page size."))
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def paginate(queryset, sort='id', cursor=None, limit=None):
+    """ Get a page of a queryset.
+    :param sort: The name of the field to sort by, prefixed with '-' to sort in descending order. It must not be
+    nullable, and rows with the same value are ordered by ID.
+    :param cursor: The cursor returned with the previous page, if any
+    :param limit: The page size, or None for everything after the cursor
+    :return: A tuple of (list of rows, cursor for the next page or None if this is the last)
+    """
+    descending = sort.startswith('-')
+    field = sort.lstrip('-')
+    queryset = queryset.order_by(sort, '-pk' if descending else 'pk')
+    if cursor is not None:
+        value, pk = decode_cursor(cursor)
+        lookup = 'lt' if descending else 'gt'
+        if field in ('id', 'pk'):
+            queryset = queryset.filter(**{'pk__' + lookup: pk})
+        else:
+            queryset = queryset.filter(Q(**{field + '__' + lookup: value}) | Q(**{field: value, 'pk__' + lookup: pk}))
+    if limit is None:
+        return list(queryset), None
+    rows = list(queryset[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], encode_cursor(getattr(last, field), last.pk)
@@ -0,0 +1,40 @@
+import threading
+import time
+
+PROGRESS_STATE = 'PROGRESS'
+
+
+class TaskProgress(object):
+    """ Reports how far through a Celery task we are as the task's state, which check_task passes on to the client.
+    Work is divided into named stages, each with a total amount of work (e.g. projects to pack or bytes to upload).
+    advance() may be called from several threads, and reports are rate-limited since each is a result backend write.
+    """
+
+    def __init__(self, task, interval=0.5):
+        self.task = task
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.name = None
+        self.done = 0
+        self.total = 0
+        self.last_report = 0
+
+    def stage(self, name, total):
+        with self.lock:
+            self.name = name
+            self.done = 0
+            self.total = total
+            self._report()
+
+    def advance(self, amount=1):
+        with self.lock:
+            self.done = min(self.done + amount, self.total) if self.total else self.done + amount
+            if time.monotonic() - self.last_report >= self.interval or self.done == self.total:
+                self._report()
+
+    def _report(self):
+        self.last_report = time.monotonic()
+        # Tasks run synchronously (e.g. in tests) have no state to update.
+        if self.task.request.id is None:
+            return
+        self.task.update_state(state=PROGRESS_STATE, meta={'stage': self.name, 'done': self.done, 'total': self.total})
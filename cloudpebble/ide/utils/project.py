@@ -15,6 +15,7 @@ MANIFEST_KINDS = [PACKAGE_MANIFEST, APPINFO_MANIFEST]
 # build/ contains waf build artifacts (including appinfo.json and auto-generated .c files).
 # node_modules/ contains npm dependencies (which may have their own package.json with "pebble" keys).
 _SKIP_DIRS = ('build/', 'node_modules/')
+SRC_DIR = 'src/'
 
 
 class InvalidProjectArchiveException(Exception):
@@ -49,60 +50,61 @@ def is_manifest(kind, contents):
         return False
 
 
+def _is_skipped(path):
+    """ Manifests inside build artifacts or dependency directories never mark a project root. """
+    return any(('/' + d) in path or path.startswith(d) for d in _SKIP_DIRS)
+
+
+def _index_source_roots(paths):
+    """ Find, in a single pass over the paths, every directory which has a source file somewhere under its src/.
+    :param paths: An iterable of item paths
+    :return: A set of directory paths, each either '' or ending in '/'
+    """
+    roots = set()
+    for path in paths:
+        if not path.endswith(('.c', '.js')):
+            continue
+        # Every directory in the path directly containing a 'src' directory is a root for this file.
+        start = path.find(SRC_DIR)
+        while start != -1:
+            if start == 0 or path[start - 1] == '/':
+                roots.add(path[:start])
+            start = path.find(SRC_DIR, start + 1)
+    return roots
+
+
 def find_project_root_and_manifest(project_items):
     """ Given the contents of an archive, find a valid Pebble project.
+    Paths are indexed once up front, so that appinfo.json files without any sources can be ruled out without being
+    read. The remaining candidates are read in order of preference until a valid manifest is found: shallowest
+    first, then package.json before appinfo.json, then in the order given.
     :param project_items: A list of BaseProjectItems
     :return: A tuple of (path_to_project, manifest BaseProjectItem)
     """
-    SRC_DIR = 'src/'
-    invalid_package_path = None
-    for item in project_items:
-        base_dir = item.path
-
-        # Skip manifests inside build artifacts or dependency directories.
-        if any(('/' + d) in base_dir or base_dir.startswith(d) for d in _SKIP_DIRS):
-            continue
-
-        # Check if the file is one of the kinds of manifest file
-        for name in MANIFEST_KINDS:
-            dir_end = base_dir.rfind(name)
-            if dir_end == -1:
-                continue
-            # Ensure that the file is actually a manifest file
-            if dir_end + len(name) == len(base_dir):
-                content = item.read()
-                try:
-                    if is_manifest(name, content):
-                        manifest_item = item
-                        break
-                except ValueError as e:
-                    invalid_package_path = item.path
-        else:
-            # If the file is not a manifest file, continue looking for the manfiest.
+    project_items = list(project_items)
+    source_roots = _index_source_roots(item.path for item in project_items)
+
+    candidates = []
+    for position, item in enumerate(project_items):
+        path = item.path
+        name = path.rsplit('/', 1)[-1]
+        if name not in MANIFEST_KINDS or _is_skipped(path):
             continue
-
         # The base dir is the location of the manifest file without the manifest filename.
-        base_dir = base_dir[:dir_end]
-
-        # If we found a valid package.json, just return.
-        if name == PACKAGE_MANIFEST:
-            return base_dir, manifest_item
-
-        # Otherwise if it's an appinfo.json, check that there is a a source directory containing
-        # at least one source file.
-        for source_item in project_items:
-            source_dir = source_item.path
-            if source_dir[:dir_end] != base_dir:
-                continue
-            if not source_dir.endswith('.c') and not source_dir.endswith('.js'):
-                continue
-            if source_dir[dir_end:dir_end + len(SRC_DIR)] != SRC_DIR:
-                continue
-            break
-        else:
-            # If there was no source directory with a source file, keep looking for manifest files.
+        base_dir = path[:-len(name)]
+        # An appinfo.json is only a project if there is a source directory containing at least one source file.
+        if name == APPINFO_MANIFEST and base_dir not in source_roots:
             continue
-        return base_dir, manifest_item
+        candidates.append(((base_dir.count('/'), name != PACKAGE_MANIFEST, position), base_dir, name, item))
+    candidates.sort(key=lambda candidate: candidate[0])
+
+    invalid_package_path = None
+    for rank, base_dir, name, item in candidates:
+        try:
+            if is_manifest(name, item.read()):
+                return base_dir, item
+        except ValueError:
+            invalid_package_path = item.path
 
     # If we didn't find a valid project but we did find a broken manifest file, complain about it specifically.
     if invalid_package_path:
@@ -5,6 +5,8 @@ import shutil
 from django.conf import settings
 
 from ide.models import ResourceFile
+from ide.models.s3file import copy_many_to_paths
+from ide.models.snapshot import read_project_contents
 from .manifest import manifest_name_for_project, generate_manifest_dict
 from ide.utils.sdk import generate_wscript_file, generate_jshint_file
 
@@ -12,6 +14,7 @@ from ide.utils.sdk import generate_wscript_file, generate_jshint_file
 def assemble_source_files(project, base_dir):
     """ Copy all the source files for a project into a project directory """
     source_files = project.source_files.all()
+    targets = []
     for f in source_files:
         target_dir = os.path.join(base_dir, f.project_dir)
         abs_target = os.path.abspath(os.path.join(target_dir, f.file_name))
@@ -20,7 +23,8 @@ def assemble_source_files(project, base_dir):
         abs_target_dir = os.path.dirname(abs_target)
         if not os.path.exists(abs_target_dir):
             os.makedirs(abs_target_dir)
-        f.copy_to_path(abs_target)
+        targets.append((f, abs_target))
+    copy_many_to_paths(targets, contents=read_project_contents(project, [f for f, path in targets]))
 
 
 def assemble_simplyjs_sources(project, base_dir, build_result):
@@ -29,7 +33,9 @@ def assemble_simplyjs_sources(project, base_dir, build_result):
     shutil.rmtree(base_dir)
     shutil.copytree(settings.SIMPLYJS_ROOT, base_dir)
 
-    js = '\n\n'.join(x.get_contents() for x in source_files if x.file_name.endswith('.js'))
+    js_files = [x for x in source_files if x.file_name.endswith('.js')]
+    contents = read_project_contents(project, js_files)
+    js = '\n\n'.join(contents[x] for x in js_files)
     escaped_js = json.dumps(js)
     build_result.save_simplyjs(js)
 
@@ -51,11 +57,13 @@ def assemble_resource_directories(project, base_dir):
 
 def assemble_resources(base_dir, resource_path, resources, type_restrictions=None):
     """ Copy all the project's resources to a path, optionally filtering by type. """
+    targets = []
     for f in resources:
         if type_restrictions and f.kind not in type_restrictions:
             continue
         target_dir = os.path.abspath(os.path.join(base_dir, resource_path, ResourceFile.DIR_MAP[f.kind]))
-        f.copy_all_variants_to_dir(target_dir)
+        targets.extend(f.get_variant_targets_in_dir(target_dir))
+    copy_many_to_paths(targets)
 
 
 def assemble_project(project, base_dir, build_result=None):
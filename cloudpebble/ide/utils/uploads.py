@@ -0,0 +1,127 @@
+"""
+Direct-to-storage uploads.
+
+Rather than posting files through Django, the editor asks for an upload target with request_upload(), sends the file
+straight to storage (a presigned S3 POST, or the upload_staged view for backends without one) and then passes the
+returned token to the view creating the file, which calls claim_upload() to validate the staged object and attach it.
+Tokens are signed, so no server-side record of pending uploads is needed. Staged objects live under STAGING_PREFIX;
+any which are never claimed should be expired by a bucket lifecycle rule on that prefix.
+
+Project archives being imported are staged the same way, under IMPORT_PREFIX, so that import tasks are sent a key
+rather than the archive itself. Archives which are downloaded by the worker importing them are spooled locally instead.
+"""
+import shutil
+import tempfile
+import uuid
+
+from django.core import signing
+from django.urls import reverse
+from django.utils.translation import gettext as _
+
+from utils.storage import get_storage, ObjectNotFound, STREAM_CHUNK_SIZE
+
+BUCKET_NAME = 'source'
+STAGING_PREFIX = 'uploads/'
+IMPORT_PREFIX = 'imports/'
+# Spooled archives bigger than this are written to disk.
+SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+MAX_UPLOAD_SIZE = 5 * 1024 * 1024
+UPLOAD_EXPIRY = 3600
+_SALT = 'ide.utils.uploads'
+
+PNG_SIGNATURES = (b'\x89PNG\r\n\x1a\n',)
+# TrueType, Apple TrueType and OpenType (CFF) fonts.
+FONT_SIGNATURES = (b'\x00\x01\x00\x00', b'true', b'OTTO')
+# What uploads of each resource kind must start with. Kinds which aren't listed, such as raw data, may be anything.
+KIND_SIGNATURES = {
+    'png': PNG_SIGNATURES,
+    'png-trans': PNG_SIGNATURES,
+    'bitmap': PNG_SIGNATURES,
+    'pbi': PNG_SIGNATURES,
+    'font': FONT_SIGNATURES,
+}
+SNIFF_SIZE = max(len(signature) for signatures in KIND_SIGNATURES.values() for signature in signatures)
+
+
+class UploadError(Exception):
+    pass
+
+
+def request_upload(user, project):
+    """ Create a staging key for a new upload to a project.
+    :return: A dictionary with the 'token' identifying the upload, and the 'url' and form 'fields' to POST it to
+    """
+    key = '%s%s' % (STAGING_PREFIX, uuid.uuid4().hex)
+    token = signing.dumps({'user': user.id, 'project': project.id, 'key': key}, salt=_SALT)
+    target = get_storage().presigned_upload(BUCKET_NAME, key, MAX_UPLOAD_SIZE, expires_in=UPLOAD_EXPIRY)
+    if target is None:
+        target = {'url': reverse('ide:upload_staged', kwargs={'token': token}), 'fields': {}}
+    return {'token': token, 'url': target['url'], 'fields': target['fields']}
+
+
+def staged_key(token, user, project=None):
+    """ Check an upload token.
+    :return: The key the upload was staged at
+    :raises UploadError: if the token is invalid, has expired, or belongs to another user or project
+    """
+    try:
+        upload = signing.loads(token, salt=_SALT, max_age=UPLOAD_EXPIRY)
+    except signing.BadSignature:
+        raise UploadError(_("Upload expired or invalid; please try again."))
+    if upload['user'] != user.id or (project is not None and upload['project'] != project.id):
+        raise UploadError(_("Upload expired or invalid; please try again."))
+    return upload['key']
+
+
+def claim_upload(token, user, project, kind=None):
+    """ Validate a staged upload, fetching no more than its first few bytes.
+    :param kind: The kind of resource being created from the upload, if any, which its contents must match
+    :return: The key it was staged at, to pass to S3File.save_staged()
+    :raises UploadError: if the token is bad, nothing was uploaded, or the upload is too big or of the wrong type
+    """
+    key = staged_key(token, user, project)
+    storage = get_storage()
+    try:
+        size = storage.size(BUCKET_NAME, key)
+    except ObjectNotFound:
+        raise UploadError(_("No file was uploaded."))
+    if size > MAX_UPLOAD_SIZE:
+        discard_upload(key)
+        raise UploadError(_("File is too large (max 5MB)."))
+    signatures = KIND_SIGNATURES.get(kind)
+    if signatures is not None:
+        # Ranged reads of an empty object fail, and it can't match anyway.
+        head = b''.join(storage.stream(BUCKET_NAME, key, 0, SNIFF_SIZE - 1)) if size else b''
+        if not head.startswith(signatures):
+            discard_upload(key)
+            if kind == 'font':
+                raise UploadError(_("The uploaded file is not a TrueType or OpenType font."))
+            raise UploadError(_("The uploaded file is not a PNG image."))
+    return key
+
+
+def discard_upload(key):
+    get_storage().delete(BUCKET_NAME, key)
+
+
+def stage_archive(chunks):
+    """ Stage an archive for an import task.
+    :param chunks: An iterable of byte strings making up the archive, such as an uploaded file's chunks()
+    :return: The key to pass to the task, which should open_staged() it and then discard_upload() it
+    """
+    key = '%s%s.zip' % (IMPORT_PREFIX, uuid.uuid4().hex)
+    get_storage().upload_stream(BUCKET_NAME, key, chunks)
+    return key
+
+
+def open_staged(key):
+    """ :return: A seekable file object for a staged archive """
+    return get_storage().open(BUCKET_NAME, key)
+
+
+def spool(stream):
+    """ Copy a stream, such as a download, into a seekable file which only goes to disk if it's large. """
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    shutil.copyfileobj(stream, spooled, STREAM_CHUNK_SIZE)
+    spooled.seek(0)
+    return spooled
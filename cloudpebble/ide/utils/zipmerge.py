@@ -0,0 +1,102 @@
+"""
+Merging zip archives without recompressing them.
+
+Each entry's compressed data is copied as it is, behind a new local header carrying the entry's new name, and a single
+central directory covering every entry is written at the end. Sizes and CRCs are taken from the source archives'
+central directories, so archives written in one pass (with data descriptors) can be merged too.
+
+Individual entries must be under 4GB, but the merged archive may be larger; Zip64 records are written when needed.
+"""
+import struct
+import zipfile
+
+_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+_CENTRAL_HEADER = struct.Struct('<4sHHHHHHIIIHHHHHII')
+_END_OF_CENTRAL_DIRECTORY = struct.Struct('<4sHHHHIIH')
+_ZIP64_END_OF_CENTRAL_DIRECTORY = struct.Struct('<4sQHHIIQQQQ')
+_ZIP64_LOCATOR = struct.Struct('<4sIQI')
+_ZIP64_OFFSET_EXTRA = struct.Struct('<HHQ')
+
+_MAX_UINT32 = 0xFFFFFFFF
+_MAX_UINT16 = 0xFFFF
+_DATA_DESCRIPTOR_FLAG = 0x08
+_UTF8_FLAG = 0x800
+_VERSION = 20
+_ZIP64_VERSION = 45
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def _dos_date_time(date_time):
+    year, month, day, hour, minute, second = date_time
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+def _raw_contents(archive, info):
+    """ Read an entry's compressed data from an archive file, in chunks. """
+    # The local header's name and extra field lengths may differ from those in the central directory.
+    archive.seek(info.header_offset + 26)
+    name_length, extra_length = struct.unpack('<HH', archive.read(4))
+    archive.seek(info.header_offset + _LOCAL_HEADER.size + name_length + extra_length)
+    remaining = info.compress_size
+    while remaining:
+        chunk = archive.read(min(remaining, _COPY_CHUNK_SIZE))
+        if not chunk:
+            raise zipfile.BadZipFile("Truncated entry %s" % info.filename)
+        remaining -= len(chunk)
+        yield chunk
+
+
+def merge_zips(archives):
+    """ Merge several zip archives into one. Only one entry's data is held in memory at a time, in chunks, so the
+    archives can be files opened straight from storage.
+    :param archives: An iterable of (archive, rename) tuples, where archive is a seekable binary file holding a zip
+    archive and rename is a function mapping the name of each of its entries to the entry's name in the merged archive.
+    Each archive has been finished with by the time the next tuple is requested.
+    :return: A generator of byte strings which together make up the merged archive
+    """
+    offset = 0
+    entries = []
+    for archive, rename in archives:
+        with zipfile.ZipFile(archive) as z:
+            infos = z.infolist()
+        for info in infos:
+            name = rename(info.filename).encode('utf-8')
+            flags = (info.flag_bits & ~_DATA_DESCRIPTOR_FLAG) | _UTF8_FLAG
+            dos_time, dos_date = _dos_date_time(info.date_time)
+            header = _LOCAL_HEADER.pack(b'PK\x03\x04', _VERSION, flags, info.compress_type, dos_time, dos_date,
+                                        info.CRC, info.compress_size, info.file_size, len(name), 0)
+            entries.append((name, info, flags, dos_time, dos_date, offset))
+            offset += len(header) + len(name) + info.compress_size
+            yield header + name
+            for chunk in _raw_contents(archive, info):
+                yield chunk
+
+    directory_offset = offset
+    directory = []
+    for name, info, flags, dos_time, dos_date, entry_offset in entries:
+        extra = b''
+        version = _VERSION
+        if entry_offset > _MAX_UINT32:
+            extra = _ZIP64_OFFSET_EXTRA.pack(0x0001, 8, entry_offset)
+            entry_offset = _MAX_UINT32
+            version = _ZIP64_VERSION
+        directory.append(_CENTRAL_HEADER.pack(
+            b'PK\x01\x02', (info.create_system << 8) | version, version, flags, info.compress_type, dos_time,
+            dos_date, info.CRC, info.compress_size, info.file_size, len(name), len(extra), 0, 0, info.internal_attr,
+            info.external_attr, entry_offset) + name + extra)
+    directory = b''.join(directory)
+
+    end = b''
+    count = len(entries)
+    if count > _MAX_UINT16 or directory_offset > _MAX_UINT32 or len(directory) > _MAX_UINT32:
+        zip64_end_offset = directory_offset + len(directory)
+        end += _ZIP64_END_OF_CENTRAL_DIRECTORY.pack(b'PK\x06\x06', _ZIP64_END_OF_CENTRAL_DIRECTORY.size - 12,
+                                                    _ZIP64_VERSION, _ZIP64_VERSION, 0, 0, count, count,
+                                                    len(directory), directory_offset)
+        end += _ZIP64_LOCATOR.pack(b'PK\x06\x07', 0, zip64_end_offset, 1)
+        count = min(count, _MAX_UINT16)
+        end += _END_OF_CENTRAL_DIRECTORY.pack(b'PK\x05\x06', 0, 0, count, count, min(len(directory), _MAX_UINT32),
+                                              min(directory_offset, _MAX_UINT32), 0)
+    else:
+        end += _END_OF_CENTRAL_DIRECTORY.pack(b'PK\x05\x06', 0, 0, count, count, len(directory), directory_offset, 0)
+    yield directory + end
@@ -8,7 +8,7 @@ from django.views.decorators.csrf import ensure_csrf_cookie, csrf_exempt
 from django.views.decorators.http import require_safe, require_POST
 from ide.models.build import BuildResult
 from ide.models.project import Project
-from ide.tasks.git import hooked_commit
+from ide.tasks.git import queue_hooked_commit
 from ide.utils import generate_half_uuid
 from utils.td_helper import send_td_event
 from ide.utils.regexes import regexes
@@ -75,7 +75,7 @@ def github_hook(request, project_id):
 
     push_info = json.loads(request.POST['payload'])
     if push_info['ref'] == 'refs/heads/%s' % (project.github_branch or push_info['repository'].get('default_branch', push_info['repository'].get('master_branch', 'main'))):
-        hooked_commit.delay(project_id, push_info['after'])
+        queue_hooked_commit(project.id, push_info['after'])
 
     return HttpResponse('ok')
 
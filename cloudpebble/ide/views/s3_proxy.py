@@ -1,10 +1,10 @@
 import mimetypes
+import posixpath
 
-from botocore.exceptions import ClientError
-from django.http import HttpResponse, HttpResponseNotFound
 from django.views.decorators.http import require_safe
 
-import utils.s3 as s3
+from ide.models.build import BuildResult
+from utils.downloads import serve_artifact, CACHE_IMMUTABLE
 
 
 @require_safe
@@ -14,19 +14,15 @@ def s3_builds_proxy(request, path):
     Used so that MEDIA_URL can point to the web server itself, avoiding
     the need to expose the S3 bucket directly.  URLs are UUID-based so
     no authentication is required (same security model as the old nginx
-    proxy to fake-S3).
+    proxy to fake-S3). Since a build's UUID directory is never rewritten, the
+    artifacts can be cached indefinitely by browsers and the CDN.
     """
-    try:
-        data = s3.read_file('builds', path)
-    except ClientError as e:
-        if e.response['Error']['Code'] == 'NoSuchKey':
-            return HttpResponseNotFound()
-        raise
-
     content_type, _ = mimetypes.guess_type(path)
     if content_type is None:
         content_type = 'application/octet-stream'
 
-    response = HttpResponse(data, content_type=content_type)
+    response = serve_artifact(request, 'builds', path, content_type=content_type,
+                              cache_control='public, ' + CACHE_IMMUTABLE,
+                              may_be_encoded=BuildResult.may_be_compressed(posixpath.basename(path)))
     response['Access-Control-Allow-Origin'] = '*'
     return response
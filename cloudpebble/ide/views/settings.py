@@ -94,7 +94,7 @@ def _store_github_token_and_profile(user_github, client_id, client_secret, callb
     user_github.token = token_result['access_token']
     user_github.nonce = None
 
-    profile_request = Request('https://api.github.com/user')
+    profile_request = Request(settings.GITHUB_API_URL + '/user')
     profile_request.add_header("Authorization", "token %s" % user_github.token)
     profile_result = json.loads(urlopen(profile_request).read())
     user_github.username = profile_result['login']
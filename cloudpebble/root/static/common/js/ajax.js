@@ -98,13 +98,17 @@ Ajax = (function() {
          * @param {Number} [options.max_bad_requests=5]
          *     The maximum number of times that the on_bad_request function will be called before
          *     aborting the polling.
+         * @param {Function} [options.on_progress=null]
+         *     If set, this function is called with the task's progress ({stage, done, total}) whenever
+         *     the task reports any.
          * @returns {Promise}
          */
         PollTask: function PollTask(task_id, options) {
             var opts = _.defaults(options || {}, {
                 milliseconds: 1000,
                 on_bad_request: null,
-                max_bad_requests: 5
+                max_bad_requests: 5,
+                on_progress: null
             });
             var warning_count = 0;
             function poll_task(task_id) {
@@ -117,7 +121,10 @@ Ajax = (function() {
                         err.task_id = task_id;
                         throw err;
                     }
-                    else return Promise.delay(opts.milliseconds).then(function() {
+                    if (data.state.progress && _.isFunction(opts.on_progress)) {
+                        opts.on_progress(data.state.progress);
+                    }
+                    return Promise.delay(opts.milliseconds).then(function() {
                         return poll_task(task_id);
                     });
                 }).catch(function(error) {
@@ -136,6 +143,35 @@ Ajax = (function() {
             }
             return poll_task(task_id);
         },
+        /** Upload a file for a project straight to storage rather than through the view which uses it.
+         *
+         * @param project_id ID of the project the file is being added to
+         * @param {File} file the file to upload
+         * @returns {Promise} resolving to an upload token, to be passed to the view as "upload_token"
+         */
+        Upload: function Upload(project_id, file) {
+            return Ajax.Post('/ide/project/' + project_id + '/request_upload').then(function(data) {
+                var upload = data.upload;
+                var form_data = new FormData();
+                _.each(upload.fields, function(value, key) {
+                    form_data.append(key, value);
+                });
+                form_data.append('file', file);
+                var direct = !_.isEmpty(upload.fields);
+                // Storage won't return our JSON, and mustn't be sent our CSRF token.
+                return new Wrapper(direct ? null : 'success').ajax({
+                    url: upload.url,
+                    type: 'POST',
+                    data: form_data,
+                    processData: false,
+                    contentType: false,
+                    dataType: direct ? 'text' : 'json',
+                    beforeSend: direct ? $.noop : undefined
+                }).then(function() {
+                    return upload.token;
+                });
+            });
+        },
         Wrapper: Wrapper
     }
 })();
@@ -0,0 +1,351 @@
+"""
+Serve stored artifacts (builds, exports) to clients without reading them into memory.
+
+Artifacts are addressed by bucket name and key in the storage backend (see utils/storage.py). Depending on
+settings.ARTIFACT_DOWNLOAD_MODE, files are either streamed through the worker in chunks, handed off to nginx with
+X-Accel-Redirect (local storage only) or redirected to a presigned S3 URL (S3 storage only). Streamed responses honour single HTTP byte ranges and HEAD requests, and carry
+ETag/Last-Modified validators so that conditional requests are answered with 304 without touching the body.
+
+Artifacts compressed at rest are sent with Content-Encoding: gzip to clients that accept it, and decompressed on the
+fly for those that don't.
+"""
+import hashlib
+import os
+import re
+import zlib
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseNotModified, HttpResponseRedirect, StreamingHttpResponse, \
+    FileResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+
+import utils.s3 as s3
+from utils.storage import get_storage, S3Storage, ObjectNotFound, is_encoded
+
+CHUNK_SIZE = 64 * 1024
+
+MODE_STREAM = 'stream'
+MODE_ACCEL = 'accel'
+MODE_REDIRECT = 'redirect'
+
+# For artifacts stored under a path that is never reused, such as a build's UUID directory.
+CACHE_IMMUTABLE = 'max-age=31536000, immutable'
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+_ACCEPTS_GZIP_RE = re.compile(r'\bgzip\b')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range_header(header):
+    """ Parse a HTTP Range header containing a single byte range.
+    :param header: The value of the Range header, or None
+    :return: A (first, last) tuple, either of which may be None for open-ended or suffix ranges,
+    or None if the header is absent or is not a single byte range (in which case it should be ignored).
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first == '' and last == '':
+        return None
+    first = int(first) if first != '' else None
+    last = int(last) if last != '' else None
+    if first is not None and last is not None and last < first:
+        return None
+    return first, last
+
+
+def resolve_range(byte_range, size):
+    """ Turn a parsed byte range into absolute (start, end) offsets, with end inclusive.
+    :raises RangeNotSatisfiable: if the range lies outside a file of the given size
+    """
+    first, last = byte_range
+    if first is None:
+        # A suffix range: the final 'last' bytes.
+        if last == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(size - last, 0), size - 1
+    if first >= size:
+        raise RangeNotSatisfiable()
+    if last is None or last >= size:
+        last = size - 1
+    return first, last
+
+
+def _set_common_headers(response, filename, disposition, cache_control):
+    response['Accept-Ranges'] = 'bytes'
+    if filename is not None:
+        response['Content-Disposition'] = '%s; filename="%s"' % (disposition, filename)
+    if cache_control is not None:
+        response['Cache-Control'] = cache_control
+
+
+def _set_validators(response, etag, last_modified, cache_control):
+    """ Set caching headers, which must also be sent on a 304 response. """
+    if etag:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    if cache_control is not None:
+        response['Cache-Control'] = cache_control
+
+
+def _if_modified_since(request):
+    # If-Modified-Since is ignored when If-None-Match is present (RFC 7232 section 3.3).
+    if request.META.get('HTTP_IF_NONE_MATCH'):
+        return None
+    timestamp = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+
+def _range_applies(request, etag, last_modified):
+    """ Check an If-Range precondition; if it fails the full representation must be sent instead. """
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return etag is not None and if_range == etag
+    timestamp = parse_http_date_safe(if_range)
+    return timestamp is not None and last_modified is not None and timestamp == last_modified
+
+
+def _not_satisfiable(size=None):
+    response = HttpResponse(status=416)
+    if size is not None:
+        response['Content-Range'] = 'bytes */%d' % size
+    return response
+
+
+def _accepts_gzip(request):
+    return bool(_ACCEPTS_GZIP_RE.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+
+
+def _gunzip(chunks):
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    yield decompressor.flush()
+
+
+def _set_encoding(response, encoding, may_be_encoded):
+    if encoding is not None:
+        response['Content-Encoding'] = encoding
+    if may_be_encoded:
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+
+def _iter_s3_body(body):
+    try:
+        for chunk in body.iter_chunks(CHUNK_SIZE):
+            yield chunk
+    finally:
+        body.close()
+
+
+def _s3_last_modified(obj):
+    if obj.get('LastModified') is None:
+        return None
+    return int(obj['LastModified'].timestamp())
+
+
+def _serve_s3(request, bucket_name, path, content_type, filename, disposition, cache_control, may_be_encoded):
+    conditions = {
+        'if_none_match': request.META.get('HTTP_IF_NONE_MATCH') or None,
+        'if_modified_since': _if_modified_since(request)
+    }
+    accepts_gzip = _accepts_gzip(request)
+    try:
+        if request.method == 'HEAD':
+            obj = s3.head_file(bucket_name, path, **conditions)
+            response = HttpResponse(content_type=content_type)
+            encoding = obj.get('ContentEncoding')
+            if encoding is None or accepts_gzip:
+                response['Content-Length'] = obj['ContentLength']
+            else:
+                encoding = None
+            _set_common_headers(response, filename, disposition, cache_control)
+            _set_validators(response, obj.get('ETag'), _s3_last_modified(obj), cache_control)
+            _set_encoding(response, encoding, may_be_encoded)
+            return response
+
+        byte_range = parse_range_header(request.META.get('HTTP_RANGE'))
+        range_header = None
+        # S3 has no If-Range support, so only pass the range on when there is no precondition to check. A range of a
+        # compressed object is no use to a client which needs it decompressed.
+        if byte_range is not None and not request.META.get('HTTP_IF_RANGE') and (accepts_gzip or not may_be_encoded):
+            range_header = 'bytes=%s-%s' % tuple('' if x is None else x for x in byte_range)
+        obj = s3.open_file(bucket_name, path, byte_range=range_header, **conditions)
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code in ('NoSuchKey', '404', 'NotFound'):
+            raise Http404()
+        if code == 'InvalidRange':
+            return _not_satisfiable()
+        if code in ('304', 'NotModified'):
+            headers = e.response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+            response = HttpResponseNotModified()
+            _set_validators(response, headers.get('etag'), parse_http_date_safe(headers.get('last-modified', '')),
+                            cache_control)
+            return response
+        raise
+
+    encoding = obj.get('ContentEncoding')
+    if encoding == 'gzip' and not accepts_gzip:
+        response = StreamingHttpResponse(_gunzip(_iter_s3_body(obj['Body'])), content_type=content_type)
+        encoding = None
+    else:
+        response = StreamingHttpResponse(_iter_s3_body(obj['Body']), content_type=content_type)
+        response['Content-Length'] = obj['ContentLength']
+        if obj.get('ContentRange'):
+            response.status_code = 206
+            response['Content-Range'] = obj['ContentRange']
+    _set_common_headers(response, filename, disposition, cache_control)
+    _set_validators(response, obj.get('ETag'), _s3_last_modified(obj), cache_control)
+    _set_encoding(response, encoding, may_be_encoded)
+    return response
+
+
+def _redirect_s3(bucket_name, path, content_type, filename, disposition):
+    headers = {'Content-Type': content_type}
+    if filename is not None:
+        headers['Content-Disposition'] = '%s; filename="%s"' % (disposition, filename)
+    return HttpResponseRedirect(s3.get_signed_url(bucket_name, path, headers=headers))
+
+
+def local_validators(stat):
+    """ Derive an ETag and Last-Modified timestamp for a local file from its metadata, so that
+    conditional requests can be answered without reading the file. Files are only ever replaced
+    wholesale, so a new size or modification time means new contents. """
+    return '"%x-%x"' % (stat.st_mtime_ns, stat.st_size), int(stat.st_mtime)
+
+
+def _stored_metadata(storage, bucket_name, key):
+    """ :return: The size, ETag and Last-Modified timestamp of a stored artifact """
+    try:
+        path = storage.local_path(bucket_name, key)
+        if path is None:
+            data = storage.read(bucket_name, key)
+            return len(data), '"%s"' % hashlib.md5(data).hexdigest(), None
+        stat = os.stat(path)
+    except (ObjectNotFound, OSError):
+        raise Http404()
+    return (stat.st_size,) + local_validators(stat)
+
+
+def _serve_stored(request, storage, bucket_name, key, content_type, filename, disposition, cache_control,
+                  may_be_encoded):
+    size, etag, last_modified = _stored_metadata(storage, bucket_name, key)
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        _set_validators(not_modified, etag, last_modified, cache_control)
+        return not_modified
+
+    encoding = None
+    if may_be_encoded and is_encoded(b''.join(storage.stream(bucket_name, key, 0, 1))):
+        encoding = 'gzip'
+    if encoding is not None and not _accepts_gzip(request):
+        response = HttpResponse(content_type=content_type)
+        if request.method != 'HEAD':
+            response = StreamingHttpResponse(_gunzip(storage.stream(bucket_name, key)), content_type=content_type)
+        _set_common_headers(response, filename, disposition, cache_control)
+        _set_validators(response, etag, last_modified, cache_control)
+        _set_encoding(response, None, may_be_encoded)
+        return response
+
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type)
+        response['Content-Length'] = size
+        _set_common_headers(response, filename, disposition, cache_control)
+        _set_validators(response, etag, last_modified, cache_control)
+        _set_encoding(response, encoding, may_be_encoded)
+        return response
+
+    byte_range = parse_range_header(request.META.get('HTTP_RANGE'))
+    if byte_range is not None and not _range_applies(request, etag, last_modified):
+        byte_range = None
+    start, end = 0, size - 1
+    if byte_range is not None:
+        try:
+            start, end = resolve_range(byte_range, size)
+        except RangeNotSatisfiable:
+            return _not_satisfiable(size)
+
+    path = storage.local_path(bucket_name, key)
+    try:
+        if byte_range is None and path is not None:
+            # A whole local file can go through the server's wsgi.file_wrapper, which uses sendfile where available.
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+            if 'Content-Disposition' in response:
+                del response['Content-Disposition']
+        else:
+            response = StreamingHttpResponse(storage.stream(bucket_name, key, start, end), content_type=content_type)
+    except (ObjectNotFound, OSError):
+        raise Http404()
+    response['Content-Length'] = end - start + 1
+    if byte_range is not None:
+        response.status_code = 206
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+    _set_common_headers(response, filename, disposition, cache_control)
+    _set_validators(response, etag, last_modified, cache_control)
+    _set_encoding(response, encoding, may_be_encoded)
+    return response
+
+
+def _accel_redirect(path, content_type, filename, disposition, cache_control):
+    storage_root = os.path.abspath(settings.FILE_STORAGE)
+    path = os.path.abspath(path)
+    if not path.startswith(storage_root + os.sep):
+        raise Http404()
+    # nginx handles Range, HEAD and conditional requests itself, so the response carries no body.
+    response = HttpResponse(content_type=content_type)
+    response['X-Accel-Redirect'] = settings.ARTIFACT_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + \
+        os.path.relpath(path, storage_root).replace(os.sep, '/')
+    _set_common_headers(response, filename, disposition, cache_control)
+    return response
+
+
+def serve_artifact(request, bucket_name, key, content_type='application/octet-stream', filename=None,
+                   disposition='attachment', cache_control=None, may_be_encoded=False):
+    """ Build a response for a stored artifact without loading it into memory.
+    :param bucket_name: The storage bucket the artifact lives in
+    :param key: The artifact's key in the bucket. This may come from the client; keys escaping the bucket are refused.
+    :param filename: If given, sent to the client in a Content-Disposition header
+    :param cache_control: If given, sent as the Cache-Control header, including on 304 responses
+    :param may_be_encoded: True if the artifact is a kind of object which may be compressed at rest
+    :raises Http404: if the artifact does not exist
+    """
+    mode = settings.ARTIFACT_DOWNLOAD_MODE
+    storage = get_storage()
+    if isinstance(storage, S3Storage):
+        if mode == MODE_REDIRECT:
+            return _redirect_s3(bucket_name, key, content_type, filename, disposition)
+        return _serve_s3(request, bucket_name, key, content_type, filename, disposition, cache_control,
+                         may_be_encoded)
+    if mode == MODE_ACCEL and storage.is_local:
+        try:
+            path = storage.local_path(bucket_name, key)
+            encoding = None
+            if may_be_encoded and is_encoded(b''.join(storage.stream(bucket_name, key, 0, 1))):
+                encoding = 'gzip'
+        except ObjectNotFound:
+            raise Http404()
+        # nginx can't decompress what it sends, so clients which don't accept gzip get it decompressed from here.
+        if encoding is None or _accepts_gzip(request):
+            response = _accel_redirect(path, content_type, filename, disposition, cache_control)
+            _set_encoding(response, encoding, may_be_encoded)
+            return response
+    return _serve_stored(request, storage, bucket_name, key, content_type, filename, disposition, cache_control,
+                         may_be_encoded)
@@ -1,6 +1,10 @@
+import datetime
+import io
 import tempfile
 import os.path
 
+from botocore.exceptions import ClientError
+
 
 class FakeRedis(object):
     """ Essentially just a dictionary accessed via 'get' and 'set' methods """
@@ -9,45 +13,113 @@ class FakeRedis(object):
         self.storage = {}
         self.ex = None
 
-    def set(self, key, value, ex=0):
+    def set(self, key, value, ex=0, nx=False, get=False):
+        previous = self.storage.get(key, None)
+        if nx and key in self.storage:
+            return None
         self.storage[key] = str(value)
         self.ex = ex
+        return previous if get else True
 
     def get(self, key, ex=0):
         self.ex = ex
         return self.storage.get(key, None)
 
+    def mget(self, keys):
+        return [self.storage.get(key, None) for key in keys]
+
+    def delete(self, *keys):
+        return sum(1 for key in keys if self.storage.pop(key, None) is not None)
+
+    def sadd(self, key, *values):
+        members = self.storage.setdefault(key, set())
+        added = {str(value) for value in values} - members
+        members.update(added)
+        return len(added)
+
+    def srem(self, key, *values):
+        members = self.storage.get(key, set())
+        removed = {str(value) for value in values} & members
+        members.difference_update(removed)
+        return len(removed)
+
+    def smembers(self, key):
+        return set(self.storage.get(key, set()))
+
 
 class FakeS3(object):
     """ Essentially just a dictionary where the keys are tuples of (bucket_name, path) """
 
     def __init__(self):
         self.dict = {}
+        self.modified = {}
         self.last_key = None
 
     def reset(self):
         self.dict = {}
+        self.modified = {}
         self.last_key = None
 
     def read_file(self, bucket_name, path):
-        return self.dict[(bucket_name, path)]
+        try:
+            return self.dict[(bucket_name, path)]
+        except KeyError:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+
+    def head_file(self, bucket_name, path, **kwargs):
+        return {'ContentLength': len(self.read_file(bucket_name, path))}
+
+    def open_file(self, bucket_name, path, byte_range=None, **kwargs):
+        data = self.read_file(bucket_name, path)
+        if byte_range is not None:
+            start, end = byte_range[len('bytes='):].split('-')
+            data = data[int(start):int(end) + 1 if end else None]
+        return {'Body': io.BytesIO(data)}
 
     def read_last_file(self):
         return self.dict[self.last_key]
 
     def save_file(self, bucket_name, path, value, **kwargs):
         self.dict[(bucket_name, path)] = value
+        self.modified[(bucket_name, path)] = datetime.datetime.now(datetime.timezone.utc)
         self.last_key = (bucket_name, path)
 
+    def list_files(self, bucket_name, prefix=''):
+        # Objects put straight into dict count as ancient.
+        ancient = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+        return [(path, self.modified.get((bucket, path), ancient)) for bucket, path in self.dict
+                if bucket == bucket_name and path.startswith(prefix)]
+
+    def copy_file(self, bucket_name, src_path, dest_path):
+        self.save_file(bucket_name, dest_path, self.read_file(bucket_name, src_path))
+
     def delete_file(self, bucket_name, path):
         del self.dict[(bucket_name, path)]
 
+    def read_many(self, bucket_name, paths):
+        return {path: self.read_file(bucket_name, path) for path in paths}
+
+    def write_many(self, bucket_name, values, **kwargs):
+        for path, value in values.items():
+            self.save_file(bucket_name, path, value, **kwargs)
+
+    def delete_many(self, bucket_name, paths):
+        for path in paths:
+            self.dict.pop((bucket_name, path), None)
+        return []
+
     def read_file_to_filesystem(self, bucket_name, path, destination):
         if not os.path.abspath(destination).startswith(tempfile.gettempdir()):
             raise ValueError("FakeS3 local-filesystem operations may only access temporary directories.")
         with open(destination, 'w') as f:
             f.write(self.read_file(bucket_name, path))
 
+    def upload_fileobj(self, bucket_name, path, fileobj, progress=None, **kwargs):
+        data = fileobj.read()
+        self.save_file(bucket_name, path, data)
+        if progress is not None:
+            progress(len(data))
+
     def upload_file(self, bucket_name, path, src_path, **kwargs):
         if not os.path.abspath(src_path).startswith(tempfile.gettempdir()):
             raise ValueError("FakeS3 local-filesystem operations may only access temporary directories.")
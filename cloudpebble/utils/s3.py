@@ -1,12 +1,22 @@
+import functools
 import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
 
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
 from botocore.exceptions import ClientError
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
+# DeleteObjects accepts at most this many keys per request.
+DELETE_BATCH_SIZE = 1000
+
 
 def _ensure_bucket_exists(s3_client, bucket):
     try:
@@ -18,6 +28,68 @@ def _ensure_bucket_exists(s3_client, bucket):
             pass
 
 
+def _client_config(**kwargs):
+    """ Build a botocore Config with an explicitly sized connection pool and adaptive retries.
+    The pool is shared by every thread issuing bulk requests, so it must be at least as large
+    as AWS_S3_MAX_CONCURRENCY or requests will queue waiting for a connection. """
+    return Config(
+        signature_version='s3v4',
+        max_pool_connections=settings.AWS_S3_MAX_POOL_CONNECTIONS,
+        retries={'max_attempts': settings.AWS_S3_MAX_ATTEMPTS, 'mode': 'adaptive'},
+        **kwargs
+    )
+
+
+def _transfer_config():
+    """ Multipart settings for uploads. Objects above AWS_S3_MULTIPART_THRESHOLD bytes are sent in parts of
+    AWS_S3_MULTIPART_CHUNKSIZE bytes, up to AWS_S3_MULTIPART_CONCURRENCY at a time. """
+    return TransferConfig(
+        multipart_threshold=settings.AWS_S3_MULTIPART_THRESHOLD,
+        multipart_chunksize=settings.AWS_S3_MULTIPART_CHUNKSIZE,
+        max_concurrency=settings.AWS_S3_MULTIPART_CONCURRENCY,
+        use_threads=True
+    )
+
+
+class LatencyStats(object):
+    """ Accumulates per-operation call counts, object counts and latencies for S3 requests. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stats = defaultdict(lambda: {'calls': 0, 'objects': 0, 'total_time': 0.0, 'max_time': 0.0})
+
+    def record(self, operation, elapsed, objects=1):
+        with self._lock:
+            entry = self._stats[operation]
+            entry['calls'] += 1
+            entry['objects'] += objects
+            entry['total_time'] += elapsed
+            entry['max_time'] = max(entry['max_time'], elapsed)
+
+    def snapshot(self):
+        """ Return a copy of the accumulated stats as a dict of operation -> stats dict. """
+        with self._lock:
+            return {operation: dict(entry) for operation, entry in self._stats.items()}
+
+
+stats = LatencyStats()
+
+
+@contextmanager
+def _timed(operation, bucket_name, objects=1):
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - start
+        stats.record(operation, elapsed, objects)
+        logger.debug("S3 %s on %s (%d objects) took %.1fms", operation, bucket_name, objects, elapsed * 1000)
+
+
 class BucketHolder(object):
     """ The bucket holder configures s3 when it is first accessed. This cannot be done on module import due to quirks in Django's settings system.
     See: https://docs.djangoproject.com/en/dev/internals/contributing/writing-code/coding-style/#use-of-django-conf-settings """
@@ -28,12 +100,14 @@ class BucketHolder(object):
         self.s3 = None
         self.s3_resource = None
         self.supports_acl = True
+        self._executor = None
+        self._executor_lock = threading.Lock()
 
     def configure(self):
         if settings.AWS_ENABLED:
             endpoint_url = getattr(settings, 'AWS_S3_ENDPOINT_URL', None)
-            s3v4_config = Config(signature_version='s3v4')
-            s3v4_path_config = Config(signature_version='s3v4', s3={'addressing_style': 'path'})
+            s3v4_config = _client_config()
+            s3v4_path_config = _client_config(s3={'addressing_style': 'path'})
             if settings.AWS_S3_FAKE_S3 is not None:
                 # Fake S3 (e.g., minio, fake-s3) — local dev
                 host, port = (settings.AWS_S3_FAKE_S3.split(':', 2) + ['80'])[:2]
@@ -117,71 +191,263 @@ class BucketHolder(object):
             self.configure()
         return self.s3_resource.Bucket(self.bucket_names[item])
 
+    @property
+    def executor(self):
+        """ A thread pool shared by all bulk operations, sized to match the client's connection pool. """
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=settings.AWS_S3_MAX_CONCURRENCY,
+                                                        thread_name_prefix='s3')
+        return self._executor
+
 
 _buckets = BucketHolder()
 
 
 def _requires_aws(fn):
-    if settings.AWS_ENABLED:
-        return fn
-    else:
-        def complain(*args, **kwargs):
+    # Checked on each call rather than at import, so that tests can enable AWS with override_settings.
+    @functools.wraps(fn)
+    def check(*args, **kwargs):
+        if not settings.AWS_ENABLED:
             raise Exception("AWS_ENABLED must be True to call %s" % fn.__name__)
+        return fn(*args, **kwargs)
 
-        return complain
+    return check
 
 
 @_requires_aws
 def read_file(bucket_name, path):
     bucket_n = _buckets[bucket_name]
-    response = _buckets.s3.get_object(Bucket=bucket_n, Key=path)
-    return response['Body'].read()
+    with _timed('get', bucket_name):
+        response = _buckets.s3.get_object(Bucket=bucket_n, Key=path)
+        return response['Body'].read()
+
+
+def _conditional_kwargs(if_none_match, if_modified_since):
+    kwargs = {}
+    if if_none_match is not None:
+        kwargs['IfNoneMatch'] = if_none_match
+    if if_modified_since is not None:
+        kwargs['IfModifiedSince'] = if_modified_since
+    return kwargs
+
+
+@_requires_aws
+def head_file(bucket_name, path, if_none_match=None, if_modified_since=None):
+    """ Fetch an object's metadata without its body.
+    :param if_none_match: An optional If-None-Match header value
+    :param if_modified_since: An optional datetime for If-Modified-Since
+    :return: The head_object response, including ContentLength, ContentType, ETag and LastModified
+    :raises ClientError: with code '304' if the preconditions show the object is unchanged
+    """
+    bucket_n = _buckets[bucket_name]
+    kwargs = _conditional_kwargs(if_none_match, if_modified_since)
+    with _timed('head', bucket_name):
+        return _buckets.s3.head_object(Bucket=bucket_n, Key=path, **kwargs)
+
+
+@_requires_aws
+def open_file(bucket_name, path, byte_range=None, if_none_match=None, if_modified_since=None):
+    """ Open an object for streaming without reading its body.
+    :param byte_range: An optional HTTP Range header value, e.g. 'bytes=0-1023'
+    :param if_none_match: An optional If-None-Match header value
+    :param if_modified_since: An optional datetime for If-Modified-Since
+    :return: The get_object response. The caller must read and close response['Body'].
+    :raises ClientError: with code '304' if the preconditions show the object is unchanged
+    """
+    bucket_n = _buckets[bucket_name]
+    kwargs = _conditional_kwargs(if_none_match, if_modified_since)
+    if byte_range is not None:
+        kwargs['Range'] = byte_range
+    with _timed('open', bucket_name):
+        return _buckets.s3.get_object(Bucket=bucket_n, Key=path, **kwargs)
 
 
 @_requires_aws
 def read_file_to_filesystem(bucket_name, path, destination):
     bucket_n = _buckets[bucket_name]
-    _buckets.s3.download_file(bucket_n, path, destination)
+    with _timed('download', bucket_name):
+        _buckets.s3.download_file(bucket_n, path, destination)
 
 
 @_requires_aws
 def delete_file(bucket_name, path):
     bucket_n = _buckets[bucket_name]
-    _buckets.s3.delete_object(Bucket=bucket_n, Key=path)
+    with _timed('delete', bucket_name):
+        _buckets.s3.delete_object(Bucket=bucket_n, Key=path)
+
+
+@_requires_aws
+def copy_file(bucket_name, src_path, dest_path):
+    bucket_n = _buckets[bucket_name]
+    with _timed('copy', bucket_name):
+        _buckets.s3.copy_object(Bucket=bucket_n, Key=dest_path, CopySource={'Bucket': bucket_n, 'Key': src_path})
 
 
 @_requires_aws
-def save_file(bucket_name, path, value, public=False, content_type='application/octet-stream'):
+def save_file(bucket_name, path, value, public=False, content_type='application/octet-stream', content_encoding=None):
     bucket_n = _buckets[bucket_name]
 
     extra_args = {'ContentType': content_type}
     if public and _buckets.supports_acl:
         extra_args['ACL'] = 'public-read'
+    if content_encoding is not None:
+        extra_args['ContentEncoding'] = content_encoding
     
     if isinstance(value, str):
         value = value.encode('utf-8')
     
-    _buckets.s3.put_object(
-        Bucket=bucket_n,
-        Key=path,
-        Body=value,
-        **extra_args
-    )
+    with _timed('put', bucket_name):
+        _buckets.s3.put_object(
+            Bucket=bucket_n,
+            Key=path,
+            Body=value,
+            **extra_args
+        )
+
+
+def _upload_args(public, content_type, download_filename):
+    extra_args = {'ContentType': content_type}
+    if public and _buckets.supports_acl:
+        extra_args['ACL'] = 'public-read'
+    if download_filename is not None:
+        extra_args['ContentDisposition'] = 'attachment;filename="%s"' % download_filename.replace(' ', '_')
+    return extra_args
 
 
 @_requires_aws
 def upload_file(bucket_name, dest_path, src_path, public=False, content_type='application/octet-stream',
-                download_filename=None):
+                download_filename=None, progress=None):
+    """ Upload a local file, in parallel parts if it is large.
+    :param progress: If given, called from the uploading threads with the number of bytes sent since the last call
+    """
     bucket_n = _buckets[bucket_name]
+    extra_args = _upload_args(public, content_type, download_filename)
+    with _timed('upload', bucket_name):
+        _buckets.s3.upload_file(src_path, bucket_n, dest_path, ExtraArgs=extra_args, Callback=progress,
+                                Config=_transfer_config())
 
+
+@_requires_aws
+def upload_fileobj(bucket_name, dest_path, fileobj, public=False, content_type='application/octet-stream',
+                   download_filename=None, progress=None):
+    """ As upload_file, but reading from a file-like object, which need not be seekable. """
+    bucket_n = _buckets[bucket_name]
+    extra_args = _upload_args(public, content_type, download_filename)
+    with _timed('upload', bucket_name):
+        _buckets.s3.upload_fileobj(fileobj, bucket_n, dest_path, ExtraArgs=extra_args, Callback=progress,
+                                   Config=_transfer_config())
+
+
+def _run_concurrently(fn, items):
+    """ Call fn on each item using the shared executor, returning results in the same order.
+    If any calls fail, the exception raised by the first of them (in the order of items) is re-raised once all calls
+    have finished. """
+    items = list(items)
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+    futures = [_buckets.executor.submit(fn, item) for item in items]
+    # Otherwise a failure would return control to the caller while later calls were still running.
+    wait(futures)
+    return [future.result() for future in futures]
+
+
+@_requires_aws
+def read_many(bucket_name, paths):
+    """ Read several objects from a bucket concurrently.
+    :param bucket_name: The bucket to read from
+    :param paths: An iterable of object keys
+    :return: A dictionary of key -> bytes
+    """
+    bucket_n = _buckets[bucket_name]
+    paths = list(dict.fromkeys(paths))
+
+    def read(path):
+        # Each request is timed as well as the whole batch, so slow individual objects show up in the stats.
+        with _timed('get', bucket_name):
+            response = _buckets.s3.get_object(Bucket=bucket_n, Key=path)
+            return response['Body'].read()
+
+    with _timed('get_many', bucket_name, len(paths)):
+        return dict(zip(paths, _run_concurrently(read, paths)))
+
+
+@_requires_aws
+def write_many(bucket_name, values, public=False, content_type='application/octet-stream', content_encoding=None):
+    """ Write several objects to a bucket concurrently.
+    :param bucket_name: The bucket to write to
+    :param values: A dictionary of key -> str or bytes
+    :param content_encoding: The Content-Encoding to store every object with, if any
+    """
+    bucket_n = _buckets[bucket_name]
     extra_args = {'ContentType': content_type}
     if public and _buckets.supports_acl:
         extra_args['ACL'] = 'public-read'
-    
-    if download_filename is not None:
-        extra_args['ContentDisposition'] = 'attachment;filename="%s"' % download_filename.replace(' ', '_')
-    
-    _buckets.s3.upload_file(src_path, bucket_n, dest_path, ExtraArgs=extra_args)
+    if content_encoding is not None:
+        extra_args['ContentEncoding'] = content_encoding
+
+    def write(item):
+        path, value = item
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        with _timed('put', bucket_name):
+            _buckets.s3.put_object(Bucket=bucket_n, Key=path, Body=value, **extra_args)
+
+    with _timed('put_many', bucket_name, len(values)):
+        _run_concurrently(write, values.items())
+
+
+@_requires_aws
+def delete_many(bucket_name, paths):
+    """ Delete several objects from a bucket using batched DeleteObjects requests.
+    :param bucket_name: The bucket to delete from
+    :param paths: An iterable of object keys
+    :return: A list of keys which could not be deleted
+    """
+    bucket_n = _buckets[bucket_name]
+    paths = list(dict.fromkeys(paths))
+    batches = [paths[i:i + DELETE_BATCH_SIZE] for i in range(0, len(paths), DELETE_BATCH_SIZE)]
+
+    def delete(batch):
+        with _timed('delete_objects', bucket_name, len(batch)):
+            response = _buckets.s3.delete_objects(Bucket=bucket_n, Delete={
+                'Objects': [{'Key': path} for path in batch],
+                'Quiet': True
+            })
+        return [error['Key'] for error in response.get('Errors', [])]
+
+    with _timed('delete_many', bucket_name, len(paths)):
+        failed = [path for errors in _run_concurrently(delete, batches) for path in errors]
+    if failed:
+        logger.warning("Failed to delete %d objects from %s", len(failed), bucket_name)
+    return failed
+
+
+@_requires_aws
+def list_files(bucket_name, prefix=''):
+    """ Iterate over the objects in a bucket whose keys start with prefix, a page of up to 1000 at a time.
+    :return: A generator of (key, last modified time) tuples
+    """
+    bucket_n = _buckets[bucket_name]
+    paginator = _buckets.s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_n, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            yield obj['Key'], obj['LastModified']
+
+
+@_requires_aws
+def get_presigned_post(bucket_name, path, max_size, expires_in=3600):
+    """ Create a presigned POST which lets a browser upload up to max_size bytes directly to path.
+    :return: A dictionary with the 'url' to POST to and the form 'fields' to send along with the file
+    """
+    bucket_n = _buckets[bucket_name]
+    return _buckets.s3.generate_presigned_post(
+        Bucket=bucket_n,
+        Key=path,
+        Conditions=[['content-length-range', 1, max_size]],
+        ExpiresIn=expires_in
+    )
 
 
 @_requires_aws
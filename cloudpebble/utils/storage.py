@@ -0,0 +1,546 @@
+"""
+Storage backends for source files, build artifacts and exports.
+
+Objects are addressed by a bucket name ('source', 'builds' or 'export') and a key within it. settings.STORAGE_BACKEND
+selects the implementation, defaulting to 's3' if AWS_ENABLED is set and 'local' otherwise:
+    's3'     - S3 or an S3-compatible service, through utils.s3
+    'local'  - the local filesystem, with the source, builds and export buckets in FILE_STORAGE, MEDIA_ROOT and
+                 EXPORT_DIRECTORY unless LOCAL_STORAGE_ROOTS says otherwise
+    'memory' - a dictionary in this process, for tests and benchmarks
+
+Use get_storage() to get the configured backend.
+
+Text objects can be gzip-compressed at rest, configured per kind of object by settings.STORAGE_COMPRESSION. Use
+encode() when writing such an object and decode() when reading it back. Compressed objects are plain gzip streams,
+which S3 is told about through their Content-Encoding so that browsers can decode them directly. Text is never
+mistaken for gzip, since valid UTF-8 cannot begin with the gzip magic number; objects written before compression was
+enabled are therefore still read correctly.
+"""
+import gzip
+import io
+import mmap
+import os
+import shutil
+import threading
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+import utils.s3 as s3
+
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+STREAM_CHUNK_SIZE = 64 * 1024
+# How much Storage.open() reads from S3 at once.
+OPEN_BUFFER_SIZE = 1024 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class ObjectNotFound(Exception):
+    pass
+
+
+def compression_for(kind):
+    """ :return: The encoding objects of the given kind are stored with, or None if they are stored as-is """
+    return settings.STORAGE_COMPRESSION.get(kind)
+
+
+def encode(data, kind):
+    """ Prepare an object of the given kind for storage.
+    :param data: The object's contents, as bytes or a string (stored as UTF-8)
+    :return: A tuple of (bytes to store, content encoding or None)
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if compression_for(kind) == 'gzip':
+        # A fixed mtime keeps the output deterministic for identical inputs.
+        return gzip.compress(data, mtime=0), 'gzip'
+    return data, None
+
+
+def is_encoded(data):
+    return data[:2] == GZIP_MAGIC
+
+
+def decode(data):
+    """ Reverse encode(), passing through objects which were stored uncompressed. Only use this on kinds of object
+    which may be compressed; arbitrary binary data could begin with the gzip magic number. """
+    if is_encoded(data):
+        return gzip.decompress(data)
+    return data
+
+
+class ChunkReader(io.RawIOBase):
+    """ A read-only file-like object over an iterable of byte strings, for uploading generated data without
+    collecting it all first. """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            try:
+                self._pending = next(self._chunks)
+            except StopIteration:
+                return 0
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+class RangeReader(io.RawIOBase):
+    """ A seekable read-only file over an S3 object, fetching each read with a ranged GET. Wrap it in an
+    io.BufferedReader so that small reads are served from larger fetches. """
+
+    def __init__(self, bucket_name, key, size):
+        self.bucket_name = bucket_name
+        self.key = key
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def readinto(self, buffer):
+        end = min(self.position + len(buffer), self.size)
+        if end <= self.position:
+            return 0
+        body = s3.open_file(self.bucket_name, self.key, byte_range='bytes=%d-%d' % (self.position, end - 1))['Body']
+        try:
+            data = body.read()
+        finally:
+            body.close()
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+class Storage(object):
+    """ The interface every storage backend implements. """
+
+    # True if objects are files on the local filesystem, which local_path() will return.
+    is_local = False
+
+    def read(self, bucket_name, key):
+        """ :return: The object's contents, as bytes
+        :raises ObjectNotFound: if there is no such object """
+        raise NotImplementedError
+
+    def read_many(self, bucket_name, keys):
+        """ :return: A dictionary of key -> contents
+        :raises ObjectNotFound: if any object is missing """
+        return {key: self.read(bucket_name, key) for key in keys}
+
+    def size(self, bucket_name, key):
+        """ :return: The size of the object in bytes, as stored
+        :raises ObjectNotFound: if there is no such object """
+        return len(self.read(bucket_name, key))
+
+    def write(self, bucket_name, key, data, public=False, content_type=DEFAULT_CONTENT_TYPE, download_filename=None,
+              content_encoding=None):
+        """ Store data, which may be bytes or a string (stored as UTF-8).
+        :param content_encoding: The encoding data is already in, if any, as returned by encode() """
+        raise NotImplementedError
+
+    def write_many(self, bucket_name, values, public=False, content_type=DEFAULT_CONTENT_TYPE, content_encoding=None):
+        """ :param values: A dictionary of key -> data
+        :param content_encoding: The encoding every value is already in, if any """
+        for key, data in values.items():
+            self.write(bucket_name, key, data, public=public, content_type=content_type,
+                       content_encoding=content_encoding)
+
+    def upload(self, bucket_name, key, src_path, public=False, content_type=DEFAULT_CONTENT_TYPE,
+               download_filename=None, progress=None):
+        """ Store the contents of a local file.
+        :param progress: If given, called (possibly from other threads) with the number of bytes stored since the
+        last call """
+        with open(src_path, 'rb') as f:
+            self.upload_stream(bucket_name, key, iter(lambda: f.read(STREAM_CHUNK_SIZE), b''), public=public,
+                               content_type=content_type, download_filename=download_filename, progress=progress)
+
+    def upload_stream(self, bucket_name, key, chunks, public=False, content_type=DEFAULT_CONTENT_TYPE,
+                      download_filename=None, progress=None):
+        """ Store data produced by an iterable of byte strings, such as a generator.
+        :param progress: As for upload() """
+        data = b''.join(chunks)
+        self.write(bucket_name, key, data, public=public, content_type=content_type,
+                   download_filename=download_filename)
+        if progress is not None:
+            progress(len(data))
+
+    def download(self, bucket_name, key, destination):
+        """ Copy an object to a local file. """
+        with open(destination, 'wb') as f:
+            f.write(self.read(bucket_name, key))
+
+    def download_many(self, bucket_name, keys_and_destinations):
+        """ Copy several objects to local files.
+        :param keys_and_destinations: An iterable of (key, local path) tuples """
+        keys_and_destinations = list(keys_and_destinations)
+        contents = self.read_many(bucket_name, {key for key, destination in keys_and_destinations})
+        for key, destination in keys_and_destinations:
+            with open(destination, 'wb') as f:
+                f.write(contents[key])
+
+    def copy(self, bucket_name, src_key, dest_key):
+        """ Copy an object within a bucket. """
+        self.write(bucket_name, dest_key, self.read(bucket_name, src_key))
+
+    def stream(self, bucket_name, key, start=0, end=None):
+        """ Iterate over an object's contents in chunks, without holding all of it in memory where possible.
+        :param start: The first byte to return
+        :param end: The last byte to return (inclusive), or None to read to the end """
+        data = self.read(bucket_name, key)
+        stop = len(data) if end is None else min(end + 1, len(data))
+        for offset in range(start, stop, STREAM_CHUNK_SIZE):
+            yield data[offset:min(offset + STREAM_CHUNK_SIZE, stop)]
+
+    def open(self, bucket_name, key):
+        """ Open an object for reading, without necessarily fetching all of it.
+        :return: A seekable binary file object """
+        return io.BytesIO(self.read(bucket_name, key))
+
+    def delete(self, bucket_name, key):
+        """ Delete an object. Deleting a missing object is not an error. """
+        raise NotImplementedError
+
+    def delete_many(self, bucket_name, keys):
+        """ :return: A list of keys which could not be deleted """
+        for key in keys:
+            self.delete(bucket_name, key)
+        return []
+
+    def list(self, bucket_name, prefix=''):
+        """ Iterate over the objects whose keys start with prefix.
+        :return: An iterable of (key, last modified time) tuples, with timezone-aware times """
+        raise NotImplementedError
+
+    def signed_url(self, bucket_name, key, headers=None):
+        """ :return: A time-limited URL for fetching the object directly, or None if the backend has no such thing """
+        return None
+
+    def presigned_upload(self, bucket_name, key, max_size, expires_in=3600):
+        """ :return: A dictionary with a 'url' and form 'fields' which let a browser POST a file of up to max_size
+        bytes directly to key, or None if the backend can't accept uploads that way """
+        return None
+
+    def local_path(self, bucket_name, key):
+        """ :return: The object's path on the local filesystem, or None if it isn't stored there """
+        return None
+
+
+class S3Storage(Storage):
+    @staticmethod
+    def _is_missing(error):
+        return error.response['Error']['Code'] in ('NoSuchKey', '404', 'NotFound')
+
+    def read(self, bucket_name, key):
+        try:
+            return s3.read_file(bucket_name, key)
+        except ClientError as e:
+            if self._is_missing(e):
+                raise ObjectNotFound(key)
+            raise
+
+    def read_many(self, bucket_name, keys):
+        try:
+            return s3.read_many(bucket_name, keys)
+        except ClientError as e:
+            if self._is_missing(e):
+                raise ObjectNotFound()
+            raise
+
+    def size(self, bucket_name, key):
+        try:
+            return s3.head_file(bucket_name, key)['ContentLength']
+        except ClientError as e:
+            if self._is_missing(e):
+                raise ObjectNotFound(key)
+            raise
+
+    def write(self, bucket_name, key, data, public=False, content_type=DEFAULT_CONTENT_TYPE, download_filename=None,
+              content_encoding=None):
+        s3.save_file(bucket_name, key, data, public=public, content_type=content_type,
+                     content_encoding=content_encoding)
+
+    def write_many(self, bucket_name, values, public=False, content_type=DEFAULT_CONTENT_TYPE, content_encoding=None):
+        s3.write_many(bucket_name, values, public=public, content_type=content_type,
+                      content_encoding=content_encoding)
+
+    def upload(self, bucket_name, key, src_path, public=False, content_type=DEFAULT_CONTENT_TYPE,
+               download_filename=None, progress=None):
+        s3.upload_file(bucket_name, key, src_path, public=public, content_type=content_type,
+                       download_filename=download_filename, progress=progress)
+
+    def upload_stream(self, bucket_name, key, chunks, public=False, content_type=DEFAULT_CONTENT_TYPE,
+                      download_filename=None, progress=None):
+        s3.upload_fileobj(bucket_name, key, ChunkReader(chunks), public=public, content_type=content_type,
+                          download_filename=download_filename, progress=progress)
+
+    def download(self, bucket_name, key, destination):
+        s3.read_file_to_filesystem(bucket_name, key, destination)
+
+    def copy(self, bucket_name, src_key, dest_key):
+        s3.copy_file(bucket_name, src_key, dest_key)
+
+    def stream(self, bucket_name, key, start=0, end=None):
+        byte_range = None
+        if start or end is not None:
+            byte_range = 'bytes=%d-%s' % (start, '' if end is None else end)
+        body = s3.open_file(bucket_name, key, byte_range=byte_range)['Body']
+        try:
+            for chunk in body.iter_chunks(STREAM_CHUNK_SIZE):
+                yield chunk
+        finally:
+            body.close()
+
+    def open(self, bucket_name, key):
+        try:
+            size = s3.head_file(bucket_name, key)['ContentLength']
+        except ClientError as e:
+            if self._is_missing(e):
+                raise ObjectNotFound(key)
+            raise
+        return io.BufferedReader(RangeReader(bucket_name, key, size), buffer_size=OPEN_BUFFER_SIZE)
+
+    def delete(self, bucket_name, key):
+        s3.delete_file(bucket_name, key)
+
+    def delete_many(self, bucket_name, keys):
+        return s3.delete_many(bucket_name, keys)
+
+    def list(self, bucket_name, prefix=''):
+        return s3.list_files(bucket_name, prefix)
+
+    def signed_url(self, bucket_name, key, headers=None):
+        return s3.get_signed_url(bucket_name, key, headers=headers)
+
+    def presigned_upload(self, bucket_name, key, max_size, expires_in=3600):
+        return s3.get_presigned_post(bucket_name, key, max_size, expires_in=expires_in)
+
+
+class LocalStorage(Storage):
+    """ Stores each bucket in a directory. Objects are streamed from a memory map and copied with
+    shutil.copyfile (which uses sendfile where available), so large files are never read into memory whole. """
+    is_local = True
+
+    def __init__(self, roots):
+        self.roots = {name: os.path.abspath(root) for name, root in roots.items()}
+
+    def local_path(self, bucket_name, key):
+        root = self.roots[bucket_name]
+        path = os.path.abspath(os.path.join(root, key))
+        if not path.startswith(root + os.sep):
+            raise ObjectNotFound(key)
+        return path
+
+    def read(self, bucket_name, key):
+        try:
+            with open(self.local_path(bucket_name, key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+
+    def size(self, bucket_name, key):
+        try:
+            return os.path.getsize(self.local_path(bucket_name, key))
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+
+    def _prepare(self, bucket_name, key):
+        path = self.local_path(bucket_name, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def write(self, bucket_name, key, data, public=False, content_type=DEFAULT_CONTENT_TYPE, download_filename=None,
+              content_encoding=None):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        path = self._prepare(bucket_name, key)
+        with open(path, 'wb') as f:
+            f.write(data)
+        if public:
+            os.chmod(path, 0o644)
+
+    def upload(self, bucket_name, key, src_path, public=False, content_type=DEFAULT_CONTENT_TYPE,
+               download_filename=None, progress=None):
+        path = self._prepare(bucket_name, key)
+        # copyfile uses sendfile where the OS supports it.
+        shutil.copyfile(src_path, path)
+        if public:
+            os.chmod(path, 0o644)
+        if progress is not None:
+            progress(os.path.getsize(path))
+
+    def upload_stream(self, bucket_name, key, chunks, public=False, content_type=DEFAULT_CONTENT_TYPE,
+                      download_filename=None, progress=None):
+        path = self._prepare(bucket_name, key)
+        with open(path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                if progress is not None:
+                    progress(len(chunk))
+        if public:
+            os.chmod(path, 0o644)
+
+    def download(self, bucket_name, key, destination):
+        try:
+            shutil.copyfile(self.local_path(bucket_name, key), destination)
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+
+    def open(self, bucket_name, key):
+        try:
+            return open(self.local_path(bucket_name, key), 'rb')
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+
+    def download_many(self, bucket_name, keys_and_destinations):
+        for key, destination in keys_and_destinations:
+            self.download(bucket_name, key, destination)
+
+    def copy(self, bucket_name, src_key, dest_key):
+        try:
+            shutil.copyfile(self.local_path(bucket_name, src_key), self._prepare(bucket_name, dest_key))
+        except FileNotFoundError:
+            raise ObjectNotFound(src_key)
+
+    def stream(self, bucket_name, key, start=0, end=None):
+        try:
+            f = open(self.local_path(bucket_name, key), 'rb')
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+        return self._stream_file(f, start, end)
+
+    @staticmethod
+    def _stream_file(f, start, end):
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            stop = size if end is None else min(end + 1, size)
+            if stop <= start:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                # Slicing copies just the chunk out of the page cache; nothing else is read.
+                for offset in range(start, stop, STREAM_CHUNK_SIZE):
+                    yield mapped[offset:min(offset + STREAM_CHUNK_SIZE, stop)]
+
+    def delete(self, bucket_name, key):
+        try:
+            os.unlink(self.local_path(bucket_name, key))
+        except OSError:
+            pass
+
+    def list(self, bucket_name, prefix=''):
+        root = self.roots[bucket_name]
+        # Only walk the directory the prefix is in.
+        top = os.path.join(root, os.path.dirname(prefix))
+        for directory, subdirectories, files in os.walk(top):
+            for name in files:
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    yield key, datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc)
+
+
+class MemoryStorage(Storage):
+    """ Keeps everything in a dictionary of (bucket name, key) -> bytes. """
+
+    def __init__(self):
+        self.objects = {}
+        self.modified = {}
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.objects = {}
+            self.modified = {}
+
+    def read(self, bucket_name, key):
+        try:
+            return self.objects[(bucket_name, key)]
+        except KeyError:
+            raise ObjectNotFound(key)
+
+    def size(self, bucket_name, key):
+        try:
+            return len(self.objects[(bucket_name, key)])
+        except KeyError:
+            raise ObjectNotFound(key)
+
+    def write(self, bucket_name, key, data, public=False, content_type=DEFAULT_CONTENT_TYPE, download_filename=None,
+              content_encoding=None):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with self.lock:
+            self.objects[(bucket_name, key)] = bytes(data)
+            self.modified[(bucket_name, key)] = datetime.now(timezone.utc)
+
+    def delete(self, bucket_name, key):
+        with self.lock:
+            self.objects.pop((bucket_name, key), None)
+            self.modified.pop((bucket_name, key), None)
+
+    def list(self, bucket_name, prefix=''):
+        with self.lock:
+            return [(key, self.modified[(bucket, key)]) for bucket, key in self.objects
+                    if bucket == bucket_name and key.startswith(prefix)]
+
+    def keys(self, bucket_name):
+        return [key for bucket, key in self.objects if bucket == bucket_name]
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """ Get the storage backend selected by settings.STORAGE_BACKEND. """
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = _make_storage(settings.STORAGE_BACKEND or ('s3' if settings.AWS_ENABLED else 'local'))
+    return _storage
+
+
+def _make_storage(name):
+    if name == 's3':
+        return S3Storage()
+    if name == 'local':
+        return LocalStorage(settings.LOCAL_STORAGE_ROOTS or {
+            'source': settings.FILE_STORAGE,
+            'builds': settings.MEDIA_ROOT,
+            'export': settings.EXPORT_DIRECTORY
+        })
+    if name == 'memory':
+        return MemoryStorage()
+    raise ValueError("Unknown storage backend '%s'" % name)
+
+
+@receiver(setting_changed)
+def _reset_storage(setting, **kwargs):
+    global _storage
+    if setting in ('STORAGE_BACKEND', 'LOCAL_STORAGE_ROOTS', 'AWS_ENABLED', 'FILE_STORAGE', 'MEDIA_ROOT',
+                   'EXPORT_DIRECTORY'):
+        _storage = None